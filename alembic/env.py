@@ -10,6 +10,7 @@ sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..'
 from src.core.database import Base
 from src.models.source_documents import SourceDocument
 from src.models.chunks import Chunk
+from src.models.embedding_models import EmbeddingModel, ChunkEmbedding, DocumentCentroid
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
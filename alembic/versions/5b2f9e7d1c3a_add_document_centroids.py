@@ -0,0 +1,39 @@
+"""Add per-document centroid embeddings for routing
+
+Revision ID: 5b2f9e7d1c3a
+Revises: 07d53b483c11
+Create Date: 2025-10-20 09:12:31.402118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import pgvector.sqlalchemy
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2f9e7d1c3a'
+down_revision: Union[str, Sequence[str], None] = '07d53b483c11'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('source_documents', sa.Column('centroid', pgvector.sqlalchemy.vector.VECTOR(dim=1024), nullable=True))
+    # Backfill documents that were ingested before centroids existed.
+    op.execute("""
+        UPDATE source_documents sd
+        SET centroid = sub.centroid
+        FROM (
+            SELECT source_doc_id, avg(embedding) AS centroid
+            FROM chunks
+            GROUP BY source_doc_id
+        ) sub
+        WHERE sd.id = sub.source_doc_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('source_documents', 'centroid')
@@ -0,0 +1,44 @@
+"""Cascade chunk foreign keys and index them for set-based deletes
+
+Revision ID: 8d41c6a0e2b7
+Revises: 5b2f9e7d1c3a
+Create Date: 2025-10-21 14:03:55.718240
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41c6a0e2b7'
+down_revision: Union[str, Sequence[str], None] = '5b2f9e7d1c3a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.drop_constraint('chunks_source_doc_id_fkey', 'chunks', type_='foreignkey')
+    op.drop_constraint('chunks_parent_id_fkey', 'chunks', type_='foreignkey')
+    op.create_foreign_key(
+        'chunks_source_doc_id_fkey', 'chunks', 'source_documents',
+        ['source_doc_id'], ['id'], ondelete='CASCADE'
+    )
+    op.create_foreign_key(
+        'chunks_parent_id_fkey', 'chunks', 'chunks',
+        ['parent_id'], ['id'], ondelete='CASCADE'
+    )
+    # Without these every cascaded row would trigger a sequential scan of chunks.
+    op.create_index(op.f('ix_chunks_source_doc_id'), 'chunks', ['source_doc_id'], unique=False)
+    op.create_index(op.f('ix_chunks_parent_id'), 'chunks', ['parent_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_chunks_parent_id'), table_name='chunks')
+    op.drop_index(op.f('ix_chunks_source_doc_id'), table_name='chunks')
+    op.drop_constraint('chunks_parent_id_fkey', 'chunks', type_='foreignkey')
+    op.drop_constraint('chunks_source_doc_id_fkey', 'chunks', type_='foreignkey')
+    op.create_foreign_key('chunks_source_doc_id_fkey', 'chunks', 'source_documents', ['source_doc_id'], ['id'])
+    op.create_foreign_key('chunks_parent_id_fkey', 'chunks', 'chunks', ['parent_id'], ['id'])
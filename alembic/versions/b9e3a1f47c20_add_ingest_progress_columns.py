@@ -0,0 +1,38 @@
+"""Add ingestion progress columns to source_documents
+
+Revision ID: b9e3a1f47c20
+Revises: 8d41c6a0e2b7
+Create Date: 2025-10-22 10:41:07.265931
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'b9e3a1f47c20'
+down_revision: Union[str, Sequence[str], None] = '8d41c6a0e2b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('source_documents', sa.Column('chunks_embedded', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('source_documents', sa.Column('chunks_written', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('source_documents', sa.Column('stage_timings', sa.JSON(), nullable=True))
+    # Documents ingested before this revision were written in one go.
+    op.execute("""
+        UPDATE source_documents sd
+        SET chunks_embedded = sub.n, chunks_written = sub.n
+        FROM (SELECT source_doc_id, count(*) AS n FROM chunks GROUP BY source_doc_id) sub
+        WHERE sd.id = sub.source_doc_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('source_documents', 'stage_timings')
+    op.drop_column('source_documents', 'chunks_written')
+    op.drop_column('source_documents', 'chunks_embedded')
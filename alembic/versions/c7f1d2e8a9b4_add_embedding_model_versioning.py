@@ -0,0 +1,77 @@
+"""Add embedding model registry and per-model vector side tables
+
+Revision ID: c7f1d2e8a9b4
+Revises: b9e3a1f47c20
+Create Date: 2025-10-24 16:20:43.518302
+
+"""
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import pgvector.sqlalchemy
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7f1d2e8a9b4'
+down_revision: Union[str, Sequence[str], None] = 'b9e3a1f47c20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    status = sa.Enum('BUILDING', 'ACTIVE', 'RETIRED', 'FAILED', name='embeddingmodelstatus')
+    op.create_table('embedding_models',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('dim', sa.Integer(), nullable=False),
+    sa.Column('inline', sa.Boolean(), server_default='false', nullable=False),
+    sa.Column('status', status, nullable=False),
+    sa.Column('chunks_total', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('chunks_done', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('chunks_per_second', sa.Float(), nullable=True),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('activated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('uq_embedding_models_active', 'embedding_models', ['status'], unique=True,
+                    postgresql_where=sa.text("status = 'ACTIVE'"))
+    op.create_table('chunk_embeddings',
+    sa.Column('chunk_id', sa.String(), nullable=False),
+    sa.Column('model_id', sa.Integer(), nullable=False),
+    sa.Column('embedding', pgvector.sqlalchemy.vector.VECTOR(), nullable=False),
+    sa.ForeignKeyConstraint(['chunk_id'], ['chunks.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['model_id'], ['embedding_models.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('chunk_id', 'model_id')
+    )
+    op.create_index(op.f('ix_chunk_embeddings_model_id'), 'chunk_embeddings', ['model_id'], unique=False)
+    op.create_table('document_centroids',
+    sa.Column('source_doc_id', sa.Integer(), nullable=False),
+    sa.Column('model_id', sa.Integer(), nullable=False),
+    sa.Column('centroid', pgvector.sqlalchemy.vector.VECTOR(), nullable=False),
+    sa.ForeignKeyConstraint(['source_doc_id'], ['source_documents.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['model_id'], ['embedding_models.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('source_doc_id', 'model_id')
+    )
+    # Chunks ingested while a side-table model is active have no inline vector.
+    op.alter_column('chunks', 'embedding', existing_type=pgvector.sqlalchemy.vector.VECTOR(dim=1024), nullable=True)
+    # Register the model the existing corpus was embedded with as the active, inline one.
+    op.execute(sa.text("""
+        INSERT INTO embedding_models (name, dim, inline, status, chunks_total, chunks_done, created_at, activated_at)
+        SELECT :name, 1024, true, 'ACTIVE', count(*), count(*), now(), now() FROM chunks
+    """).bindparams(name=os.getenv('EMBEDDING_MODEL') or 'legacy'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # The old NOT NULL column cannot hold chunks that only have side-table vectors.
+    op.execute("DELETE FROM chunks WHERE embedding IS NULL")
+    op.alter_column('chunks', 'embedding', existing_type=pgvector.sqlalchemy.vector.VECTOR(dim=1024), nullable=False)
+    op.drop_table('document_centroids')
+    op.drop_index(op.f('ix_chunk_embeddings_model_id'), table_name='chunk_embeddings')
+    op.drop_table('chunk_embeddings')
+    op.drop_index('uq_embedding_models_active', table_name='embedding_models')
+    op.drop_table('embedding_models')
+    sa.Enum(name='embeddingmodelstatus').drop(op.get_bind(), checkfirst=False)
@@ -0,0 +1,31 @@
+"""Add content hash and format to source_documents for uploads
+
+Revision ID: d3a8f5b61e07
+Revises: c7f1d2e8a9b4
+Create Date: 2025-11-14 09:12:44.518203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3a8f5b61e07'
+down_revision: Union[str, Sequence[str], None] = 'c7f1d2e8a9b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('source_documents', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.add_column('source_documents', sa.Column('format', sa.String(), nullable=True))
+    op.create_index(op.f('ix_source_documents_content_hash'), 'source_documents', ['content_hash'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_source_documents_content_hash'), table_name='source_documents')
+    op.drop_column('source_documents', 'format')
+    op.drop_column('source_documents', 'content_hash')
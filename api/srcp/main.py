@@ -1,12 +1,25 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Tuple, Optional
 import sys
 import os
+import json
 
 from src.rag.pipeline import RAG
+from src.rag.rerank_cache import RERANK_CACHE
+from src.rag.scheduler import Overloaded
+from src.rag.sessions import new_session_id
+from src.core.database import pool_stats
+from src.core.metrics import PoolCollector, register_collector, render_metrics
+from src.core.tracing import setup_tracing, tracer, traced
 from src.workers.celery_app import celery_app
-from src.workers.tasks import  process_document_task, delete_document_task
+from src.workers.status import task_status, document_status, documents_status, embedding_models_status
+from src.workers.tasks import  start_ingest, delete_document_task, delete_documents_batch_task, ingest_batch, batch_progress, reembed_corpus_task
+from src.workers.reembed import activate_model
+from src.load import SUPPORTED_FORMATS
+from src.models.source_documents import IngestStatus
+from .uploads import UploadTooLarge, receive_upload, find_existing
 
 
 app = FastAPI(
@@ -15,7 +28,9 @@ app = FastAPI(
     version = "1.0.0"
 )
 
+setup_tracing("rag-api")
 rag_pipeline = RAG()
+register_collector(PoolCollector())
 
 class IngestRequest(BaseModel):
     file_name: str
@@ -25,6 +40,23 @@ class IngestResponse(BaseModel):
     message: str
     task_id: str
 
+class UploadResponse(BaseModel):
+    message: str
+    media_id: int
+    content_hash: str
+    size: int
+    duplicate: bool
+    task_id: Optional[str] = None
+
+class IngestBatchRequest(BaseModel):
+    documents: List[IngestRequest]
+
+class IngestBatchResponse(BaseModel):
+    message: str
+    batch_id: str
+    task_id: str
+    total: int
+
 class DeleteRequest(BaseModel):
     media_id: int
 
@@ -32,22 +64,68 @@ class DeleteResponse(BaseModel):
     message: str
     task_id: str
 
+class BatchDeleteRequest(BaseModel):
+    media_ids: List[int]
+
+class DocumentsStatusRequest(BaseModel):
+    media_ids: List[int]
+
 class ChatRequest(BaseModel):
     question: str
     media_id: Optional[int] = None
+    media_ids: List[int] = []
     history: List[Tuple[str, str]] = []
+    session_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     answer: str
     history: List[Tuple[str, str]]
+    session_id: Optional[str] = None
+    stats: Optional[dict] = None
+
+class ChatBatchRequest(BaseModel):
+    questions: List[str]
+    media_id: Optional[int] = None
+    media_ids: List[int] = []
+    threshold: int = 7
+    concurrency: Optional[int] = None
+
+class EmbeddingModelRequest(BaseModel):
+    name: str
+    batch_size: int = 256
+    activate: bool = False
+
+class SessionResponse(BaseModel):
+    session_id: str
+    history: List[Tuple[str, str]] = []
+
+@app.middleware("http")
+async def trace_requests(request : Request, call_next):
+    with tracer.start_as_current_span(f"{request.method} {request.url.path}") as span:
+        response = await call_next(request)
+        span.set_attribute("http.status_code", response.status_code)
+        return response
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the RAG API"}
 
+@app.get("/metrics", summary="Prometheus metrics")
+def get_metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/metrics/pool", summary="DB connection pool usage")
+def get_pool_stats():
+    return pool_stats()
+
+@app.get("/metrics/rerank-cache", summary="Reranker score cache usage")
+def get_rerank_cache_stats():
+    return RERANK_CACHE.stats()
+
 @app.post("/ingest", response_model = IngestResponse, summary="Import documents")
 def ingest_document(request : IngestRequest):
-    task = process_document_task.delay(
+    task = start_ingest(
         file_name = request.file_name,
         media_id = request.media_id
     )
@@ -56,19 +134,164 @@ def ingest_document(request : IngestRequest):
         "task_id" : task.id
     }
 
+@app.post("/ingest/upload", response_model = UploadResponse, summary="Upload and import a document")
+async def ingest_upload(request : Request, media_id : int, format : Optional[str] = None, file_name : Optional[str] = None):
+    if format is not None and format.lower() not in SUPPORTED_FORMATS:
+        raise HTTPException(status_code=415, detail=f"Unsupported format {format}")
+    try:
+        upload = await receive_upload(request)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    stem, extension = os.path.splitext(upload.filename or "")
+    format = (format or extension.lstrip(".") or "pdf").lower()
+    if format not in SUPPORTED_FORMATS:
+        raise HTTPException(status_code=415, detail=f"Unsupported format {format}")
+    stored = upload.stored
+    existing = await find_existing(stored.content_hash, media_id)
+    if existing is not None and existing.media_id == media_id and (
+            existing.content_hash != stored.content_hash or existing.status == IngestStatus.FAILED):
+        raise HTTPException(status_code=409, detail=f"Document with M_ID {media_id} already exists; delete it first")
+    if existing is not None:
+        return {
+            "message" : f"Same file already ingested as M_ID {existing.media_id}; skipped.",
+            "media_id" : existing.media_id,
+            "content_hash" : stored.content_hash,
+            "size" : stored.size,
+            "duplicate" : True
+        }
+    task = start_ingest(
+        file_name = file_name or stem or stored.content_hash,
+        media_id = media_id,
+        format = format,
+        content_hash = stored.content_hash
+    )
+    return {
+        "message" : "Document ingestion started.",
+        "media_id" : media_id,
+        "content_hash" : stored.content_hash,
+        "size" : stored.size,
+        "duplicate" : False,
+        "task_id" : task.id
+    }
+
+@app.post("/ingest/batch", response_model = IngestBatchResponse, summary="Import many documents")
+def ingest_documents_batch(request : IngestBatchRequest):
+    if not request.documents:
+        raise HTTPException(status_code=422, detail="documents must not be empty")
+    media_ids = [d.media_id for d in request.documents]
+    if len(set(media_ids)) != len(media_ids):
+        raise HTTPException(status_code=422, detail="media_ids must be unique within a batch")
+    group_result, callback = ingest_batch([d.model_dump() for d in request.documents])
+    return {
+        "message" : f"Batch ingestion of {len(request.documents)} documents started.",
+        "batch_id" : group_result.id,
+        "task_id" : callback.id,
+        "total" : len(request.documents)
+    }
+
+@app.get("/ingest/batch/{batch_id}", summary="Batch ingestion progress")
+def ingest_batch_progress(batch_id : str):
+    progress = batch_progress(batch_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Unknown batch_id")
+    return progress
+
+@app.post("/embedding-models", response_model = IngestResponse, summary="Re-embed the corpus with another model")
+def create_embedding_model(request : EmbeddingModelRequest):
+    if request.batch_size < 1:
+        raise HTTPException(status_code=422, detail="batch_size must be positive")
+    task = reembed_corpus_task.delay(model_name = request.name, batch_size = request.batch_size, activate = request.activate)
+    return {
+        "message" : f"Re-embedding into {request.name} started.",
+        "task_id" : task.id
+    }
+
+@app.get("/embedding-models", summary="Embedding models and re-embedding progress")
+async def list_embedding_models():
+    return {"models" : await embedding_models_status()}
+
+@app.post("/embedding-models/{model_id}/activate", summary="Switch retrieval to an embedding model")
+def activate_embedding_model(model_id : int):
+    try:
+        return activate_model(model_id, catch_up = False)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/tasks/{task_id}", summary="Task state and progress")
+def get_task_status(task_id : str):
+    return task_status(task_id)
+
+@app.get("/documents/{media_id}", summary="Document ingestion status")
+async def get_document_status(media_id : int):
+    status = await document_status(media_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Document with M_ID {media_id} not found")
+    return status
+
+@app.post("/documents/status", summary="Ingestion status of many documents")
+async def get_documents_status(request : DocumentsStatusRequest):
+    return {"documents" : await documents_status(request.media_ids)}
+
 @app.post("/chat", response_model = ChatResponse, summary = "Chats")
 async def chat_rag(request : ChatRequest):
     try:
-        result = await rag_pipeline.ask(
-            query = request.question,
-            media_id = request.media_id,
-            chat_history = request.history
-        )
+        with traced("chat_rag", **{"chat.media_ids" : request.media_ids or ([request.media_id] if request.media_id else [])}):
+            result = await rag_pipeline.ask(
+                query = request.question,
+                media_id = request.media_id,
+                media_ids = request.media_ids,
+                chat_history = request.history,
+                session_id = request.session_id
+            )
         return result
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After" : str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/chat/batch", summary = "Answers many questions, streamed as JSON lines")
+async def chat_batch(request : ChatBatchRequest):
+    if not request.questions:
+        raise HTTPException(status_code=422, detail="questions must not be empty")
+    if request.concurrency is not None and request.concurrency < 1:
+        raise HTTPException(status_code=422, detail="concurrency must be positive")
+
+    async def lines():
+        async for item in rag_pipeline.ask_batch(
+            request.questions,
+            media_id = request.media_id,
+            media_ids = request.media_ids,
+            threshold = request.threshold,
+            concurrency = request.concurrency
+        ):
+            yield json.dumps(item, ensure_ascii = False) + "\n"
+    return StreamingResponse(lines(), media_type = "application/x-ndjson")
+
+@app.post("/sessions", response_model = SessionResponse, summary = "Starts a chat session")
+def create_session():
+    # Sessions are created lazily on the first /chat turn; this only hands out an id.
+    return {"session_id" : new_session_id()}
+
+@app.get("/sessions/{session_id}", response_model = SessionResponse, summary = "Stored turns of a chat session")
+async def get_session(session_id : str):
+    return {"session_id" : session_id, "history" : await rag_pipeline.sessions.history(session_id)}
+
+@app.delete("/sessions/{session_id}", summary = "Ends a chat session")
+async def delete_session(session_id : str):
+    if not await rag_pipeline.sessions.clear(session_id):
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    return {"message" : f"Session {session_id} deleted."}
     
 @app.delete("/delete", response_model=DeleteResponse, summary="Del documents")
 def delete_document(request: DeleteRequest):
     task = delete_document_task.delay(media_id=request.media_id)
-    return {"message": "Document deletion started.", "task_id": task.id}
\ No newline at end of file
+    return {"message": "Document deletion started.", "task_id": task.id}
+
+@app.delete("/delete/batch", response_model=DeleteResponse, summary="Del many documents")
+def delete_documents_batch(request: BatchDeleteRequest):
+    if not request.media_ids:
+        raise HTTPException(status_code=422, detail="media_ids must not be empty")
+    task = delete_documents_batch_task.delay(media_ids=request.media_ids)
+    return {"message": f"Deletion of {len(request.media_ids)} documents started.", "task_id": task.id}
@@ -0,0 +1,120 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select, or_
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from src.core.database import AsyncSessionLocal
+from src.core.objects import ObjectStore, ObjectWriter, StoredObject
+from src.models.source_documents import SourceDocument, IngestStatus
+
+# 0 disables the limit.
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', 200 * 1024 * 1024))
+UPLOAD_FIELD = b'file'
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+@dataclass
+class Upload:
+    stored : StoredObject
+    filename : Optional[str]
+
+
+async def receive_upload(request : Request, store : Optional[ObjectStore] = None,
+                         max_bytes : int = UPLOAD_MAX_BYTES) -> Upload:
+    """
+    Parses a multipart/form-data body as it arrives and streams its `file` part into the object
+    store, so memory use stays at one network chunk whatever the upload size. Other parts are ignored.
+    The parser callbacks only collect bytes; file writes, fsync and rename run in the threadpool
+    (as Starlette's UploadFile does) so a large upload never blocks the event loop.
+    """
+    content_type, params = parse_options_header(request.headers.get('content-type', ''))
+    if content_type != b'multipart/form-data' or b'boundary' not in params:
+        raise ValueError('Expected a multipart/form-data body with a "file" part')
+    store = store or ObjectStore()
+    state = {'field' : b'', 'value' : b'', 'headers' : {}, 'writer' : None, 'filename' : None}
+    writers = []
+    pending = []
+
+    def on_part_begin():
+        state['headers'] = {}
+        state['writer'] = None
+
+    def on_header_field(data, start, end):
+        state['field'] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state['value'] += data[start:end]
+
+    def on_header_end():
+        state['headers'][state['field'].lower()] = state['value']
+        state['field'], state['value'] = b'', b''
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state['headers'].get(b'content-disposition', b''))
+        if disposition.get(b'name') == UPLOAD_FIELD and not writers:
+            state['writer'] = ObjectWriter(store, max_bytes)
+            writers.append(state['writer'])
+            filename = disposition.get(b'filename')
+            state['filename'] = os.path.basename(filename.decode('utf-8', 'replace')) if filename else None
+
+    def on_part_data(data, start, end):
+        if state['writer'] is not None:
+            pending.append(data[start:end])
+
+    def on_part_end():
+        state['writer'] = None
+
+    parser = MultipartParser(params[b'boundary'], {
+        'on_part_begin' : on_part_begin,
+        'on_header_field' : on_header_field,
+        'on_header_value' : on_header_value,
+        'on_header_end' : on_header_end,
+        'on_headers_finished' : on_headers_finished,
+        'on_part_data' : on_part_data,
+        'on_part_end' : on_part_end,
+    })
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if pending:
+                data = b''.join(pending)
+                pending.clear()
+                await run_in_threadpool(writers[0].write, data)
+        parser.finalize()
+    except ValueError as e:
+        for writer in writers:
+            await run_in_threadpool(writer.abort)
+        if writers and max_bytes and writers[0].size > max_bytes:
+            raise UploadTooLarge(str(e)) from e
+        raise
+    except BaseException:
+        for writer in writers:
+            await run_in_threadpool(writer.abort)
+        raise
+    if not writers:
+        raise ValueError('Multipart body has no "file" part')
+    return Upload(await run_in_threadpool(writers[0].commit), state['filename'])
+
+
+async def find_existing(content_hash : str, media_id : int) -> Optional[SourceDocument]:
+    """
+    The document already registered under `media_id`, or one built from the same bytes that did not fail.
+    A FAILED document with the same hash is not a duplicate: the re-upload retries it under the new media_id,
+    and parse_document deletes the failed row, which holds the same object path.
+    """
+    async with AsyncSessionLocal() as asession:
+        stmt = select(SourceDocument).where(or_(
+            SourceDocument.media_id == media_id,
+            (SourceDocument.content_hash == content_hash) & (SourceDocument.status != IngestStatus.FAILED)
+        )).order_by((SourceDocument.media_id == media_id).desc())
+        return (await asession.execute(stmt)).scalars().first()
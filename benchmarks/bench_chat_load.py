@@ -0,0 +1,93 @@
+"""
+Concurrent /chat load generator. Targets a running API with --url, or runs the FastAPI
+app in-process with Ollama replaced by benchmarks.ollama_stub, so only retrieval, rerank
+and the service overhead are real.
+
+    python -m benchmarks.bench_chat_load --requests 100 --concurrency 16
+    python -m benchmarks.bench_chat_load --url http://localhost:8000 --queries benchmarks/data/queries.jsonl
+"""
+import os
+import time
+import random
+import asyncio
+import argparse
+import urllib.request
+import json
+
+from .common import summarize, write_results
+from .corpus import generate, load_jsonl
+
+
+async def _load(client, queries, n_requests : int, concurrency : int, scoped : bool, seed : int):
+    rng = random.Random(seed)
+    gate = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], {}
+
+    async def one():
+        query = rng.choice(queries)
+        body = {"question" : query["question"], "history" : []}
+        if scoped:
+            body["media_id"] = query["media_id"]
+        async with gate:
+            started = time.perf_counter()
+            try:
+                response = await client.post("/chat", json=body)
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            if status == "200":
+                latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(n_requests)])
+    wall = time.perf_counter() - started
+    return {**summarize(latencies), "throughput_rps" : len(latencies) / wall, "statuses" : statuses}
+
+
+async def _run(args, queries):
+    import httpx
+    timeout = httpx.Timeout(args.timeout)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=timeout) as client:
+            return await _load(client, queries, args.requests, args.concurrency, args.scoped, args.seed)
+    # Imported here so OLLAMA_BASE_URL already points at the stub when the pipeline is built.
+    from api.srcp.main import app
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout) as client:
+        return await _load(client, queries, args.requests, args.concurrency, args.scoped, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent /chat load benchmark.")
+    parser.add_argument("--url", type=str, default=None, help="Running API; omit to serve the app in-process on the stub.")
+    parser.add_argument("--queries", type=str, default=None, help="JSONL query set; defaults to the synthetic one.")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scoped", action="store_true", help="Send the query's media_id with each request.")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--parallel", type=int, default=2, help="Simulated OLLAMA_NUM_PARALLEL.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=str, default=None)
+    args = parser.parse_args()
+
+    queries = load_jsonl(args.queries) if args.queries else generate(10, 12, args.seed)[1]
+    server = None
+    if not args.url:
+        from .ollama_stub import StubModel, serve
+        os.environ["OLLAMA_BASE_URL"] = f"http://127.0.0.1:{args.port}"
+        server = serve(args.port, StubModel(parallel=args.parallel), background=True)
+    try:
+        payload = asyncio.run(_run(args, queries))
+        if server is not None:
+            payload["stub"] = json.loads(urllib.request.urlopen(f"{os.environ['OLLAMA_BASE_URL']}/stats").read())
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    write_results("chat_load", {"params" : vars(args), **payload}, args.out)
+
+
+if __name__ == "__main__":
+    main()
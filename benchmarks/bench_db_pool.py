@@ -0,0 +1,85 @@
+"""
+p50/p99 latency of a retrieval-shaped session (3 sequential queries, as in
+retrieval_and_rerank) against concurrency, using the configured async pool.
+
+    DB_POOL_SIZE=10 DB_MAX_OVERFLOW=10 python -m benchmarks.bench_db_pool --levels 1 8 32 64
+"""
+import time
+import asyncio
+import argparse
+import numpy as np
+
+from .common import summarize, write_results
+
+
+async def _session(query_embedding, k : int):
+    from sqlalchemy import select
+    from src.core.database import AsyncSessionLocal
+    from src.models.chunks import Chunk, ChunkLevel
+    from src.models.source_documents import SourceDocument
+
+    distance = Chunk.embedding.cosine_distance(query_embedding).label('distance')
+    async with AsyncSessionLocal() as asession:
+        media_ids = (await asession.execute(
+            select(SourceDocument.media_id, distance).select_from(Chunk).join(SourceDocument).order_by(distance).limit(20)
+        )).scalars().all()
+        child_ids = (await asession.execute(
+            select(Chunk.parent_id, distance).where(Chunk.chunk_level == ChunkLevel.CHILD)
+            .join(SourceDocument).where(SourceDocument.media_id.in_(list(set(media_ids))[:3]))
+            .order_by(distance).limit(k)
+        )).scalars().all()
+        await asession.execute(select(Chunk).where(Chunk.id.in_([c for c in child_ids if c] or [''])))
+
+
+async def _level(concurrency : int, requests : int, k : int, dim : int, rng):
+    from sqlalchemy.exc import TimeoutError as PoolTimeout
+    gate = asyncio.Semaphore(concurrency)
+    latencies, timeouts, errors = [], 0, 0
+
+    async def one():
+        nonlocal timeouts, errors
+        vector = rng.standard_normal(dim).astype(np.float32)
+        vector /= np.linalg.norm(vector)
+        async with gate:
+            started = time.perf_counter()
+            try:
+                await _session(vector.tolist(), k)
+                latencies.append(time.perf_counter() - started)
+            except PoolTimeout:
+                timeouts += 1
+            except Exception:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(requests)])
+    wall = time.perf_counter() - started
+    return {**summarize(latencies), 'throughput_rps' : len(latencies) / wall, 'pool_timeouts' : timeouts, 'errors' : errors}
+
+
+async def _run(args):
+    from src.core.database import async_engine, pool_stats, POOL_OPTIONS
+    rng = np.random.default_rng(args.seed)
+    results = {}
+    for level in args.levels:
+        results[str(level)] = await _level(level, args.requests, args.k, args.dim, rng)
+        print(f"concurrency={level}: p50={results[str(level)]['p50_ms']:.1f}ms p99={results[str(level)]['p99_ms']:.1f}ms")
+    stats = pool_stats()
+    await async_engine.dispose()
+    return {'pool_options' : POOL_OPTIONS, 'results' : results, 'pool' : stats['async']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DB pool latency vs. concurrency benchmark.")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16, 32, 64])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--k", type=int, default=40)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=str, default=None)
+    args = parser.parse_args()
+    payload = asyncio.run(_run(args))
+    write_results("db_pool", {"params" : vars(args), **payload}, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Embedding handoff from encoder to database, old path against new: peak RSS and chunks/s.
+
+    orm   embed_documents (nested Python lists) -> Chunk ORM objects -> pgvector text literals
+    copy  embed_matrix (one float32 array) -> pgvector binary format -> COPY ... FORMAT binary
+
+Each mode runs in its own process so peak RSS is not shared, and writes inside a transaction
+that is rolled back, so the database is left as it was.
+
+    python -m benchmarks.bench_embed_write --chunks 20000
+    python -m benchmarks.bench_embed_write --chunks 20000 --encoder model --modes copy
+"""
+import sys
+import json
+import time
+import resource
+import argparse
+import subprocess
+from uuid import uuid4
+
+from .common import write_results
+from .corpus import generate
+
+MODES = ("orm", "copy")
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _contents(n_chunks : int, seed : int):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from src.workers.processing import DEFAULT_CHUNKING
+
+    documents, _ = generate(8, 12, seed)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=DEFAULT_CHUNKING.child_size, chunk_overlap=DEFAULT_CHUNKING.child_overlap)
+    passages = [chunk for document in documents for chunk in splitter.split_text('\n'.join(document['pages']))]
+    return [passages[i % len(passages)] for i in range(n_chunks)]
+
+
+def _encode(mode : str, encoder : str, contents, dim : int, seed : int):
+    if encoder == "model":
+        from src.core.embeddings import get_embedding_fn, embed_matrix
+        embedding_fn = get_embedding_fn()
+        return embedding_fn.embed_documents(contents) if mode == "orm" else embed_matrix(embedding_fn, contents)
+    import numpy as np
+    vectors = np.random.default_rng(seed).standard_normal((len(contents), dim), dtype=np.float32)
+    # embed_documents hands back nested lists; that conversion is part of the old path.
+    return vectors.tolist() if mode == "orm" else vectors
+
+
+def _write(mode : str, session, source_doc_id : int, contents, vectors) -> None:
+    from src.models.chunks import Chunk, ChunkLevel
+    if mode == "orm":
+        session.add_all(
+            Chunk(
+                id=str(uuid4()), content=content, chunk_level=ChunkLevel.CHILD, embedding=vector,
+                chunk_metadata={'page' : 0}, source_doc_id=source_doc_id, parent_id=None
+            )
+            for content, vector in zip(contents, vectors)
+        )
+        session.flush()
+        return
+    from src.core.pgcopy import copy_rows, int4_field, json_field, row, text_field, vector_fields
+    from src.workers.processing import CHUNK_COLUMNS
+    doc_field, level_field, metadata_field = int4_field(source_doc_id), text_field(ChunkLevel.CHILD.value), json_field({'page' : 0})
+    copy_rows(session.connection().connection.cursor(), 'chunks', CHUNK_COLUMNS, (
+        row(text_field(str(uuid4())), text_field(content), level_field, metadata_field, vector, doc_field, text_field(None))
+        for content, vector in zip(contents, vector_fields(vectors))
+    ))
+
+
+def _child(args) -> dict:
+    from src.core.database import SessionLocal
+    from src.models.source_documents import SourceDocument, IngestStatus
+
+    contents = _contents(args.chunks, args.seed)
+    if args.encoder == "model":
+        from src.core.embeddings import get_embedding_fn
+        get_embedding_fn().embed_documents(contents[:8])
+    baseline = _peak_rss_mb()
+    started = time.perf_counter()
+    vectors = _encode(args.mode, args.encoder, contents, args.dim, args.seed)
+    encoded = time.perf_counter()
+    with SessionLocal() as session:
+        doc = SourceDocument(
+            media_id=-1, file_name='bench_embed_write', file_path=f'bench_embed_write/{uuid4()}',
+            page_count=0, status=IngestStatus.PROCESSING
+        )
+        session.add(doc)
+        session.flush()
+        _write(args.mode, session, doc.id, contents, vectors)
+        written = time.perf_counter()
+        session.rollback()
+    peak = _peak_rss_mb()
+    return {
+        'chunks' : len(contents),
+        'encode_seconds' : encoded - started,
+        'write_seconds' : written - encoded,
+        'chunks_per_second' : len(contents) / (written - started) if written > started else 0.0,
+        'write_chunks_per_second' : len(contents) / (written - encoded) if written > encoded else 0.0,
+        'baseline_rss_mb' : baseline,
+        'peak_rss_mb' : peak,
+        'peak_rss_growth_mb' : peak - baseline,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak RSS and chunks/s of the ORM and COPY embedding write paths.")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--encoder", choices=["random", "model"], default="random",
+                        help="random isolates the handoff; model includes the embedding model's own cost.")
+    parser.add_argument("--dim", type=int, default=1024, help="Vector width for --encoder random (the chunks column is 1024).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--out", type=str, default=None)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(_child(args)))
+        return
+    results = {}
+    for mode in args.modes:
+        command = [sys.executable, "-m", "benchmarks.bench_embed_write", "--mode", mode, "--chunks", str(args.chunks),
+                   "--encoder", args.encoder, "--dim", str(args.dim), "--seed", str(args.seed)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+    if "orm" in results and "copy" in results:
+        results["copy_vs_orm"] = {
+            'speedup' : results["copy"]['chunks_per_second'] / results["orm"]['chunks_per_second']
+            if results["orm"]['chunks_per_second'] else None,
+            'peak_rss_growth_ratio' : results["copy"]['peak_rss_growth_mb'] / results["orm"]['peak_rss_growth_mb']
+            if results["orm"]['peak_rss_growth_mb'] else None,
+        }
+    write_results("embed_write", {"params" : {k : v for k, v in vars(args).items() if k != "mode"}, "results" : results}, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Ingest throughput on the synthetic corpus: runs parse -> embed -> write in-process
+(the same stage functions the Celery chain uses) and reports per-stage timings.
+
+    python -m benchmarks.bench_ingest --docs 10 --pages 12
+    python -m benchmarks.bench_ingest --docs 10 --keep   # leave documents for bench_retrieval
+"""
+import time
+import argparse
+
+from .common import summarize, write_results
+from .corpus import generate, to_langchain_pages
+
+
+def _ingest(documents):
+    from src.workers.processing import parse_document, embed_chunks, write_chunks
+
+    per_stage = {'parse' : [], 'embed' : [], 'write' : []}
+    pages = chunks = failed = 0
+    started = time.perf_counter()
+    for document in documents:
+        t0 = time.perf_counter()
+        payload = parse_document(document['name'], document['media_id'], docs=to_langchain_pages(document))
+        t1 = time.perf_counter()
+        payload = embed_chunks(payload)
+        t2 = time.perf_counter()
+        result = write_chunks(payload)
+        t3 = time.perf_counter()
+        if result is None:
+            failed += 1
+            continue
+        per_stage['parse'].append(t1 - t0)
+        per_stage['embed'].append(t2 - t1)
+        per_stage['write'].append(t3 - t2)
+        pages += result['pages']
+        chunks += result['chunks']
+    wall = time.perf_counter() - started
+    return {
+        'stages' : {stage : summarize(values) for stage, values in per_stage.items()},
+        'documents' : len(documents) - failed,
+        'failed' : failed,
+        'pages' : pages,
+        'chunks' : chunks,
+        'wall_seconds' : wall,
+        'pages_per_second' : pages / wall if wall else 0.0,
+        'chunks_per_second' : chunks / wall if wall else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest throughput benchmark on the synthetic corpus.")
+    parser.add_argument("--docs", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--first-media-id", type=int, default=900000)
+    parser.add_argument("--keep", action="store_true", help="Keep the ingested documents instead of deleting them.")
+    parser.add_argument("--out", type=str, default=None)
+    args = parser.parse_args()
+
+    from src.workers.delete_documents import delete_documents_bulk
+
+    documents, _ = generate(args.docs, args.pages, args.seed, args.first_media_id)
+    media_ids = [document['media_id'] for document in documents]
+    # Leftovers from an interrupted run would make parse_document skip every document.
+    delete_documents_bulk(media_ids)
+    try:
+        payload = _ingest(documents)
+    finally:
+        if not args.keep:
+            delete_documents_bulk(media_ids)
+    write_results("ingest", {"params" : vars(args), **payload}, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Compares the legacy single-ChatOllama setup against the pooled, per-chain LLM layer
+(src/rag/llm.py) on a local Ollama-compatible stub.
+
+    python -m benchmarks.bench_llm --requests 64 --concurrency 8
+"""
+import os
+import time
+import random
+import asyncio
+import argparse
+import urllib.request
+import json
+
+from .common import summarize, write_results
+from .ollama_stub import StubModel, serve
+
+
+def _legacy_templates():
+    from src.rag.definitions import VI_PROMPT, EN_PROMPT, RELEVANCE_PROMPT
+    # Pre-change layouts: {lang} inside the rules and the query ahead of the context.
+    vi = VI_PROMPT.replace("được ghi ở mục NGÔN NGỮ bên dưới", "tức là {lang}")
+    en = EN_PROMPT.replace("given as LANGUAGE below", "which is {lang}")
+    relevance = RELEVANCE_PROMPT.replace("Context:\n---\n{context}\n---\nQuery: {query}\n",
+                                         "Query: {query}\nContext:\n---\n{context}\n---\n")
+    return {"vi" : vi, "en" : en}, relevance
+
+
+def _build_chains(mode : str):
+    from langchain_core.output_parsers import StrOutputParser, PydanticOutputParser
+    from langchain_core.prompts import PromptTemplate
+    from langchain_ollama import ChatOllama
+    from src.rag.definitions import RelevanceCheck, RELEVANCE_PROMPT, PROMPT_TEMPLATES
+    from src.rag.llm import LLMExecutor, build_llm, MODEL
+
+    parser = PydanticOutputParser(pydantic_object = RelevanceCheck)
+    if mode == "legacy":
+        templates, relevance_template = _legacy_templates()
+        llm = ChatOllama(model = MODEL, base_url = os.environ["OLLAMA_BASE_URL"], num_ctx = 8192, num_predict = 4096)
+        relevance_llm = generation_llm = llm
+        executor = None
+    else:
+        templates, relevance_template = PROMPT_TEMPLATES, RELEVANCE_PROMPT
+        relevance_llm, generation_llm = build_llm("relevance"), build_llm("generation")
+        executor = LLMExecutor()
+    relevance = PromptTemplate(
+        template = relevance_template,
+        input_variables = ["query", "context"],
+        partial_variables = {"format_instructions" : parser.get_format_instructions()},
+    ) | relevance_llm | parser
+    generation = {
+        lang : PromptTemplate.from_template(t) | generation_llm | StrOutputParser()
+        for lang, t in templates.items()
+    }
+    return relevance, generation, executor
+
+
+async def _run(mode : str, n_requests : int, concurrency : int, seed : int):
+    relevance, generation, executor = _build_chains(mode)
+    rng = random.Random(seed)
+    gate = asyncio.Semaphore(concurrency)
+
+    async def call(chain, inputs):
+        if executor is not None:
+            return await executor.ainvoke(chain, inputs)
+        return await chain.ainvoke(inputs)
+
+    async def one(i : int) -> float:
+        lang = rng.choice(["vi", "en"])
+        context = "\n\n---\n\n".join(f"Trang {p}:\n" + "Điều %d. Nội dung quy định. " % p * 30 for p in rng.sample(range(1, 80), 4))
+        question = f"Câu hỏi số {i} về quy định?"
+        async with gate:
+            started = time.perf_counter()
+            await call(relevance, {"query" : question, "context" : context})
+            await call(generation[lang], {"context" : context, "question" : question, "lang" : lang})
+            return time.perf_counter() - started
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*[one(i) for i in range(n_requests)])
+    return list(latencies), time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM layer benchmark against an Ollama stub.")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--parallel", type=int, default=2, help="Simulated OLLAMA_NUM_PARALLEL.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=str, default=None)
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    os.environ["OLLAMA_BASE_URL"] = base_url
+    results = {}
+    for mode in ["legacy", "pooled"]:
+        server = serve(args.port, StubModel(parallel=args.parallel), background=True)
+        latencies, wall = asyncio.run(_run(mode, args.requests, args.concurrency, args.seed))
+        stub_stats = json.loads(urllib.request.urlopen(f"{base_url}/stats").read())
+        server.shutdown()
+        server.server_close()
+        results[mode] = {
+            **summarize(latencies),
+            "throughput_rps" : args.requests / wall,
+            "stub" : stub_stats,
+        }
+    write_results("llm", {"params" : vars(args), "results" : results}, args.out)
+
+
+if __name__ == "__main__":
+    main()
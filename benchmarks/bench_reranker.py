@@ -0,0 +1,126 @@
+"""
+Reranker backends on a fixed pair set: pairs/s, per-request latency and agreement with the first backend.
+
+Pairs come from the seeded synthetic corpus: every query is paired with `--candidates` passages cut at
+the production parent and child chunk sizes (its own document's passages first, then others).
+
+    python -m benchmarks.bench_reranker --backends flag int8 onnx onnx-int8 --max-tokens 384
+"""
+import time
+import random
+import argparse
+from typing import Dict, List, Sequence
+
+from .common import summarize, write_results
+from .corpus import generate
+
+
+def _pair_set(n_docs : int, n_pages : int, seed : int, candidates : int):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from src.workers.processing import DEFAULT_CHUNKING
+
+    documents, queries = generate(n_docs, n_pages, seed)
+    splitters = [
+        RecursiveCharacterTextSplitter(chunk_size=DEFAULT_CHUNKING.parent_size, chunk_overlap=DEFAULT_CHUNKING.parent_overlap),
+        RecursiveCharacterTextSplitter(chunk_size=DEFAULT_CHUNKING.child_size, chunk_overlap=DEFAULT_CHUNKING.child_overlap),
+    ]
+    passages : Dict[int, List[str]] = {}
+    for document in documents:
+        text = '\n'.join(document['pages'])
+        passages[document['media_id']] = [chunk for splitter in splitters for chunk in splitter.split_text(text)]
+    rng = random.Random(seed)
+    everything = [passage for chunks in passages.values() for passage in chunks]
+    requests = []
+    for query in queries:
+        own = passages[query['media_id']][:candidates]
+        others = rng.sample(everything, min(len(everything), candidates - len(own)))
+        requests.append([(query['question'], passage) for passage in own + others])
+    return requests
+
+
+def _ranks(scores : Sequence[float]) -> List[int]:
+    order = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+    ranks = [0] * len(scores)
+    for rank, i in enumerate(order):
+        ranks[i] = rank
+    return ranks
+
+
+def _spearman(a : Sequence[float], b : Sequence[float]) -> float:
+    n = len(a)
+    if n < 2:
+        return 1.0
+    ra, rb = _ranks(a), _ranks(b)
+    return 1 - 6 * sum((x - y) ** 2 for x, y in zip(ra, rb)) / (n * (n * n - 1))
+
+
+def _top_overlap(a : Sequence[float], b : Sequence[float], k : int) -> float:
+    top = lambda scores: set(sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k])
+    return len(top(a) & top(b)) / min(k, len(a)) if a else 1.0
+
+
+def _run(backends : List[str], requests, max_tokens : int, batch_size : int, repeat : int, top_k : int):
+    from src.rag.rerankers import load_reranker, resolve_backend
+
+    results, reference = {}, None
+    for backend in backends:
+        name = resolve_backend(backend)
+        started = time.perf_counter()
+        reranker = load_reranker(name, max_tokens=max_tokens, batch_size=batch_size)
+        load_seconds = time.perf_counter() - started
+        reranker.compute_score(requests[0])
+        latencies, scores = [], []
+        pairs = 0
+        for _ in range(repeat):
+            scores = []
+            for request in requests:
+                t0 = time.perf_counter()
+                scores.append(reranker.compute_score(request))
+                latencies.append(time.perf_counter() - t0)
+                pairs += len(request)
+        total = sum(latencies)
+        results[name] = {
+            'load_seconds' : load_seconds,
+            'pairs' : pairs,
+            'pairs_per_second' : pairs / total if total else 0.0,
+            'request' : summarize(latencies),
+        }
+        if reference is None:
+            reference = (name, scores)
+        else:
+            results[name]['agreement_with'] = reference[0]
+            results[name]['spearman'] = sum(_spearman(a, b) for a, b in zip(reference[1], scores)) / len(scores)
+            results[name][f'top{top_k}_overlap'] = sum(_top_overlap(a, b, top_k) for a, b in zip(reference[1], scores)) / len(scores)
+        del reranker
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reranker backend throughput and agreement.")
+    parser.add_argument("--backends", nargs="+", default=["flag", "int8", "onnx", "onnx-int8"],
+                        help="The first backend is the reference for score agreement.")
+    parser.add_argument("--docs", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--candidates", type=int, default=40, help="Pairs per request, like retrieval's candidate set.")
+    parser.add_argument("--max-tokens", type=int, default=None, help="Default: RERANK_MAX_TOKENS.")
+    parser.add_argument("--batch-size", type=int, default=None, help="Default: RERANK_BATCH_SIZE.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--out", type=str, default=None)
+    args = parser.parse_args()
+
+    from src.rag.rerankers import RERANK_BATCH_SIZE, RERANK_MAX_TOKENS
+    max_tokens = args.max_tokens or RERANK_MAX_TOKENS
+    batch_size = args.batch_size or RERANK_BATCH_SIZE
+    requests = _pair_set(args.docs, args.pages, args.seed, args.candidates)
+    results = _run(args.backends, requests, max_tokens, batch_size, args.repeat, args.top_k)
+    write_results("reranker", {
+        "params" : {**vars(args), "max_tokens" : max_tokens, "batch_size" : batch_size},
+        "requests" : len(requests),
+        "results" : results
+    }, args.out)
+
+
+if __name__ == "__main__":
+    main()
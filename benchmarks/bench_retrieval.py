@@ -0,0 +1,106 @@
+"""
+Retrieval latency and recall@k against a labeled query set ({question, media_id, page}).
+By default the synthetic corpus is ingested first and removed afterwards.
+
+    python -m benchmarks.bench_retrieval --docs 10 --k 25 --top-k 10
+    python -m benchmarks.bench_retrieval --queries my_queries.jsonl --no-ingest
+"""
+import time
+import asyncio
+import argparse
+
+from .common import summarize, write_results
+from .corpus import generate, load_jsonl, to_langchain_pages
+
+
+def _media_ids_by_source_doc(media_ids):
+    from sqlalchemy import select
+    from src.core.database import SessionLocal
+    from src.models.source_documents import SourceDocument
+    with SessionLocal() as session:
+        rows = session.execute(
+            select(SourceDocument.id, SourceDocument.media_id).where(SourceDocument.media_id.in_(media_ids))
+        ).all()
+    return {source_doc_id : media_id for source_doc_id, media_id in rows}
+
+
+def _hit(docs, query, media_id_of) -> int:
+    """Rank (1-based) of the first document matching the labeled media_id/page, 0 if none."""
+    for rank, doc in enumerate(docs, start=1):
+        # Stored chunk pages are 1-based, like the labels.
+        if media_id_of.get(doc.metadata.get('source_doc_id')) == query['media_id'] and doc.metadata.get('page') == query['page']:
+            return rank
+    return 0
+
+
+async def _run(queries, args):
+    from src.rag.retrieval import retrieval_and_rerank
+    from src.rag.policy import RetrievalStats
+
+    media_id_of = _media_ids_by_source_doc(sorted({query['media_id'] for query in queries}))
+    latencies, ranks, stats_rows = [], [], []
+    for query in queries:
+        stats = RetrievalStats()
+        started = time.perf_counter()
+        docs = await retrieval_and_rerank(
+            query['question'], media_id=query['media_id'] if args.scoped else None,
+            k=args.k, top_k=args.top_k, stats=stats
+        )
+        latencies.append(time.perf_counter() - started)
+        ranks.append(_hit(docs, query, media_id_of))
+        stats_rows.append(stats.as_dict())
+
+    found = [r for r in ranks if r]
+    recall = {
+        f'recall@{cut}' : sum(1 for r in found if r <= cut) / len(ranks) if ranks else 0.0
+        for cut in sorted({1, 3, 5, args.top_k})
+    }
+    mrr = sum(1 / r for r in found) / len(ranks) if ranks else 0.0
+    means = {
+        key : sum(row[key] for row in stats_rows) / len(stats_rows)
+        for key in (stats_rows[0] if stats_rows else {})
+    }
+    return {'latency' : summarize(latencies), **recall, 'mrr' : mrr, 'mean_stats' : means}
+
+
+def _ingest(documents):
+    from src.workers.processing import parse_document, embed_chunks, write_chunks
+    for document in documents:
+        write_chunks(embed_chunks(parse_document(document['name'], document['media_id'], docs=to_langchain_pages(document))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval latency and recall@k benchmark.")
+    parser.add_argument("--docs", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--first-media-id", type=int, default=900000)
+    parser.add_argument("--queries", type=str, default=None, help="JSONL query set; defaults to the synthetic one.")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--k", type=int, default=25)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--scoped", action="store_true", help="Pass the gold media_id, measuring in-document ranking only.")
+    parser.add_argument("--no-ingest", action="store_true", help="Query what is already in the database.")
+    parser.add_argument("--out", type=str, default=None)
+    args = parser.parse_args()
+
+    documents, queries = generate(args.docs, args.pages, args.seed, args.first_media_id)
+    if args.queries:
+        queries = load_jsonl(args.queries)
+    queries = queries[:args.limit] if args.limit else queries
+
+    media_ids = [document['media_id'] for document in documents]
+    if not args.no_ingest:
+        from src.workers.delete_documents import delete_documents_bulk
+        delete_documents_bulk(media_ids)
+        _ingest(documents)
+    try:
+        payload = asyncio.run(_run(queries, args))
+    finally:
+        if not args.no_ingest:
+            delete_documents_bulk(media_ids)
+    write_results("retrieval", {"params" : vars(args), "queries" : len(queries), **payload}, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Routing accuracy and latency: centroid router vs. the chunk-voting scan.
+
+The query set is JSONL with one {"question": ..., "media_id": ...} per line, where
+media_id is the document that answers the question.
+
+    python -m benchmarks.bench_routing queries.jsonl --top-k 3
+"""
+import json
+import time
+import asyncio
+import argparse
+
+from .common import summarize, write_results
+
+
+async def _run(queries, top_k : int):
+    from src.core.embeddings import get_embedding_fn
+    from src.rag.retrieval import vote_retrieval
+    from src.rag.routing import DOCUMENT_ROUTER
+
+    embeddings = get_embedding_fn().embed_documents([q["question"] for q in queries])
+    await DOCUMENT_ROUTER.refresh(force=True)
+    results = {}
+    for name in ["vote", "centroid"]:
+        hits, first_hits, latencies = 0, 0, []
+        for query, embedding in zip(queries, embeddings):
+            started = time.perf_counter()
+            if name == "vote":
+                media_ids = await vote_retrieval(query["question"], top_k_ids=top_k, query_embedding=embedding)
+            else:
+                media_ids = await DOCUMENT_ROUTER.route(embedding, top_k)
+            latencies.append(time.perf_counter() - started)
+            hits += int(query["media_id"] in media_ids)
+            first_hits += int(bool(media_ids) and media_ids[0] == query["media_id"])
+        results[name] = {
+            f"accuracy_at_{top_k}" : hits / len(queries),
+            "accuracy_at_1" : first_hits / len(queries),
+            **summarize(latencies),
+        }
+    results["documents_indexed"] = len(DOCUMENT_ROUTER)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Document routing benchmark.")
+    parser.add_argument("queries", type=str, help="JSONL file of {question, media_id}.")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--out", type=str, default=None)
+    args = parser.parse_args()
+
+    with open(args.queries, encoding="utf-8") as f:
+        queries = [json.loads(line) for line in f if line.strip()]
+    results = asyncio.run(_run(queries, args.top_k))
+    write_results("routing", {"params" : vars(args), "queries" : len(queries), "results" : results}, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import os
+import json
+import time
+import platform
+import subprocess
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def percentile(values : List[float], pct : float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def summarize(latencies : List[float]) -> Dict[str, float]:
+    return {
+        'count' : len(latencies),
+        'mean_ms' : 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+        'p50_ms' : 1000 * percentile(latencies, 50),
+        'p95_ms' : 1000 * percentile(latencies, 95),
+        'p99_ms' : 1000 * percentile(latencies, 99),
+        'max_ms' : 1000 * max(latencies) if latencies else 0.0,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except Exception:
+        return None
+
+
+def write_results(name : str, payload : Dict[str, Any], out : Optional[str] = None) -> str:
+    """Writes a benchmark result as JSON, tagged with commit and host so runs can be compared."""
+    record = {
+        'benchmark' : name,
+        'commit' : git_commit(),
+        'timestamp' : datetime.now(timezone.utc).isoformat(),
+        'host' : platform.node(),
+        'python' : platform.python_version(),
+        **payload,
+    }
+    if out is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = os.path.join(RESULTS_DIR, f"{name}-{record['commit'] or 'nogit'}-{int(time.time())}.json")
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(record, f, indent=2, ensure_ascii=False)
+    print(json.dumps(record, indent=2, ensure_ascii=False))
+    return out
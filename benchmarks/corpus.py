@@ -0,0 +1,128 @@
+"""
+Deterministic synthetic corpus for benchmarks: legal-style documents (Chương/Điều/khoản)
+and narrative documents, plus a labeled query set pointing at the page holding each fact.
+
+    python -m benchmarks.corpus --docs 20 --pages 12 --out benchmarks/data
+    # -> corpus.jsonl (one document per line) and queries.jsonl ({question, media_id, page})
+"""
+import os
+import json
+import random
+import argparse
+from typing import Dict, List, Tuple
+
+LEGAL_TOPICS = [
+    "ăn trưa", "xăng xe", "điện thoại", "nhà ở", "độc hại", "ca đêm", "thâm niên", "trách nhiệm",
+    "chuyên cần", "công tác", "đào tạo", "ngoại ngữ", "thai sản", "hiếu hỉ", "làm thêm giờ", "khu vực",
+]
+NARRATIVE_TOPICS = [
+    "warehouse migration", "supplier audit", "safety drill", "client onboarding", "network upgrade",
+    "quality review", "budget planning", "recruitment drive", "data center move", "training week",
+]
+FILLER_VI = [
+    "Người lao động có trách nhiệm tuân thủ nội quy lao động và các quy định của Công ty.",
+    "Phòng Hành chính Nhân sự chịu trách nhiệm hướng dẫn và theo dõi việc thực hiện quy định này.",
+    "Trường hợp phát sinh vướng mắc, các đơn vị báo cáo Ban Giám đốc để xem xét giải quyết.",
+    "Quy định này được áp dụng thống nhất cho tất cả các bộ phận trong Công ty.",
+    "Các khoản chi trả được thực hiện cùng kỳ lương hàng tháng thông qua tài khoản ngân hàng.",
+]
+FILLER_EN = [
+    "The team reviewed the schedule and agreed on the next milestones.",
+    "Several stakeholders joined the weekly meeting to discuss open risks.",
+    "Documentation was updated and shared with every department involved.",
+    "Follow-up actions were assigned to owners with clear deadlines.",
+    "The steering committee approved the revised plan after a short discussion.",
+]
+
+
+def _legal_document(rng : random.Random, media_id : int, n_pages : int) -> Tuple[Dict, List[Dict]]:
+    pages, queries, article = [], [], 1
+    topics = rng.sample(LEGAL_TOPICS, k=min(len(LEGAL_TOPICS), n_pages))
+    for page_no in range(n_pages):
+        lines = []
+        if page_no % 4 == 0:
+            lines.append(f"Chương {page_no // 4 + 1}. QUY ĐỊNH VỀ CHẾ ĐỘ PHỤ CẤP (văn bản {media_id})")
+        for _ in range(3):
+            topic = topics[page_no % len(topics)]
+            amount = rng.randrange(100, 5000) * 1000
+            lines.append(f"\n\nĐiều {article}. Phụ cấp {topic} (văn bản {media_id})")
+            lines.append(f"1. Mức phụ cấp {topic} của văn bản {media_id} là {amount:,} đồng mỗi tháng.")
+            lines.append(f"2. Điều kiện hưởng: {rng.choice(FILLER_VI)}")
+            lines.append(f"a) {rng.choice(FILLER_VI)}\nb) {rng.choice(FILLER_VI)}")
+            if not any(q["page"] == page_no + 1 for q in queries):
+                queries.append({
+                    "question" : f"Theo Điều {article} của văn bản {media_id}, mức phụ cấp {topic} là bao nhiêu?",
+                    "answer" : f"{amount:,}",
+                    "media_id" : media_id,
+                    "page" : page_no + 1,
+                })
+            article += 1
+        pages.append("\n".join(lines))
+    return {"name" : f"bench_legal_{media_id}", "media_id" : media_id, "kind" : "legal", "pages" : pages}, queries
+
+
+def _narrative_document(rng : random.Random, media_id : int, n_pages : int) -> Tuple[Dict, List[Dict]]:
+    pages, queries = [], []
+    project = rng.choice(NARRATIVE_TOPICS)
+    for page_no in range(n_pages):
+        day = rng.randrange(1, 28)
+        people = rng.randrange(5, 400)
+        paragraphs = [" ".join(rng.choice(FILLER_EN) for _ in range(6)) for _ in range(3)]
+        fact = f"On day {day} of the {project} (report {media_id}, part {page_no + 1}), {people} people took part."
+        paragraphs.insert(rng.randrange(0, 3), fact)
+        pages.append("\n\n".join(paragraphs))
+        queries.append({
+            "question" : f"How many people took part in part {page_no + 1} of the {project} in report {media_id}?",
+            "answer" : str(people),
+            "media_id" : media_id,
+            "page" : page_no + 1,
+        })
+    return {"name" : f"bench_narrative_{media_id}", "media_id" : media_id, "kind" : "narrative", "pages" : pages}, queries
+
+
+def generate(n_docs : int, n_pages : int, seed : int = 0, first_media_id : int = 900000):
+    rng = random.Random(seed)
+    documents, queries = [], []
+    for i in range(n_docs):
+        build = _legal_document if i % 2 == 0 else _narrative_document
+        document, doc_queries = build(rng, first_media_id + i, n_pages)
+        documents.append(document)
+        queries.extend(doc_queries)
+    return documents, queries
+
+
+def to_langchain_pages(document : Dict):
+    from langchain_core.documents import Document
+    # Same shape as load_from_document: one Document per page, 0-based 'page' metadata.
+    return [Document(page_content=text, metadata={"page" : i}) for i, text in enumerate(document["pages"])]
+
+
+def load_jsonl(path : str) -> List[Dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_jsonl(path : str, rows : List[Dict]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic benchmark corpus generator.")
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--first-media-id", type=int, default=900000)
+    parser.add_argument("--out", type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+    args = parser.parse_args()
+
+    documents, queries = generate(args.docs, args.pages, args.seed, args.first_media_id)
+    os.makedirs(args.out, exist_ok=True)
+    write_jsonl(os.path.join(args.out, "corpus.jsonl"), documents)
+    write_jsonl(os.path.join(args.out, "queries.jsonl"), queries)
+    print(f"Wrote {len(documents)} documents and {len(queries)} queries to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Offline retrieval quality-vs-cost evaluation. Re-chunks a corpus under a parameter grid
+and keeps every index in memory (exact cosine search in NumPy), so production tables are
+never read or written. For each config it reports hit-rate/MRR against gold pages next to
+the cost side: embeddings, index bytes, reranked pairs, context tokens and query latency.
+
+    python -m benchmarks.eval_retrieval --parent-sizes 800 1200 --child-sizes 300 500 --top-k 5 10
+    python -m benchmarks.eval_retrieval --corpus benchmarks/data/corpus.jsonl \\
+        --queries benchmarks/data/queries.jsonl --relevance   # also sweeps the relevance threshold (needs Ollama)
+
+Candidate selection mirrors retrieval_and_rerank: child and parent candidates cut at the
+distance gap, cross-encoder rerank with the score elbow, then fit_to_budget and pack_context.
+Document routing is skipped: every query searches the whole corpus.
+"""
+import time
+import asyncio
+import argparse
+import itertools
+from dataclasses import replace
+from typing import Dict, List
+
+import numpy as np
+
+from .common import summarize, write_results
+from .corpus import generate, load_jsonl, to_langchain_pages
+
+RELEVANCE_THRESHOLDS = range(1, 11)
+
+
+class MemoryIndex:
+    """Parent/child chunks of one chunking config with their normalized embeddings."""
+
+    def __init__(self, chunks, embeddings : np.ndarray):
+        self.chunks = chunks
+        self.embeddings = embeddings
+        self.by_id = {chunk.metadata['id'] : chunk for chunk in chunks}
+        levels = np.array([chunk.metadata['chunk_level'] == 'CHILD' for chunk in chunks], dtype=bool)
+        self.child_rows = np.flatnonzero(levels)
+        self.parent_rows = np.flatnonzero(~levels)
+
+    @property
+    def vector_bytes(self) -> int:
+        return int(self.embeddings.nbytes)
+
+    @property
+    def text_bytes(self) -> int:
+        return sum(len(chunk.page_content.encode('utf-8')) for chunk in self.chunks)
+
+    def search(self, query_embedding : np.ndarray, rows : np.ndarray, limit : int):
+        distances = 1.0 - self.embeddings[rows] @ query_embedding
+        order = np.argsort(distances)[:limit]
+        return [(self.chunks[rows[i]], float(distances[i])) for i in order]
+
+
+def _build_index(documents, config) -> Dict:
+    from src.core.embeddings import get_embedding_fn
+    from src.workers.processing import chunk_documents
+
+    started = time.perf_counter()
+    chunks = []
+    for document in documents:
+        for chunk in chunk_documents(to_langchain_pages(document), config):
+            # Same metadata shape as retrieval._to_document builds from stored rows.
+            chunk.metadata.update({
+                'chunk_level' : chunk.metadata['chunk_level'].value,
+                'page' : chunk.metadata.get('page') + 1,
+                'source_doc_id' : document['media_id'],
+            })
+            chunks.append(chunk)
+    chunk_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    embeddings = np.asarray(get_embedding_fn().embed_documents([chunk.page_content for chunk in chunks]), dtype=np.float32)
+    embed_seconds = time.perf_counter() - started
+    index = MemoryIndex(chunks, embeddings)
+    return {
+        'index' : index,
+        'cost' : {
+            'parents' : len(index.parent_rows),
+            'children' : len(index.child_rows),
+            'embeddings' : len(chunks),
+            'vector_bytes' : index.vector_bytes,
+            'text_bytes' : index.text_bytes,
+            'chunk_seconds' : chunk_seconds,
+            'embed_seconds' : embed_seconds,
+        }
+    }
+
+
+def _retrieve(index : MemoryIndex, question : str, query_embedding : np.ndarray, k : int, top_k : int, policy):
+    from src.rag.policy import cut_at_distance_gap, fit_to_budget
+    from src.rag.retrieval import RERANKER_VN, rerank_documents_vn
+
+    max_candidates = min(k, policy.max_candidates)
+    children = index.search(query_embedding, index.child_rows, max_candidates)
+    children = children[:cut_at_distance_gap([d for _, d in children], policy.distance_gap, policy.min_candidates)]
+    parents = index.search(query_embedding, index.parent_rows, max_candidates)
+    parents = parents[:cut_at_distance_gap([d for _, d in parents], policy.distance_gap, policy.min_candidates)]
+
+    parent_ids = {chunk.metadata.get('parent_id') for chunk, _ in children} | {chunk.metadata['id'] for chunk, _ in parents}
+    candidates = [index.by_id[i] for i in parent_ids if i in index.by_id] + [chunk for chunk, _ in children]
+    # No score cache: configs sharing a chunking would otherwise reuse each other's scores and skew latency.
+    reranked = rerank_documents_vn(question, candidates, RERANKER_VN, top_k, policy, cache=None)
+    reranked = reranked[:len(fit_to_budget([doc.page_content for doc in reranked], policy.context_tokens))]
+    return candidates, reranked
+
+
+def _rank(docs, query) -> int:
+    for rank, doc in enumerate(docs, start=1):
+        if doc.metadata.get('source_doc_id') == query['media_id'] and doc.metadata.get('page') == query['page']:
+            return rank
+    return 0
+
+
+def _evaluate(index : MemoryIndex, queries, query_embeddings, k : int, top_k : int, policy, context_budget : int):
+    from src.rag.context import pack_context
+    from src.rag.policy import estimate_tokens
+
+    ranks, candidate_hits, latencies, pairs, tokens, contexts = [], 0, [], [], [], []
+    for query, query_embedding in zip(queries, query_embeddings):
+        started = time.perf_counter()
+        candidates, reranked = _retrieve(index, query['question'], query_embedding, k, top_k, policy)
+        latencies.append(time.perf_counter() - started)
+        packed, _ = pack_context(reranked, context_budget)
+        ranks.append(_rank(reranked, query))
+        candidate_hits += bool(_rank(candidates, query))
+        pairs.append(len(candidates))
+        tokens.append(sum(estimate_tokens(doc.page_content) for doc in packed))
+        contexts.append(packed)
+    n = len(queries) or 1
+    return {
+        'hit_rate' : sum(1 for r in ranks if r) / n,
+        'mrr' : sum(1 / r for r in ranks if r) / n,
+        'candidate_recall' : candidate_hits / n,
+        'mean_rerank_pairs' : sum(pairs) / n,
+        'mean_context_tokens' : sum(tokens) / n,
+        'latency' : summarize(latencies),
+    }, ranks, contexts
+
+
+def _format_context(docs) -> str:
+    # Same layout as RAG._format_context.
+    return "\n\n---\n\n".join(f"Trang {doc.metadata.get('page', 'N/A')}:\n{doc.page_content}" for doc in docs)
+
+
+async def _relevance_sweep(queries, ranks, contexts) -> Dict[str, Dict[str, float]]:
+    """Share of queries answered at each threshold, split by whether the gold page reached the context."""
+    from langchain_core.output_parsers import PydanticOutputParser
+    from langchain_core.prompts import PromptTemplate
+    from src.rag.definitions import RelevanceCheck, RELEVANCE_PROMPT
+    from src.rag.llm import LLMExecutor, build_llm
+
+    parser = PydanticOutputParser(pydantic_object = RelevanceCheck)
+    chain = PromptTemplate(
+        template = RELEVANCE_PROMPT,
+        input_variables = ["query", "context"],
+        partial_variables = {"format_instructions" : parser.get_format_instructions()},
+    ) | build_llm("relevance") | parser
+    executor = LLMExecutor(max_queue = -1)
+
+    async def score(query, docs):
+        try:
+            result = await executor.ainvoke(chain, {
+                "query" : query['question'], "context" : _format_context(docs)
+            }, name = "relevance")
+            return result.relevance_score
+        except Exception:
+            return 0
+
+    scores = await asyncio.gather(*[score(q, docs) for q, docs in zip(queries, contexts)])
+    hits = [s for s, r in zip(scores, ranks) if r]
+    misses = [s for s, r in zip(scores, ranks) if not r]
+    return {
+        str(threshold) : {
+            'answered_with_gold' : sum(1 for s in hits if s >= threshold) / len(hits) if hits else 0.0,
+            'answered_without_gold' : sum(1 for s in misses if s >= threshold) / len(misses) if misses else 0.0,
+        }
+        for threshold in RELEVANCE_THRESHOLDS
+    }
+
+
+def _pareto(rows : List[Dict]) -> None:
+    """Marks configs no other config beats on hit rate, context tokens and p50 latency at once."""
+    def key(row):
+        return row['hit_rate'], -row['mean_context_tokens'], -row['latency']['p50_ms']
+    for row in rows:
+        mine = key(row)
+        row['pareto'] = not any(
+            all(a >= b for a, b in zip(key(other), mine)) and key(other) != mine for other in rows
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval quality-vs-cost grid evaluation (in-memory).")
+    parser.add_argument("--corpus", type=str, default=None, help="JSONL corpus from benchmarks.corpus; defaults to a generated one.")
+    parser.add_argument("--queries", type=str, default=None)
+    parser.add_argument("--docs", type=int, default=6)
+    parser.add_argument("--pages", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--parent-sizes", type=int, nargs="+", default=[1200])
+    parser.add_argument("--child-sizes", type=int, nargs="+", default=[500])
+    parser.add_argument("--semantic-child-sizes", type=int, nargs="+", default=[400])
+    parser.add_argument("--parent-overlap", type=float, default=0.1, help="Parent overlap as a fraction of its size.")
+    parser.add_argument("--child-overlap", type=float, default=0.2, help="Child overlap as a fraction of its size.")
+    parser.add_argument("--k", type=int, nargs="+", default=[25])
+    parser.add_argument("--top-k", type=int, nargs="+", default=[10])
+    parser.add_argument("--context-budget", type=int, default=4096)
+    parser.add_argument("--relevance", action="store_true", help="Sweep the relevance threshold with the configured LLM.")
+    parser.add_argument("--out", type=str, default=None)
+    args = parser.parse_args()
+
+    from src.core.embeddings import get_embedding_fn
+    from src.rag.retrieval import DEFAULT_POLICY
+    from src.workers.processing import DEFAULT_CHUNKING
+
+    documents, queries = generate(args.docs, args.pages, args.seed)
+    if args.corpus:
+        documents = load_jsonl(args.corpus)
+    if args.queries:
+        queries = load_jsonl(args.queries)
+    queries = queries[:args.limit] if args.limit else queries
+    query_embeddings = np.asarray(get_embedding_fn().embed_documents([q['question'] for q in queries]), dtype=np.float32)
+
+    rows = []
+    for parent_size, child_size, semantic_child_size in itertools.product(
+            args.parent_sizes, args.child_sizes, args.semantic_child_sizes):
+        if child_size >= parent_size:
+            continue
+        config = replace(
+            DEFAULT_CHUNKING,
+            parent_size = parent_size, parent_overlap = int(parent_size * args.parent_overlap),
+            child_size = child_size, child_overlap = int(child_size * args.child_overlap),
+            semantic_child_size = semantic_child_size, semantic_child_overlap = int(semantic_child_size * args.child_overlap / 2),
+        )
+        built = _build_index(documents, config)
+        for k, top_k in itertools.product(args.k, args.top_k):
+            quality, ranks, contexts = _evaluate(
+                built['index'], queries, query_embeddings, k, top_k, DEFAULT_POLICY, args.context_budget
+            )
+            row = {'chunking' : vars(config), 'k' : k, 'top_k' : top_k, **built['cost'], **quality}
+            if args.relevance:
+                row['relevance'] = asyncio.run(_relevance_sweep(queries, ranks, contexts))
+            rows.append(row)
+            print(f"parent={parent_size} child={child_size} k={k} top_k={top_k}: "
+                  f"hit={row['hit_rate']:.3f} mrr={row['mrr']:.3f} tokens={row['mean_context_tokens']:.0f} "
+                  f"p50={row['latency']['p50_ms']:.1f}ms embeddings={row['embeddings']}")
+    _pareto(rows)
+    write_results("eval_retrieval", {
+        "params" : vars(args), "documents" : len(documents), "queries" : len(queries), "results" : rows
+    }, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Minimal Ollama-compatible server for benchmarks: implements /api/chat, /api/generate,
+/api/tags and /api/embed with simulated prefill/decode cost and a per-slot prefix cache,
+so prompt layout and client settings can be compared without a GPU.
+
+    python -m benchmarks.ollama_stub --port 11435
+"""
+import json
+import time
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+
+class StubModel:
+    def __init__(self, prefill_ms_per_kchar : float = 40.0, decode_ms_per_token : float = 5.0,
+                 answer_tokens : int = 120, slots : int = 4, parallel : int = 1):
+        self.prefill_ms_per_kchar = prefill_ms_per_kchar
+        self.decode_ms_per_token = decode_ms_per_token
+        self.answer_tokens = answer_tokens
+        self.slots : List[str] = []
+        self.max_slots = slots
+        self._lock = threading.Lock()
+        self._busy = threading.Semaphore(parallel)
+        self.prompt_chars = 0
+        self.cached_chars = 0
+        self.requests = 0
+        self.loads = 0
+        self._loaded_options : Optional[tuple] = None
+
+    def _reuse(self, prompt : str) -> int:
+        best = 0
+        for cached in self.slots:
+            n = 0
+            for a, b in zip(cached, prompt):
+                if a != b:
+                    break
+                n += 1
+            best = max(best, n)
+        return best
+
+    def run(self, prompt : str, options : dict):
+        with self._busy:
+            with self._lock:
+                key = (options.get('num_ctx'),)
+                if key != self._loaded_options:
+                    # Ollama reloads the runner when num_ctx changes.
+                    self.loads += 1
+                    self._loaded_options = key
+                    self.slots.clear()
+                reused = self._reuse(prompt)
+                self.slots.append(prompt)
+                self.slots = self.slots[-self.max_slots:]
+                self.requests += 1
+                self.prompt_chars += len(prompt)
+                self.cached_chars += reused
+            time.sleep((len(prompt) - reused) / 1000 * self.prefill_ms_per_kchar / 1000)
+            if 'relevance_score' in prompt:
+                tokens = ['{"relevance_score": 8}']
+            else:
+                tokens = [f"tok{i} " for i in range(self.answer_tokens)]
+            limit = options.get('num_predict') or len(tokens)
+            for token in tokens[:max(1, limit)]:
+                time.sleep(self.decode_ms_per_token / 1000)
+                yield token, len(prompt) // 3, reused // 3
+
+    def stats(self) -> dict:
+        return {
+            'requests' : self.requests,
+            'prompt_chars' : self.prompt_chars,
+            'cached_chars' : self.cached_chars,
+            'prefix_cache_ratio' : self.cached_chars / self.prompt_chars if self.prompt_chars else 0.0,
+            'model_loads' : self.loads,
+        }
+
+
+def make_handler(model : StubModel):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, payload : dict, status : int = 200):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/api/tags':
+                return self._json({'models' : [{'name' : 'stub', 'model' : 'stub'}]})
+            if self.path == '/stats':
+                return self._json(model.stats())
+            self._json({'error' : 'not found'}, 404)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/api/embed':
+                inputs = request.get('input') or []
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                return self._json({'model' : request.get('model'), 'embeddings' : [[0.0] * 8 for _ in inputs]})
+            if self.path not in ('/api/chat', '/api/generate'):
+                return self._json({'error' : 'not found'}, 404)
+            chat = self.path == '/api/chat'
+            if chat:
+                prompt = "\n".join(m.get('content', '') for m in request.get('messages', []))
+            else:
+                prompt = request.get('prompt', '')
+            options = request.get('options') or {}
+            stream = request.get('stream', True)
+            started = time.perf_counter()
+            now = datetime.now(timezone.utc).isoformat()
+
+            def frame(text : str, done : bool, **extra) -> dict:
+                payload = {'model' : request.get('model'), 'created_at' : now, 'done' : done, **extra}
+                if chat:
+                    payload['message'] = {'role' : 'assistant', 'content' : text}
+                else:
+                    payload['response'] = text
+                return payload
+
+            pieces, prompt_tokens, count = [], 0, 0
+            if stream:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+            for token, prompt_tokens, _ in model.run(prompt, options):
+                count += 1
+                if stream:
+                    self._chunk(frame(token, False))
+                else:
+                    pieces.append(token)
+            final = frame('' if stream else ''.join(pieces), True,
+                          done_reason = 'stop',
+                          total_duration = int((time.perf_counter() - started) * 1e9),
+                          prompt_eval_count = prompt_tokens,
+                          eval_count = count)
+            if stream:
+                self._chunk(final)
+                self.wfile.write(b'0\r\n\r\n')
+            else:
+                self._json(final)
+
+        def _chunk(self, payload : dict):
+            data = (json.dumps(payload) + '\n').encode()
+            self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+            self.wfile.flush()
+
+    return Handler
+
+
+def serve(port : int = 11435, model : Optional[StubModel] = None, background : bool = False) -> ThreadingHTTPServer:
+    model = model or StubModel()
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(model))
+    server.daemon_threads = True
+    server.model = model
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        server.serve_forever()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ollama-compatible stub server for benchmarks.")
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--prefill-ms-per-kchar', type=float, default=40.0)
+    parser.add_argument('--decode-ms-per-token', type=float, default=5.0)
+    parser.add_argument('--answer-tokens', type=int, default=120)
+    parser.add_argument('--parallel', type=int, default=1)
+    args = parser.parse_args()
+    serve(args.port, StubModel(args.prefill_ms_per_kchar, args.decode_ms_per_token, args.answer_tokens,
+                               parallel=args.parallel))
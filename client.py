@@ -1,5 +1,6 @@
 import requests
 import json
+import os
 import argparse
 
 # The base URL of your API running in Docker
@@ -34,20 +35,79 @@ def ingest_document(file_name: str, media_id: int):
     headers = {"Content-Type": "application/json"}
     handle_request("post", url, headers=headers, json=payload)
 
-def ask_question(question: str, media_id: int = None):
+def upload_document(path: str, media_id: int, file_format: str = None):
     """
-    Sends a question to the /chat endpoint.
+    Streams a local file to the /ingest/upload endpoint; the format is inferred from the extension unless given.
+    """
+    print(f"--- Uploading {path} as media_id: {media_id} ---")
+    url = f"{BASE_URL}/ingest/upload"
+    params = {"media_id": media_id}
+    if file_format:
+        params["format"] = file_format
+    with open(path, "rb") as f:
+        handle_request("post", url, params=params, files={"file": (os.path.basename(path), f)})
+
+def ingest_batch(documents: list):
+    """
+    Sends a request to the /ingest/batch endpoint; documents are "file_name:media_id" strings.
+    """
+    print(f"--- Sending Batch Ingest Request for {len(documents)} documents ---")
+    url = f"{BASE_URL}/ingest/batch"
+    payload = {"documents": []}
+    for item in documents:
+        file_name, media_id = item.rsplit(":", 1)
+        payload["documents"].append({"file_name": file_name, "media_id": int(media_id)})
+    headers = {"Content-Type": "application/json"}
+    handle_request("post", url, headers=headers, json=payload)
+
+def ask_question(question: str, media_id: int = None, session_id: str = None, media_ids: list = None):
+    """
+    Sends a question to the /chat endpoint; with a session_id the server keeps the history.
     """
     print(f"--- Sending Chat Request ---")
     url = f"{BASE_URL}/chat"
     payload = {
         "question": question,
         "media_id": media_id,
-        "history": []  # Example with no history, you can modify this
+        "media_ids": media_ids or [],
+        "session_id": session_id,
+        "history": []
     }
     headers = {"Content-Type": "application/json"}
     handle_request("post", url, headers=headers, json=payload)
 
+def ask_batch(questions_file: str, output: str = None, media_ids: list = None, concurrency: int = None):
+    """
+    Sends every question in a file (one per line, or JSONL with a "question" field) to /chat/batch
+    and writes the streamed JSON lines to `output` (stdout by default) as they arrive.
+    """
+    with open(questions_file, encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    questions = [json.loads(line)["question"] if line.startswith("{") else line for line in lines]
+    print(f"--- Sending Batch Chat Request with {len(questions)} questions ---")
+    url = f"{BASE_URL}/chat/batch"
+    payload = {"questions": questions, "media_ids": media_ids or [], "concurrency": concurrency}
+    try:
+        with requests.post(url, json=payload, stream=True) as response:
+            response.raise_for_status()
+            out = open(output, "w", encoding="utf-8") if output else None
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    if out:
+                        out.write(line + "\n")
+                        out.flush()
+                        item = json.loads(line)
+                        print(f"{'❌' if 'error' in item else '✅'} [{item.get('index')}] {item.get('question', '')[:80]}")
+                    else:
+                        print(line)
+            finally:
+                if out:
+                    out.close()
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Request Failed: {e}")
+
 def delete_document(media_id: int):
     """
     Sends a request to the /delete endpoint to remove a document.
@@ -68,10 +128,29 @@ if __name__ == "__main__":
     parser_ingest.add_argument("file_name", type=str, help="The name of the file to ingest (without .pdf extension).")
     parser_ingest.add_argument("media_id", type=int, help="A unique integer ID for the media file.")
 
+    # --- Upload Command ---
+    parser_upload = subparsers.add_parser("upload", help="Upload and ingest a local file.")
+    parser_upload.add_argument("path", type=str, help="Path of the file to upload (pdf, epub, xps, txt, md, html, ...).")
+    parser_upload.add_argument("media_id", type=int, help="A unique integer ID for the media file.")
+    parser_upload.add_argument("--format", type=str, default=None, help="Optional: Overrides the format inferred from the extension.")
+
+    # --- Batch Ingest Command ---
+    parser_batch = subparsers.add_parser("ingest-batch", help="Ingest many documents at once.")
+    parser_batch.add_argument("documents", nargs="+", help="Documents as file_name:media_id pairs.")
+
     # --- Chat Command ---
     parser_chat = subparsers.add_parser("chat", help="Ask a question.")
     parser_chat.add_argument("question", type=str, help="The question to ask the RAG pipeline.")
     parser_chat.add_argument("--media_id", type=int, default=None, help="Optional: An integer media_id to filter the search.")
+    parser_chat.add_argument("--media_ids", type=int, nargs="+", default=None, help="Optional: Several media_ids to search together, e.g. to compare policies.")
+    parser_chat.add_argument("--session", type=str, default=None, help="Optional: A session id (from POST /sessions) to continue a conversation.")
+
+    # --- Batch Chat Command ---
+    parser_chat_batch = subparsers.add_parser("chat-batch", help="Answer a file of questions in one batch.")
+    parser_chat_batch.add_argument("questions_file", type=str, help="One question per line, or JSONL with a \"question\" field.")
+    parser_chat_batch.add_argument("--output", type=str, default=None, help="Optional: JSONL file for the answers (default: stdout).")
+    parser_chat_batch.add_argument("--media_ids", type=int, nargs="+", default=None, help="Optional: media_ids to search.")
+    parser_chat_batch.add_argument("--concurrency", type=int, default=None, help="Optional: Generations running at once.")
 
     # --- Delete Command ---
     parser_delete = subparsers.add_parser("delete", help="Delete a document.")
@@ -81,7 +160,13 @@ if __name__ == "__main__":
 
     if args.command == "ingest":
         ingest_document(args.file_name, args.media_id)
+    elif args.command == "upload":
+        upload_document(args.path, args.media_id, args.format)
+    elif args.command == "ingest-batch":
+        ingest_batch(args.documents)
     elif args.command == "chat":
-        ask_question(args.question, args.media_id)
+        ask_question(args.question, args.media_id, args.session, args.media_ids)
+    elif args.command == "chat-batch":
+        ask_batch(args.questions_file, args.output, args.media_ids, args.concurrency)
     elif args.command == "delete":
         delete_document(args.media_id)
\ No newline at end of file
@@ -0,0 +1,68 @@
+import os
+import logging
+import threading
+from typing import List, Optional
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+log = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL')
+EMBEDDING_DEVICE = os.getenv('EMBEDDING_DEVICE')
+
+_lock = threading.Lock()
+_embedding_fns = {}
+
+
+def _device() -> str:
+    import torch
+    if EMBEDDING_DEVICE:
+        return EMBEDDING_DEVICE
+    if torch.cuda.is_available():
+        return 'cuda'
+    if torch.backends.mps.is_available():
+        return 'mps'
+    return 'cpu'
+
+
+def get_embedding_fn(model_name : Optional[str] = None):
+    """
+    Returns the process-wide embedding model, loading it on first use. Workers that never
+    embed (delete, most parse jobs) therefore never import torch or hold a model copy.
+    `model_name` selects another model (e.g. one being re-embedded into); defaults to EMBEDDING_MODEL.
+    """
+    model_name = model_name or EMBEDDING_MODEL
+    embedding_fn = _embedding_fns.get(model_name)
+    if embedding_fn is None:
+        with _lock:
+            embedding_fn = _embedding_fns.get(model_name)
+            if embedding_fn is None:
+                from langchain_huggingface import HuggingFaceEmbeddings
+                device = _device()
+                log.info(f"Loading embedding model {model_name} on {device}")
+                embedding_fn = HuggingFaceEmbeddings(
+                    model_name = model_name,
+                    model_kwargs = {'device' : device},
+                    encode_kwargs = {'normalize_embeddings' : True}
+                )
+                _embedding_fns[model_name] = embedding_fn
+    return embedding_fn
+
+
+def embed_matrix(embedding_fn, texts : List[str]) -> np.ndarray:
+    """
+    Embeds `texts` into one contiguous (len(texts), dim) float32 array. `embed_documents` turns the
+    SentenceTransformer output into nested lists (a boxed float per dimension), so for
+    HuggingFaceEmbeddings the underlying model is called directly with the same settings.
+    """
+    client = getattr(embedding_fn, '_client', None)
+    if client is None or getattr(embedding_fn, 'multi_process', False):
+        return np.ascontiguousarray(embedding_fn.embed_documents(texts), dtype=np.float32)
+    if not texts:
+        return np.empty((0, client.get_sentence_embedding_dimension()), dtype=np.float32)
+    matrix = client.encode(
+        [text.replace('\n', ' ') for text in texts],
+        **{'show_progress_bar' : False, **embedding_fn.encode_kwargs, 'convert_to_numpy' : True}
+    )
+    return np.ascontiguousarray(matrix, dtype=np.float32)
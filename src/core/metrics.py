@@ -0,0 +1,117 @@
+import os
+import time
+import logging
+from contextlib import contextmanager
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, start_http_server
+)
+from prometheus_client.core import GaugeMetricFamily
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+
+# --- chat pipeline ---
+CHAT_STAGE_SECONDS = Histogram(
+    'rag_chat_stage_seconds', 'Latency of RAG.ask stages.', ['stage'], buckets = LATENCY_BUCKETS
+)
+RETRIEVAL_QUERY_SECONDS = Histogram(
+    'rag_retrieval_query_seconds', 'Latency of each retrieval SQL query.', ['query'], buckets = LATENCY_BUCKETS
+)
+CHAT_REQUESTS = Counter('rag_chat_requests_total', 'Chat requests by outcome.', ['outcome'])
+GENERATION_TTFT_SECONDS = Histogram(
+    'rag_generation_ttft_seconds', 'Time to first generated token.', buckets = LATENCY_BUCKETS
+)
+GENERATION_TOKENS_PER_SECOND = Histogram(
+    'rag_generation_tokens_per_second', 'Decode speed of the generation call.',
+    buckets = (1, 2, 5, 10, 20, 30, 40, 60, 80, 120, 160)
+)
+RERANK_PAIRS = Histogram(
+    'rag_rerank_pairs', 'Pairs sent to the cross-encoder per request.', buckets = (5, 10, 20, 40, 60, 80, 120)
+)
+RERANK_CACHE_LOOKUPS = Counter('rag_rerank_cache_lookups_total', 'Reranker score cache lookups by result.', ['result'])
+CONTEXT_TOKENS = Histogram(
+    'rag_context_tokens', 'Estimated context tokens sent to the LLM.', buckets = (256, 512, 1024, 2048, 3072, 4096, 6144)
+)
+
+# --- scheduling ---
+SCHEDULER_QUEUE_DEPTH = Gauge('rag_scheduler_queue_depth', 'Requests waiting for a stage slot.', ['stage'])
+SCHEDULER_IN_FLIGHT = Gauge('rag_scheduler_in_flight', 'Requests holding a stage slot.', ['stage'])
+SCHEDULER_SHED = Counter('rag_scheduler_shed_total', 'Requests rejected with 429 because a stage queue was full.', ['stage'])
+SCHEDULER_WAIT_SECONDS = Histogram(
+    'rag_scheduler_wait_seconds', 'Time spent queued for a stage slot.', ['stage'], buckets = LATENCY_BUCKETS
+)
+CHAT_COALESCED = Counter('rag_chat_coalesced_total', 'Chat requests served by an identical in-flight request.')
+
+# --- ingestion ---
+INGEST_STAGE_SECONDS = Histogram(
+    'ingest_stage_seconds', 'Latency of ingestion stages (load, chunk, embed, write).', ['stage'],
+    buckets = LATENCY_BUCKETS + (320, 640, 1280)
+)
+INGEST_PAGES = Counter('ingest_pages_parsed_total', 'Pages parsed.')
+INGEST_CHUNKS_EMBEDDED = Counter('ingest_chunks_embedded_total', 'Chunks embedded.')
+INGEST_CHUNKS_WRITTEN = Counter('ingest_chunks_written_total', 'Chunks written to the database.')
+INGEST_EMBED_RATE = Histogram(
+    'ingest_embed_chunks_per_second', 'Embedding throughput per document.',
+    buckets = (1, 5, 10, 25, 50, 100, 200, 400, 800)
+)
+REEMBED_CHUNKS = Counter('reembed_chunks_total', 'Chunks re-embedded into a new embedding model.', ['model'])
+CELERY_TASK_SECONDS = Histogram(
+    'celery_task_seconds', 'Celery task run time.', ['task', 'state'], buckets = LATENCY_BUCKETS + (320, 640, 1280)
+)
+
+
+@contextmanager
+def timed(histogram, *labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric = histogram.labels(*labels) if labels else histogram
+        metric.observe(time.perf_counter() - started)
+
+
+class PoolCollector:
+    """Exposes src.core.database.pool_stats() as gauges at scrape time."""
+
+    def collect(self):
+        from src.core.database import pool_stats
+        gauges = {
+            key : GaugeMetricFamily(f'db_pool_{key}', f'DB pool {key}.', labels = ['engine'])
+            for key in ['size', 'checked_out', 'overflow', 'checkouts', 'invalidated', 'hold_seconds_total']
+        }
+        for engine, stats in pool_stats().items():
+            for key, gauge in gauges.items():
+                gauge.add_metric([engine], stats[key])
+        yield from gauges.values()
+
+
+# Live collectors (read at scrape time, never written to the multiprocess files) that every served registry gets.
+_COLLECTORS = []
+
+
+def register_collector(collector) -> None:
+    _COLLECTORS.append(collector)
+    REGISTRY.register(collector)
+
+
+def _registry():
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        # These report the process answering the scrape only.
+        for collector in _COLLECTORS:
+            registry.register(collector)
+        return registry
+    return REGISTRY
+
+
+def render_metrics():
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port : int):
+    # Prefork pools observe metrics in child processes; they are only visible here with PROMETHEUS_MULTIPROC_DIR set.
+    start_http_server(port, registry = _registry())
+    log.info(f"Metrics server listening on :{port}")
@@ -0,0 +1,111 @@
+import os
+import mmap
+import time
+import hashlib
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass
+from uuid import uuid4
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Shared by the API (writes uploads) and the parse workers (read them); see docker-compose.yml.
+OBJECT_STORE_DIR = os.getenv('OBJECT_STORE_DIR', os.path.join(BASE_DIR, '..', '..', 'objects'))
+# Objects touched more recently than this are never removed: an upload of the same bytes may be about to use them.
+OBJECT_GC_GRACE_SECONDS = int(os.getenv('OBJECT_GC_GRACE_SECONDS', 3600))
+
+
+@dataclass
+class StoredObject:
+    content_hash : str
+    size : int
+    path : str
+    created : bool
+
+
+class ObjectWriter:
+    """
+    Streams one upload into the store: bytes go to a temporary file while the sha256 is updated,
+    and `commit` renames it to its content address. Nothing is held in memory beyond one chunk.
+    """
+
+    def __init__(self, store : 'ObjectStore', max_bytes : int = 0):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._tmp_path = os.path.join(store.tmp_dir, uuid4().hex)
+        self._file = open(self._tmp_path, 'wb')
+
+    def write(self, data : bytes) -> None:
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise ValueError(f'Upload exceeds {self.max_bytes} bytes')
+        self._hash.update(data)
+        self._file.write(data)
+
+    def commit(self) -> StoredObject:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        content_hash = self._hash.hexdigest()
+        path = self.store.path(content_hash)
+        if os.path.exists(path):
+            # Same bytes already stored: keep the existing object, touched so removal waits out the grace period.
+            os.remove(self._tmp_path)
+            os.utime(path)
+            return StoredObject(content_hash, self.size, path, created=False)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self._tmp_path, path)
+        return StoredObject(content_hash, self.size, path, created=True)
+
+    def abort(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class ObjectStore:
+    """Content-addressed files on local disk: objects/sha256/ab/cd/<hash>."""
+
+    def __init__(self, root : str = OBJECT_STORE_DIR):
+        self.root = os.path.abspath(root)
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, content_hash : str) -> str:
+        return os.path.join(self.root, 'sha256', content_hash[:2], content_hash[2:4], content_hash)
+
+    def exists(self, content_hash : str) -> bool:
+        return os.path.exists(self.path(content_hash))
+
+    def writer(self, max_bytes : int = 0) -> ObjectWriter:
+        return ObjectWriter(self, max_bytes)
+
+    def hashes(self):
+        for _, _, files in os.walk(os.path.join(self.root, 'sha256')):
+            yield from files
+
+    def remove(self, content_hash : str, grace_seconds : int = OBJECT_GC_GRACE_SECONDS) -> bool:
+        """Deletes an object unless it is missing or was written or re-uploaded within `grace_seconds`."""
+        path = self.path(content_hash)
+        try:
+            if time.time() - os.stat(path).st_mtime < grace_seconds:
+                return False
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+
+@contextmanager
+def mapped(path : str):
+    """Read-only memory map of a stored object; pages are loaded by the OS as the parser touches them."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
@@ -0,0 +1,64 @@
+import io
+import json
+import struct
+from typing import Iterable, List, Optional, Sequence
+import numpy as np
+
+# PostgreSQL's binary COPY format: signature, flags, header extension length, tuples, then -1.
+HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+TRAILER = struct.pack('!h', -1)
+NULL = struct.pack('!i', -1)
+
+
+def text_field(value : Optional[str]) -> bytes:
+    # Also the binary input of varchar, enum labels and json.
+    if value is None:
+        return NULL
+    data = value.encode('utf-8')
+    return struct.pack('!i', len(data)) + data
+
+
+def int4_field(value : Optional[int]) -> bytes:
+    return NULL if value is None else struct.pack('!ii', 4, value)
+
+
+def json_field(value) -> bytes:
+    return NULL if value is None else text_field(json.dumps(value, ensure_ascii = False))
+
+
+def vector_fields(matrix : np.ndarray, present : Optional[Sequence[bool]] = None) -> List[bytes]:
+    """
+    pgvector's binary input (int16 dim, int16 unused, big-endian float4s) for every row of a
+    2-D array, converted in one NumPy call. Rows where `present` is False become NULL.
+    """
+    matrix = np.ascontiguousarray(matrix, dtype = '>f4')
+    if matrix.ndim != 2:
+        raise ValueError(f'Expected a 2-D array of vectors, got shape {matrix.shape}')
+    rows, dim = matrix.shape
+    prefix = struct.pack('!ihh', 4 + 4 * dim, dim, 0)
+    data = memoryview(matrix.tobytes())
+    size = 4 * dim
+    return [
+        prefix + data[i * size:(i + 1) * size] if present is None or present[i] else NULL
+        for i in range(rows)
+    ]
+
+
+def row(*fields : bytes) -> bytes:
+    return struct.pack('!h', len(fields)) + b''.join(fields)
+
+
+def copy_rows(cursor, table : str, columns : Sequence[str], rows : Iterable[bytes]) -> int:
+    """Loads pre-encoded rows (see `row`) with one COPY ... FROM STDIN (FORMAT binary); returns the row count."""
+    buffer = io.BytesIO()
+    buffer.write(HEADER)
+    count = 0
+    for encoded in rows:
+        buffer.write(encoded)
+        count += 1
+    if not count:
+        return 0
+    buffer.write(TRAILER)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT binary)", buffer)
+    return count
@@ -0,0 +1,94 @@
+import os
+import logging
+from contextlib import contextmanager
+from opentelemetry import context, propagate, trace
+from opentelemetry.propagators.textmap import Getter
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+log = logging.getLogger(__name__)
+
+# otlp | console | file | none. OTLP honours the standard OTEL_EXPORTER_OTLP_* variables.
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'none').lower()
+TRACING_FILE = os.getenv('TRACING_FILE', 'traces.jsonl')
+
+tracer = trace.get_tracer('rag')
+_configured = False
+
+
+def _exporter():
+    if TRACING_EXPORTER == 'otlp':
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    if TRACING_EXPORTER == 'console':
+        return ConsoleSpanExporter()
+    if TRACING_EXPORTER == 'file':
+        # One JSON span per line, easy to grep or load for a single slow request.
+        return ConsoleSpanExporter(
+            out = open(TRACING_FILE, 'a', encoding = 'utf-8'),
+            formatter = lambda span: span.to_json(indent = None) + os.linesep
+        )
+    return None
+
+
+def setup_tracing(service_name : str) -> None:
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    exporter = _exporter()
+    if exporter is None:
+        return
+    provider = TracerProvider(resource = Resource.create({'service.name' : service_name}))
+    # BatchSpanProcessor restarts its export thread after fork, so prefork Celery children keep exporting.
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    log.info(f"Tracing enabled for {service_name} ({TRACING_EXPORTER})")
+
+
+@contextmanager
+def traced(name : str, **attributes):
+    with tracer.start_as_current_span(name) as span:
+        for key, value in attributes.items():
+            if value is not None:
+                span.set_attribute(key, value)
+        yield span
+
+
+def set_attributes(attributes : dict, span = None) -> None:
+    span = span or trace.get_current_span()
+    for key, value in attributes.items():
+        if isinstance(value, (bool, int, float, str)):
+            span.set_attribute(key, value)
+
+
+class _RequestGetter(Getter):
+    # Celery exposes custom message headers as attributes of task.request.
+    def get(self, carrier, key):
+        value = getattr(carrier, key, None)
+        if value is None:
+            return None
+        return value if isinstance(value, list) else [value]
+
+    def keys(self, carrier):
+        return []
+
+
+def inject_headers(headers : dict) -> None:
+    propagate.inject(headers)
+
+
+def start_task_span(name : str, request):
+    """Starts a consumer span parented to the publisher's context; returns (span, token) for end_task_span."""
+    parent = propagate.extract(request, getter = _RequestGetter())
+    span = tracer.start_span(name, context = parent, kind = trace.SpanKind.CONSUMER)
+    token = context.attach(trace.set_span_in_context(span, parent))
+    return span, token
+
+
+def end_task_span(span, token, state : str = None) -> None:
+    if state:
+        span.set_attribute('celery.state', state)
+    span.end()
+    context.detach(token)
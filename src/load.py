@@ -1,7 +1,9 @@
 import os
+import codecs
 import pickle
 import re
 from typing import List
+from src.core.objects import mapped
 from langchain.docstore.document import Document
 from langchain_pymupdf4llm import PyMuPDF4LLMLoader
 from langchain_community.document_loaders.parsers.images import TesseractBlobParser
@@ -27,18 +29,136 @@ def preprocess_text_unified(text: str) -> str:
     return text
 
 
-def load_from_document(full_pdf_path: str) -> List[Document]:
+# Opened with PyMuPDF (paged); the text formats are split into pages on form feeds.
+PYMUPDF_FORMATS = {'pdf', 'xps', 'epub', 'mobi', 'fb2', 'cbz'}
+TEXT_FORMATS = {'txt', 'md'}
+HTML_FORMATS = {'html', 'htm'}
+SUPPORTED_FORMATS = PYMUPDF_FORMATS | TEXT_FORMATS | HTML_FORMATS
+
+
+def _pages(texts: List[str]) -> List[Document]:
+    pages = []
+    for page_num, text in enumerate(texts):
+        cleaned_content = preprocess_text_unified(text)
+        # Only include pages that have a meaningful amount of text
+        if len(cleaned_content) > 20:
+            pages.append(Document(page_content=cleaned_content, metadata={'page': page_num}))
+    return pages
+
+
+# Bytes decoded per step for text and HTML, so only the extracted text is ever held in the heap.
+DECODE_SLICE_BYTES = 1 << 20
+
+
+def _decoded_slices(buffer):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    view = memoryview(buffer)
+    try:
+        for start in range(0, len(view), DECODE_SLICE_BYTES):
+            yield decoder.decode(view[start:start + DECODE_SLICE_BYTES])
+        yield decoder.decode(b'', final=True)
+    finally:
+        view.release()
+
+
+def _text_pages(buffer) -> List[str]:
+    pages, current = [], []
+    for text in _decoded_slices(buffer):
+        *done, rest = text.split('\f')
+        for part in done:
+            current.append(part)
+            pages.append(''.join(current))
+            current = []
+        current.append(rest)
+    pages.append(''.join(current))
+    return pages
+
+
+class _HtmlText:
+    """lxml parser target keeping the visible strings, like BeautifulSoup's get_text('\\n')."""
+
+    SKIP = {'script', 'style', 'noscript', 'template'}
+
+    def __init__(self):
+        self.strings = []
+        self.current = []
+        self.skipping = 0
+
+    def _flush(self):
+        if self.current:
+            self.strings.append(''.join(self.current))
+            self.current = []
+
+    def start(self, tag, attrib):
+        self._flush()
+        if tag in self.SKIP:
+            self.skipping += 1
+
+    def end(self, tag):
+        self._flush()
+        if tag in self.SKIP:
+            self.skipping -= 1
+
+    def data(self, data):
+        if not self.skipping:
+            self.current.append(data)
+
+    def close(self):
+        self._flush()
+        return '\n'.join(self.strings)
+
+
+def _html_text(buffer) -> str:
+    from lxml import etree
+    parser = etree.HTMLParser(target=_HtmlText())
+    for text in _decoded_slices(buffer):
+        parser.feed(text)
+    return parser.close()
+
+
+def load_from_file(path: str, format: str = 'pdf') -> List[Document]:
+    """
+    Loads a stored file of any SUPPORTED_FORMATS through a read-only memory map: PyMuPDF reads
+    the mapped pages directly, and text and HTML are decoded slice by slice, so the worker never
+    copies the whole file into its heap. Pages carry 0-based 'page' metadata.
+    """
+    format = format.lower()
+    if format not in SUPPORTED_FORMATS:
+        raise ValueError(f'Unsupported format {format}; expected one of {sorted(SUPPORTED_FORMATS)}')
+    with mapped(path) as buffer:
+        if format in PYMUPDF_FORMATS:
+            import pymupdf
+            import pymupdf4llm
+            view = memoryview(buffer)
+            document = pymupdf.open(stream=view, filetype=format)
+            try:
+                chunks = pymupdf4llm.to_markdown(document, page_chunks=True, table_strategy="lines_strict", show_progress=False)
+            finally:
+                # Both must let go of the mapping before it is unmapped.
+                document.close()
+                del document
+                view.release()
+            return _pages([chunk['text'] for chunk in chunks])
+        if format in HTML_FORMATS:
+            return _pages([_html_text(buffer)])
+        return _pages(_text_pages(buffer))
+
+
+def load_from_document(full_pdf_path: str, format: str = 'pdf') -> List[Document]:
     """
-    Loads a PDF document, processes its pages, and returns a single list of documents.
-    Caches the processed result for faster subsequent loads.
+    Loads a document from data/, processes its pages, and returns a single list of documents.
+    PDFs are cached after processing for faster subsequent loads; other formats go through load_from_file.
     
     Args:
-        full_pdf_path: The full, absolute path to the PDF file.
+        full_pdf_path: The file name under data/, without extension.
+        format: The file extension.
     """
-    F_PATH = os.path.join(DATA_DIR, f'{full_pdf_path}.pdf')
+    F_PATH = os.path.join(DATA_DIR, f'{full_pdf_path}.{format}')
     if not os.path.exists(F_PATH):
         logging.error(f'File does not exist: {full_pdf_path}')
         return []
+    if format != 'pdf':
+        return load_from_file(F_PATH, format)
 
     file_basename = os.path.basename(full_pdf_path)
     cache_path = os.path.join(PROCESSED_DIR, f'{file_basename}.pkl')
@@ -18,20 +18,24 @@ class Chunk(Base):
     content: Mapped[str] = mapped_column(String)
     chunk_level: Mapped[ChunkLevel] = mapped_column(Enum(ChunkLevel))
     chunk_metadata: Mapped[dict] = mapped_column(JSON)
-    embedding: Mapped[Vector] = mapped_column(Vector(1024))
+    # Vector of the inline embedding model; other models store theirs in chunk_embeddings.
+    embedding: Mapped[Optional[Vector]] = mapped_column(Vector(1024), nullable=True)
 
     source_doc_id: Mapped[int] = mapped_column(
-        ForeignKey('source_documents.id')
+        ForeignKey('source_documents.id', ondelete='CASCADE'),
+        index=True
     )
 
     source_documents: Mapped['SourceDocument'] = relationship(back_populates='chunks')
     parent_id: Mapped[Optional[str]] = mapped_column(
-        ForeignKey('chunks.id'),
-        nullable=True
+        ForeignKey('chunks.id', ondelete='CASCADE'),
+        nullable=True,
+        index=True
     )
     parent: Mapped[Optional['Chunk']] = relationship(
         back_populates='children', remote_side=[id]
     )
     children: Mapped[List['Chunk']] = relationship(
-        back_populates="parent"
+        back_populates="parent",
+        passive_deletes=True
     )
\ No newline at end of file
@@ -0,0 +1,54 @@
+import enum
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import String, Integer, Float, Boolean, Enum, DateTime, ForeignKey, Index, func, text
+from sqlalchemy.orm import Mapped, mapped_column
+from pgvector.sqlalchemy import Vector
+from src.core.database import Base
+
+
+class EmbeddingModelStatus(enum.Enum):
+    BUILDING = 'BUILDING'
+    ACTIVE = 'ACTIVE'
+    RETIRED = 'RETIRED'
+    FAILED = 'FAILED'
+
+
+class EmbeddingModel(Base):
+    """
+    One row per embedding model the corpus has been embedded with. `inline` models keep their
+    vectors in chunks.embedding / source_documents.centroid; the others use the side tables below.
+    Exactly one model is ACTIVE and serves retrieval.
+    """
+    __tablename__ = 'embedding_models'
+    __table_args__ = (
+        Index('uq_embedding_models_active', 'status', unique=True, postgresql_where=text("status = 'ACTIVE'")),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String)
+    dim: Mapped[int] = mapped_column(Integer)
+    inline: Mapped[bool] = mapped_column(Boolean, default=False, server_default='false')
+    status: Mapped[EmbeddingModelStatus] = mapped_column(
+        Enum(EmbeddingModelStatus), default=EmbeddingModelStatus.BUILDING
+    )
+    chunks_total: Mapped[int] = mapped_column(Integer, default=0, server_default='0')
+    chunks_done: Mapped[int] = mapped_column(Integer, default=0, server_default='0')
+    chunks_per_second: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    error: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+    activated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+
+class ChunkEmbedding(Base):
+    __tablename__ = 'chunk_embeddings'
+    chunk_id: Mapped[str] = mapped_column(ForeignKey('chunks.id', ondelete='CASCADE'), primary_key=True)
+    model_id: Mapped[int] = mapped_column(ForeignKey('embedding_models.id', ondelete='CASCADE'), primary_key=True, index=True)
+    # Dimension-less so models of any size share the table; each model gets a partial HNSW index on a typed cast.
+    embedding: Mapped[Vector] = mapped_column(Vector())
+
+
+class DocumentCentroid(Base):
+    __tablename__ = 'document_centroids'
+    source_doc_id: Mapped[int] = mapped_column(ForeignKey('source_documents.id', ondelete='CASCADE'), primary_key=True)
+    model_id: Mapped[int] = mapped_column(ForeignKey('embedding_models.id', ondelete='CASCADE'), primary_key=True)
+    centroid: Mapped[Vector] = mapped_column(Vector())
@@ -1,7 +1,9 @@
 import enum
 from datetime import datetime
-from sqlalchemy import String, Integer, Enum, DateTime, func, ForeignKey
+from sqlalchemy import String, Integer, Enum, DateTime, func, ForeignKey, JSON
+from typing import Optional
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from pgvector.sqlalchemy import Vector
 from src.core.database import Base
 
 class IngestStatus(enum.Enum):
@@ -16,14 +18,22 @@ class SourceDocument(Base):
     media_id : Mapped[int] = mapped_column(Integer, unique = True, index = True)
     file_name: Mapped[str] = mapped_column(String)
     file_path: Mapped[str] = mapped_column(String, unique=True)
+    # sha256 of the uploaded bytes (object store key); NULL for files read from data/.
+    content_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True, index=True)
+    format: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     page_count: Mapped[int] = mapped_column(Integer)
     status: Mapped[IngestStatus] = mapped_column(
         Enum(IngestStatus), default=IngestStatus.PENDING
     )
     created_at: Mapped[datetime] =   mapped_column(DateTime, default=func.now())
     processed_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    centroid: Mapped[Optional[Vector]] = mapped_column(Vector(1024), nullable=True)
+    chunks_embedded: Mapped[int] = mapped_column(Integer, default=0, server_default='0')
+    chunks_written: Mapped[int] = mapped_column(Integer, default=0, server_default='0')
+    stage_timings: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
     chunks:Mapped[list['Chunk']] = relationship(
         back_populates='source_documents',
-        cascade='all, delete-orphan'               
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
 
@@ -0,0 +1,113 @@
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Tuple
+from langchain_core.documents import Document
+
+from .policy import estimate_tokens
+
+MIN_OVERLAP = 20
+MAX_OVERLAP = 600
+
+
+@dataclass
+class PackingReport:
+    input_docs : int = 0
+    output_blocks : int = 0
+    input_tokens : int = 0
+    output_tokens : int = 0
+    collapsed_children : int = 0
+    merged : int = 0
+    trimmed_chars : int = 0
+    dropped_for_budget : int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.input_tokens - self.output_tokens
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), 'tokens_saved' : self.tokens_saved}
+
+
+def _overlap(left : str, right : str) -> int:
+    # Longest suffix of `left` that is also a prefix of `right`.
+    upper = min(len(left), len(right), MAX_OVERLAP)
+    for size in range(upper, MIN_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _collapse_children(docs : List[Document], report : PackingReport) -> List[Document]:
+    parent_ids = {
+        doc.metadata.get('id') for doc in docs
+        if doc.metadata.get('chunk_level') == 'PARENT' and doc.metadata.get('id')
+    }
+    parents = [doc.page_content for doc in docs if doc.metadata.get('chunk_level') == 'PARENT']
+    kept = []
+    for doc in docs:
+        if doc.metadata.get('chunk_level') == 'CHILD' and (
+            doc.metadata.get('parent_id') in parent_ids or any(doc.page_content in p for p in parents)
+        ):
+            report.collapsed_children += 1
+            continue
+        kept.append(doc)
+    return kept
+
+
+def _merge_same_page(docs : List[Document], report : PackingReport) -> List[Document]:
+    # Keeps rerank order by first appearance; later chunks from the same page are folded into that block.
+    blocks : Dict[Tuple, List[str]] = {}
+    order : List[Tuple] = []
+    metadata : Dict[Tuple, dict] = {}
+    for doc in docs:
+        key = (doc.metadata.get('source_doc_id'), doc.metadata.get('page'))
+        text = doc.page_content
+        if key not in blocks:
+            blocks[key], metadata[key] = [text], dict(doc.metadata)
+            order.append(key)
+            continue
+        parts = blocks[key]
+        if any(text in part for part in parts):
+            report.trimmed_chars += len(text)
+            report.merged += 1
+            continue
+        for i, part in enumerate(parts):
+            size = _overlap(part, text)
+            if size:
+                parts[i] = part + text[size:]
+                break
+            size = _overlap(text, part)
+            if size:
+                parts[i] = text + part[size:]
+                break
+        else:
+            parts.append(text)
+            size = 0
+        report.trimmed_chars += size
+        report.merged += 1
+    return [
+        Document(page_content="\n".join(blocks[key]), metadata=metadata[key])
+        for key in order
+    ]
+
+
+def pack_context(docs : List[Document], token_budget : int) -> Tuple[List[Document], PackingReport]:
+    """
+    Collapses children into selected parents, merges chunks from the same page
+    (trimming the splitter overlap between them) and cuts the result to `token_budget`.
+    """
+    report = PackingReport(
+        input_docs = len(docs),
+        input_tokens = sum(estimate_tokens(doc.page_content) for doc in docs)
+    )
+    packed = _merge_same_page(_collapse_children(docs, report), report)
+    kept, used = [], 0
+    for doc in packed:
+        tokens = estimate_tokens(doc.page_content)
+        if kept and used + tokens > token_budget:
+            report.dropped_for_budget += 1
+            continue
+        kept.append(doc)
+        used += tokens
+    report.output_blocks = len(kept)
+    report.output_tokens = used
+    return kept, report
@@ -1,5 +1,9 @@
 from pydantic import BaseModel, Field
 
+# Every template keeps its instructions as a fixed prefix and puts the per-request
+# fields ({context}, {question}, {lang}, ...) at the end, so Ollama can reuse the
+# KV cache of the instruction prefix across requests.
+
 class RelevanceCheck(BaseModel):
     relevance_score: int = Field(description="An integer value between 0 and 10 representing the relevance of the context to the query.")
 
@@ -7,11 +11,11 @@ RELEVANCE_PROMPT = """You are an expert at evaluating the relevance of a given c
 Your sole task is to determine if the provided context contains enough information to answer the query.
 Respond with ONLY a JSON object containing a single key 'relevance_score' with an integer value between 0 (not relevant at all) and 10 (perfectly relevant).
 {format_instructions}
-Query: {query}
 Context:
 ---
 {context}
 ---
+Query: {query}
 """
 
 EN_PROMPT = """You are a professional document analysis assistant. Your task is to answer the user's question as accurately and in as much detail as possible, using only information from the provided CONTEXT.
@@ -20,7 +24,7 @@ MANDATORY RULES:
 1.  DETAILED ANSWER: Extract all relevant information, data, and points from the context to create a comprehensive answer. Do not summarize briefly or omit information.
 2.  STRICT CITATION: Every piece of information you provide must be accompanied by a page citation. Append `(Page: [number])` immediately after the sentence or point containing the information.
 3.  USE CONTEXT ONLY: Absolutely do not use external knowledge. If the answer is not in the context, state clearly: "This information is not available in the provided document."
-4.  MAINTAIN LANGUAGE: Always answer in the language of the question, which is {lang}.
+4.  MAINTAIN LANGUAGE: Always answer in the language of the question, given as LANGUAGE below.
 5.  NO MARKDOWN: Write the answer as plain text. Do not use formatting characters like `**`, `*`, `#`, or bullet points.
 
 EXAMPLE OF OUTPUT FORMAT:
@@ -50,7 +54,7 @@ QUY TẮC BẮT BUỘC:
 3.  QUY TẮC VỀ NGỮ CẢNH:
     a. Luôn trả lời DỰA VÀO NGỮ CẢNH. Tuyệt đối không dùng kiến thức bên ngoài.
     b. **CHỈ KHI** bạn đã tìm kiếm kỹ trong ngữ cảnh và **hoàn toàn không tìm thấy** thông tin để trả lời câu hỏi, **thì câu trả lời DUY NHẤT của bạn** phải là: "Tôi không tìm thấy thông tin về [chủ đề của câu hỏi] trong tài liệu được cung cấp." Không được viết gì thêm.
-4.  GIỮ NGUYÊN NGÔN NGỮ: Luôn trả lời bằng ngôn ngữ của câu hỏi, tức là {lang}.
+4.  GIỮ NGUYÊN NGÔN NGỮ: Luôn trả lời bằng ngôn ngữ của câu hỏi, được ghi ở mục NGÔN NGỮ bên dưới.
 5.  SUY LUẬN VÀ TÍNH TOÁN: Nếu câu hỏi yêu cầu tính toán, hãy làm theo các bước sau:
     a. Trích xuất công thức chính xác từ NGỮ CẢNH.
     b. Liệt kê tất cả các giá trị cần thiết từ câu hỏi và NGỮ CẢNH.
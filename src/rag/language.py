@@ -0,0 +1,49 @@
+import os
+import re
+import logging
+from functools import lru_cache
+from langdetect import DetectorFactory, detect, LangDetectException
+
+log = logging.getLogger(__name__)
+
+DEFAULT_LANGUAGE = os.getenv("DEFAULT_LANGUAGE", "vi")
+LANG_CACHE_SIZE = int(os.getenv("LANG_CACHE_SIZE", 4096))
+
+# Letters (any case, with or without tone marks) that only occur in Vietnamese among the languages we serve.
+VI_DIACRITICS = re.compile(
+    r'[ăâđêôơưĂÂĐÊÔƠƯ'
+    r'àáảãạằắẳẵặầấẩẫậèéẻẽẹềếểễệìíỉĩịòóỏõọồốổỗộờớởỡợùúủũụừứửữựỳýỷỹỵ'
+    r'ÀÁẢÃẠẰẮẲẴẶẦẤẨẪẬÈÉẺẼẸỀẾỂỄỆÌÍỈĨỊÒÓỎÕỌỒỐỔỖỘỜỚỞỠỢÙÚỦŨỤỪỨỬỮỰỲÝỶỸỴ]'
+)
+VI_SPECIFIC = re.compile(r'[ăđơưạảấầẩẫậắằẳẵặẹẻẽếềểễệỉịọỏốồổỗộớờởỡợụủứừửữựỳỵỷỹĂĐƠƯ]')
+
+# langdetect is randomized unless seeded.
+DetectorFactory.seed = 0
+
+
+def warmup() -> None:
+    """Loads langdetect's profiles so the first live request does not pay for it."""
+    try:
+        detect("warm up the language profiles")
+    except LangDetectException:
+        pass
+    log.info("Language detector profiles loaded.")
+
+
+@lru_cache(maxsize=LANG_CACHE_SIZE)
+def _detect_cached(text : str) -> str:
+    try:
+        return detect(text)
+    except LangDetectException as l:
+        log.warning(f"Error in detecion : {l}")
+        return DEFAULT_LANGUAGE
+
+
+def detect_language(text : str) -> str:
+    text = (text or "").strip()
+    if not text:
+        return DEFAULT_LANGUAGE
+    # Fast path: Vietnamese-only letters settle the vi/en split without langdetect.
+    if VI_SPECIFIC.search(text) or len(VI_DIACRITICS.findall(text)) >= 2:
+        return "vi"
+    return _detect_cached(text)
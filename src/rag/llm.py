@@ -0,0 +1,110 @@
+import os
+import time
+import logging
+import httpx
+from typing import Any, Dict, Optional, Tuple
+from langchain_ollama import ChatOllama
+from src.core.tracing import traced, set_attributes
+from .policy import estimate_tokens
+from .scheduler import LLM_MAX_QUEUE, StageLimiter
+
+log = logging.getLogger(__name__)
+
+MODEL = os.getenv("MODEL", "llama3.1:8b")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 4))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", LLM_MAX_CONCURRENCY * 2))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 300))
+
+# num_ctx is a load-time option in Ollama: giving chains different values makes the
+# runner reload the model between calls, so keep them equal unless each chain has its own model.
+CHAIN_OPTIONS: Dict[str, Dict[str, int]] = {
+    "condense": {"num_ctx": 8192, "num_predict": 256},
+    "relevance": {"num_ctx": 8192, "num_predict": 32},
+    "generation": {"num_ctx": 8192, "num_predict": 4096},
+}
+
+
+def chain_options(chain : str) -> Dict[str, int]:
+    options = dict(CHAIN_OPTIONS[chain])
+    for key in options:
+        value = os.getenv(f"LLM_{chain.upper()}_{key.upper()}")
+        if value:
+            options[key] = int(value)
+    return options
+
+
+def build_llm(chain : str, model : Optional[str] = None, **overrides : Any) -> ChatOllama:
+    options = {**chain_options(chain), **overrides}
+    limits = httpx.Limits(
+        max_connections = LLM_MAX_CONNECTIONS,
+        max_keepalive_connections = LLM_MAX_CONNECTIONS,
+        keepalive_expiry = 300
+    )
+    kwargs = {}
+    if OLLAMA_BASE_URL:
+        kwargs["base_url"] = OLLAMA_BASE_URL
+    return ChatOllama(
+        model = model or MODEL,
+        keep_alive = OLLAMA_KEEP_ALIVE,
+        client_kwargs = {"limits" : limits, "timeout" : LLM_TIMEOUT},
+        **options,
+        **kwargs
+    )
+
+
+class LLMExecutor:
+    """
+    Runs chain invocations with at most `max_concurrency` in flight against Ollama and
+    at most `max_queue` waiting; past that, calls raise scheduler.Overloaded.
+    """
+
+    def __init__(self, max_concurrency : int = LLM_MAX_CONCURRENCY, max_queue : int = LLM_MAX_QUEUE):
+        self.max_concurrency = max_concurrency
+        self.limiter = StageLimiter("llm", max_concurrency, max_queue)
+
+    @property
+    def waiting(self) -> int:
+        return self.limiter.waiting
+
+    @property
+    def in_flight(self) -> int:
+        return self.limiter.in_flight
+
+    def slot(self):
+        return self.limiter.slot()
+
+    async def ainvoke(self, chain, inputs : Dict[str, Any], name : str = "chain"):
+        with traced(f"llm.{name}", **{"llm.queue_waiting" : self.waiting}) as span:
+            async with self.slot():
+                result = await chain.ainvoke(inputs)
+            span.set_attribute("llm.prompt_tokens_est", sum(estimate_tokens(str(v)) for v in inputs.values()))
+            return result
+
+    async def astream_text(self, chain, inputs : Dict[str, Any], name : str = "chain") -> Tuple[str, Dict[str, float]]:
+        """Streams a string-output chain and returns the text with its time-to-first-token and decode rate."""
+        with traced(f"llm.{name}", **{"llm.queue_waiting" : self.waiting}) as span:
+            text, stats = await self._astream_text(chain, inputs)
+            span.set_attribute("llm.prompt_tokens_est", sum(estimate_tokens(str(v)) for v in inputs.values()))
+            set_attributes({f"llm.{key}" : value for key, value in stats.items()}, span)
+            return text, stats
+
+    async def _astream_text(self, chain, inputs : Dict[str, Any]) -> Tuple[str, Dict[str, float]]:
+        async with self.slot():
+            started = time.perf_counter()
+            first_token_at = None
+            parts = []
+            async for piece in chain.astream(inputs):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(piece)
+            finished = time.perf_counter()
+        ttft = (first_token_at or finished) - started
+        decode_seconds = finished - (first_token_at or finished)
+        return "".join(parts), {
+            "ttft" : ttft,
+            "tokens" : len(parts),
+            "tokens_per_second" : len(parts) / decode_seconds if decode_seconds > 0 else 0.0,
+            "seconds" : finished - started,
+        }
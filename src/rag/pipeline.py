@@ -1,12 +1,23 @@
 import os
+import asyncio
 import logging
-from typing import List, Optional, Tuple
+from typing import AsyncIterator, List, Optional, Tuple
 from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser, PydanticOutputParser
 from langchain_core.prompts import PromptTemplate
-from langchain_ollama import ChatOllama
-from langdetect import detect, LangDetectException
-from .retrieval import retrieval_and_rerank
+from .retrieval import retrieval_and_rerank, retrieval_and_rerank_batch
+from src.core.embeddings import get_embedding_fn
+from .policy import RetrievalStats, estimate_tokens
+from .context import pack_context
+from .llm import LLMExecutor, build_llm, chain_options
+from .rewrite import QueryRewriter, REWRITE_WINDOW_TURNS
+from .sessions import SessionStore
+from .scheduler import EMBED_LIMITER, RERANK_LIMITER, Coalescer, Overloaded, admit, retry_overloaded
+from .language import detect_language, warmup as warmup_language
+from src.core.metrics import (
+    CHAT_REQUESTS, CHAT_STAGE_SECONDS, CONTEXT_TOKENS, GENERATION_TOKENS_PER_SECOND, GENERATION_TTFT_SECONDS, timed
+)
+from src.core.tracing import traced, set_attributes
 from .definitions import RelevanceCheck, RELEVANCE_PROMPT, PROMPT_TEMPLATES, CONDENSE_QUESTION_PROMPT
 
 logging.basicConfig(
@@ -15,14 +26,21 @@ logging.basicConfig(
 )
 log = logging.getLogger(__name__)
 
+RETRIEVAL_K = 40
+RETRIEVAL_TOP_K = 20
+
 class RAG:
     def __init__(self):
-        model_name = os.getenv("MODEL", "llama3.1:8b")
-        self.llm = ChatOllama(
-            model = model_name,
-            num_ctx = 8192,
-            num_predict = 4096
-        )
+        self.num_ctx = chain_options("generation")["num_ctx"]
+        self.llm = build_llm("generation")
+        self.relevance_llm = build_llm("relevance")
+        self.condense_llm = build_llm("condense")
+        self.executor = LLMExecutor()
+        warmup_language()
+        # Context has to share num_ctx with the longest prompt template and the answer.
+        template_tokens = max(estimate_tokens(t) for t in [RELEVANCE_PROMPT, *PROMPT_TEMPLATES.values()])
+        answer_reserve = int(os.getenv("RAG_ANSWER_RESERVE", 2048))
+        self.context_budget = max(512, self.num_ctx - template_tokens - answer_reserve)
 
         relevance_parser = PydanticOutputParser(pydantic_object = RelevanceCheck)
         relevance_prompt = PromptTemplate(
@@ -30,11 +48,14 @@ class RAG:
             input_variables = ["query", "context"],
             partial_variables = {"format_instructions" : relevance_parser.get_format_instructions()},
         )
-        self.relevance_chain = relevance_prompt | self.llm | relevance_parser
+        self.relevance_chain = relevance_prompt | self.relevance_llm | relevance_parser
         condense_prompt = PromptTemplate.from_template(
             CONDENSE_QUESTION_PROMPT
         )
-        self.condense_chain = condense_prompt | self.llm | StrOutputParser()
+        self.condense_chain = condense_prompt | self.condense_llm | StrOutputParser()
+        self.rewriter = QueryRewriter(self.condense_chain, self.executor, get_embedding_fn())
+        self.sessions = SessionStore()
+        self.coalescer = Coalescer()
         self.generation_chain = {
             lang : PromptTemplate.from_template(template) | self.llm | StrOutputParser()
             for lang, template in PROMPT_TEMPLATES.items()
@@ -49,68 +70,160 @@ class RAG:
             context_parts.append(context_part)
         return "\n\n---\n\n".join(context_parts)
 
-    async def ask(self, query : str, media_id : Optional[int] = None, chat_history : Optional[List[Tuple[str, str]]] = None, threshold : int = 7) -> str:
+    async def ask(self, query : str, media_id : Optional[int] = None, chat_history : Optional[List[Tuple[str, str]]] = None,
+                  threshold : int = 7, session_id : Optional[str] = None, media_ids : Optional[List[int]] = None) -> str:
+        """
+        `media_id` or `media_ids` restrict retrieval to those documents; several ids are searched together.
+        With a session_id the history comes from the session store, the new turn is saved
+        there and the returned history holds only that turn.
+        """
+        scope = tuple(sorted(set(media_ids or ([media_id] if media_id else []))))
+        # Shed before doing any work when a stage this request needs is already saturated.
+        admit(self.executor.limiter, EMBED_LIMITER, RERANK_LIMITER)
+        if session_id:
+            chat_history = await self._session_history(session_id)
+        with traced("RAG.ask", **{"rag.media_ids" : list(scope), "rag.history_turns" : len(chat_history or []), "rag.session" : bool(session_id)}) as span:
+            result = await self._ask(query, scope, chat_history, threshold)
+            set_attributes({f"rag.{key}" : value for key, value in (result.get("stats") or {}).items()}, span)
+        if session_id:
+            try:
+                await self.sessions.append(session_id, query, result["answer"])
+            except Exception as e:
+                log.warning(f"Could not save turn for session {session_id} : {e}")
+            result["history"] = result["history"][-1:]
+            result["session_id"] = session_id
+        return result
+
+    async def _session_history(self, session_id : str) -> List[Tuple[str, str]]:
+        # Only the turns the rewriter's window can use are read back.
+        try:
+            with timed(CHAT_STAGE_SECONDS, "session_load"):
+                return await self.sessions.history(session_id, last = REWRITE_WINDOW_TURNS)
+        except Exception as e:
+            log.warning(f"Could not load session {session_id}, answering without history : {e}")
+            return []
+
+    async def _ask(self, query : str, media_ids : Tuple[int, ...] = (), chat_history : Optional[List[Tuple[str, str]]] = None, threshold : int = 7) -> str:
         chat_history = chat_history or []
-        if chat_history:
-            formatted_history = "\n".join(
-                [f"Người dùng: {q}\nTrợ lý: {a}" for q, a in chat_history]
+        standalone_question = await self.rewriter.rewrite(query, chat_history)
+        log.info(f"Standalone Question: {standalone_question}")
+        # Identical in-flight questions (after rewriting) share one retrieval and generation.
+        key = (" ".join(standalone_question.lower().split()), media_ids, threshold)
+        answer, stats = await self.coalescer.run(key, lambda: self._answer(standalone_question, media_ids, threshold))
+        return {
+            "answer" : answer,
+            "history" : chat_history + [(query, answer)],
+            "stats" : dict(stats)
+        }
+
+    async def _answer(self, standalone_question : str, media_ids : Tuple[int, ...], threshold : int) -> Tuple[str, dict]:
+        stats = RetrievalStats()
+        with timed(CHAT_STAGE_SECONDS, "retrieval"):
+            retrieved_docs = await retrieval_and_rerank(
+                query = standalone_question,
+                media_ids = list(media_ids),
+                k = RETRIEVAL_K,
+                top_k = RETRIEVAL_TOP_K,
+                stats = stats
             )
-            standalone_question = await self.condense_chain.ainvoke({
-                "chat_history": formatted_history,
-                "question": query
-            })
-            log.info(f"Rewritten Question: {standalone_question}")
-        else:
-            standalone_question = query
-            log.info(f"Standalone Question: {standalone_question}")
-        try:
-            lang = detect(standalone_question)
-        except LangDetectException as l:
-            log.warning(f"Error in detecion : {l}")
-            lang = "vi"
+        return await self._respond(standalone_question, retrieved_docs, stats, threshold)
+
+    async def ask_batch(self, questions : List[str], media_id : Optional[int] = None, media_ids : Optional[List[int]] = None,
+                        threshold : int = 7, concurrency : Optional[int] = None) -> AsyncIterator[dict]:
+        """
+        Answers independent questions (no history) as one job: batched embedding, concurrent
+        searches, batched reranking, then up to `concurrency` relevance/generation calls at a time.
+        Yields {"index", "question", "answer", "stats"} (or "error") in completion order; a failed
+        question only errors its own line.
+        """
+        gate = asyncio.Semaphore(concurrency or self.executor.max_concurrency)
+        results : asyncio.Queue = asyncio.Queue()
+        tasks : List[asyncio.Task] = []
+
+        async def respond(index : int, docs : List[Document], stats : RetrievalStats):
+            item = {"index" : index, "question" : questions[index]}
+            try:
+                async with gate:
+                    answer, answer_stats = await retry_overloaded(lambda: self._respond(questions[index], docs, stats, threshold))
+                item.update(answer = answer, stats = answer_stats)
+            except Exception as e:
+                log.error(f"Batch question {index} failed : {e}")
+                item["error"] = str(e)
+            await results.put(item)
+
+        async def produce():
+            try:
+                try:
+                    async for index, docs, stats, error in retrieval_and_rerank_batch(
+                            questions, media_id = media_id, media_ids = media_ids, k = RETRIEVAL_K, top_k = RETRIEVAL_TOP_K):
+                        if error is None:
+                            tasks.append(asyncio.create_task(respond(index, docs, stats)))
+                        else:
+                            log.error(f"Batch question {index} failed : {error}")
+                            await results.put({"index" : index, "question" : questions[index], "error" : str(error)})
+                except Exception as e:
+                    # Only the shared query embedding fails every question; answers already started still finish.
+                    log.error(f"Batch retrieval failed : {e}")
+                    await results.put({"error" : str(e)})
+                await asyncio.gather(*tasks)
+            finally:
+                await results.put(None)
+
+        with traced("RAG.ask_batch", **{"batch.questions" : len(questions)}):
+            producer = asyncio.create_task(produce())
+            try:
+                while (item := await results.get()) is not None:
+                    yield item
+            finally:
+                # Also reached when the client disconnects: stop the searches and LLM calls nobody will read.
+                producer.cancel()
+                for task in tasks:
+                    task.cancel()
+
+    async def _respond(self, standalone_question : str, retrieved_docs : List[Document], stats : RetrievalStats,
+                       threshold : int) -> Tuple[str, dict]:
+        with timed(CHAT_STAGE_SECONDS, "language"):
+            lang = detect_language(standalone_question)
         log.info(f"FOUND LANGUAGE : {lang}")
-        retrieved_docs = await retrieval_and_rerank(
-            query = standalone_question,
-            media_id = media_id,
-            k = 40,
-            top_k = 20
-        )
+        log.info(f"Retrieval stats : {stats.as_dict()}")
         if not retrieved_docs:
             no_info_answer = "Không tìm thấy thông tin liên quan trong tài liệu."
             log.info("Không tìm thấy thông tin liên quan trong tài liệu.")
-            return {
-                "answer" : no_info_answer,
-                "history" : chat_history + [(query, no_info_answer)]
-            }
-        formatted_context = self._format_context(retrieved_docs)
+            CHAT_REQUESTS.labels("no_documents").inc()
+            return no_info_answer, stats.as_dict()
+        packed_docs, packing = pack_context(retrieved_docs, self.context_budget)
+        stats.packed_tokens = packing.output_tokens
+        stats.tokens_saved = packing.tokens_saved
+        log.info(f"Context packing : {packing.as_dict()}")
+        formatted_context = self._format_context(packed_docs)
+        CONTEXT_TOKENS.observe(packing.output_tokens)
         try:
-            relevancy = await self.relevance_chain.ainvoke({
-                "query" : query,
-                "context" : formatted_context
-            })
+            with timed(CHAT_STAGE_SECONDS, "relevance"):
+                relevancy = await self.executor.ainvoke(self.relevance_chain, {
+                    "query" : standalone_question,
+                    "context" : formatted_context
+                }, name = "relevance")
             if relevancy.relevance_score < threshold:
                 log.warning("Tài liệu được tìm thấy không đủ liên quan để trả lời câu hỏi này.")
+                CHAT_REQUESTS.labels("not_relevant").inc()
                 not_relevant_answer = "Tài liệu được tìm thấy không đủ liên quan để trả lời câu hỏi này."
-                return {
-                    "answer": not_relevant_answer,
-                    "history": chat_history + [(query, not_relevant_answer)]
-                }
+                return not_relevant_answer, stats.as_dict()
+        except Overloaded:
+            raise
         except Exception as e:
             log.error(f"Đã xảy ra lỗi trong quá trình kiểm tra mức độ liên quan: {e}")
             error_answer = f"Đã xảy ra lỗi trong quá trình kiểm tra mức độ liên quan: {e}"
-            return {
-                "answer": error_answer,
-                "history": chat_history + [(query, error_answer)]
-            }
+            CHAT_REQUESTS.labels("relevance_error").inc()
+            return error_answer, stats.as_dict()
         
-        final_answer = await self.generation_chain.get(lang, self.generation_chain['vi']).ainvoke({
+        final_answer, generation = await self.executor.astream_text(self.generation_chain.get(lang, self.generation_chain['vi']), {
             "context": formatted_context,
             "question": standalone_question,
-            "lang" : detect(query)
-        })
-        chat_history.append((query, final_answer))
-        return {
-            "answer" : final_answer,
-            "history" : chat_history
-        }
-        
\ No newline at end of file
+            "lang" : lang
+        }, name = "generation")
+        CHAT_STAGE_SECONDS.labels("generation").observe(generation["seconds"])
+        GENERATION_TTFT_SECONDS.observe(generation["ttft"])
+        GENERATION_TOKENS_PER_SECOND.observe(generation["tokens_per_second"])
+        CHAT_REQUESTS.labels("answered").inc()
+        log.info(f"Generation : {generation}")
+        return final_answer, stats.as_dict()
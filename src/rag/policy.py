@@ -0,0 +1,82 @@
+import os
+from dataclasses import dataclass, asdict
+from typing import List, Sequence
+
+
+def estimate_tokens(text : str) -> int:
+    # Rough llama-style estimate (~3 chars per token for mixed vi/en text); avoids loading a tokenizer per request.
+    return max(1, len(text) // 3)
+
+
+@dataclass
+class RetrievalPolicy:
+    routing_chunks : int = int(os.getenv('RAG_ROUTING_CHUNKS', 20))
+    routing_max_chunks : int = int(os.getenv('RAG_ROUTING_MAX_CHUNKS', 100))
+    routing_top_ids : int = int(os.getenv('RAG_ROUTING_TOP_IDS', 3))
+    min_candidates : int = int(os.getenv('RAG_MIN_CANDIDATES', 8))
+    max_candidates : int = int(os.getenv('RAG_MAX_CANDIDATES', 40))
+    distance_gap : float = float(os.getenv('RAG_DISTANCE_GAP', 0.15))
+    rerank_min : int = int(os.getenv('RAG_RERANK_MIN', 3))
+    rerank_max : int = int(os.getenv('RAG_RERANK_MAX', 20))
+    elbow_drop : float = float(os.getenv('RAG_ELBOW_DROP', 2.0))
+    context_tokens : int = int(os.getenv('RAG_CONTEXT_TOKENS', 4096))
+
+
+@dataclass
+class RetrievalStats:
+    routing_chunks : int = 0
+    candidates : int = 0
+    rerank_pairs : int = 0
+    rerank_cached : int = 0
+    selected : int = 0
+    context_tokens : int = 0
+    packed_tokens : int = 0
+    tokens_saved : int = 0
+    expanded : bool = False
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def cut_at_distance_gap(distances : Sequence[float], gap : float, min_keep : int) -> int:
+    """
+    Returns how many of the (ascending) distances to keep: everything within `gap`
+    of the best hit, but never fewer than `min_keep`.
+    """
+    if not distances:
+        return 0
+    best = distances[0]
+    keep = len(distances)
+    for i, distance in enumerate(distances):
+        if i >= min_keep and distance - best > gap:
+            keep = i
+            break
+    return keep
+
+
+def cut_at_score_elbow(scores : Sequence[float], min_keep : int, max_keep : int, min_drop : float) -> int:
+    """
+    Returns how many of the (descending) rerank scores to keep, cutting at the
+    largest drop between consecutive scores if that drop is at least `min_drop`.
+    """
+    upper = min(len(scores), max_keep)
+    if upper <= min_keep:
+        return upper
+    best_drop, cut = 0.0, upper
+    for i in range(max(min_keep, 1), upper):
+        drop = scores[i - 1] - scores[i]
+        if drop > best_drop:
+            best_drop, cut = drop, i
+    return cut if best_drop >= min_drop else upper
+
+
+def fit_to_budget(texts : Sequence[str], budget : int, min_keep : int = 1) -> List[int]:
+    """Returns the per-text token counts of the prefix of `texts` that fits in `budget`."""
+    kept, used = [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if len(kept) >= min_keep and used + tokens > budget:
+            break
+        kept.append(tokens)
+        used += tokens
+    return kept
@@ -0,0 +1,122 @@
+import os
+import re
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+from langchain_core.documents import Document
+
+from src.core.metrics import RERANK_CACHE_LOOKUPS
+from .rerankers import RerankerBackend
+
+# Scores kept per process (a few hundred bytes each); 0 disables the cache.
+RERANK_CACHE_SIZE = int(os.getenv('RERANK_CACHE_SIZE', 100000))
+
+
+def normalize_query(query : str) -> str:
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', query)).strip().casefold()
+
+
+def query_hash(query : str) -> str:
+    return hashlib.blake2b(normalize_query(query).encode('utf-8'), digest_size=12).hexdigest()
+
+
+def chunk_id_of(doc : Document) -> Optional[str]:
+    return doc.id or doc.metadata.get('id')
+
+
+class ScoreCache:
+    """
+    Bounded LRU of cross-encoder scores keyed by (normalized query hash, chunk id, reranker key).
+    Chunk ids are never reused for different text (re-ingestion creates new ids), so entries
+    only go stale by eviction.
+    """
+
+    def __init__(self, max_entries : int = RERANK_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._scores : 'OrderedDict[Hashable, float]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get_many(self, keys : Sequence[Optional[Hashable]]) -> List[Optional[float]]:
+        found = []
+        with self._lock:
+            for key in keys:
+                score = self._scores.get(key) if key is not None else None
+                if score is not None:
+                    self._scores.move_to_end(key)
+                found.append(score)
+            hits = sum(score is not None for score in found)
+            misses = sum(key is not None for key in keys) - hits
+            self.hits += hits
+            self.misses += misses
+        RERANK_CACHE_LOOKUPS.labels('hit').inc(hits)
+        RERANK_CACHE_LOOKUPS.labels('miss').inc(misses)
+        return found
+
+    def put_many(self, keys : Sequence[Optional[Hashable]], scores : Sequence[float]) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            for key, score in zip(keys, scores):
+                if key is None:
+                    continue
+                self._scores[key] = score
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._scores.clear()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'entries' : len(self),
+            'max_entries' : self.max_entries,
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'hit_ratio' : self.hit_ratio,
+        }
+
+
+def cached_scores(reranker : RerankerBackend, cache : Optional[ScoreCache],
+                  items : Sequence[Tuple[str, Document]]) -> Tuple[List[float], List[bool]]:
+    """
+    Scores (question, document) pairs, sending only the pairs missing from `cache` to the model.
+    Returns the scores in input order and, per pair, whether it came from the cache.
+    """
+    if cache is None or cache.max_entries <= 0:
+        return reranker.compute_score([(question, doc.page_content) for question, doc in items]), [False] * len(items)
+    hashes = {}
+    keys = []
+    for question, doc in items:
+        chunk_id = chunk_id_of(doc)
+        if chunk_id is None:
+            keys.append(None)
+            continue
+        if question not in hashes:
+            hashes[question] = query_hash(question)
+        keys.append((hashes[question], chunk_id, reranker.key))
+    scores = cache.get_many(keys)
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if missing:
+        computed = reranker.compute_score([(items[i][0], items[i][1].page_content) for i in missing])
+        for i, score in zip(missing, computed):
+            scores[i] = score
+        cache.put_many([keys[i] for i in missing], computed)
+    missed = set(missing)
+    return scores, [i not in missed for i in range(len(items))]
+
+
+RERANK_CACHE = ScoreCache()
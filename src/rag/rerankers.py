@@ -0,0 +1,201 @@
+import os
+import logging
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+log = logging.getLogger(__name__)
+
+RERANKER_VN_MODEL = os.getenv('VN_MODEL')
+# flag (FlagEmbedding, fp16 on a GPU), int8 (torch dynamic quantization), onnx, onnx-int8; auto picks flag on a GPU, else int8.
+# The quantized backends change scores (and so the elbow cut): opt in after checking bench_reranker's agreement.
+RERANK_BACKEND = os.getenv('RERANK_BACKEND', 'flag')
+# Passages are truncated so query + passage fit in this many tokens.
+RERANK_MAX_TOKENS = int(os.getenv('RERANK_MAX_TOKENS', 512))
+RERANK_BATCH_SIZE = int(os.getenv('RERANK_BATCH_SIZE', 32))
+RERANK_THREADS = int(os.getenv('RERANK_THREADS', 0))
+RERANK_ONNX_DIR = os.getenv('RERANK_ONNX_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'rag-rerankers'))
+
+Pair = Tuple[str, str]
+
+
+class RerankerBackend:
+    """A cross-encoder behind `compute_score(pairs) -> one raw score per pair`, in input order."""
+
+    name = 'base'
+
+    def __init__(self, model_name : str, max_tokens : int = RERANK_MAX_TOKENS, batch_size : int = RERANK_BATCH_SIZE):
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.batch_size = batch_size
+
+    @property
+    def key(self) -> str:
+        # Identifies the scores this backend produces: truncation changes them, batch size does not.
+        return f'{self.name}:{self.model_name}:{self.max_tokens}'
+
+    def compute_score(self, pairs : Sequence[Pair]) -> List[float]:
+        raise NotImplementedError
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.model_name}, max_tokens={self.max_tokens}, batch_size={self.batch_size})'
+
+
+class FlagBackend(RerankerBackend):
+    """FlagEmbedding's reranker; it sorts pairs by length itself. fp16 is only used on a GPU, where it helps."""
+
+    name = 'flag'
+
+    def __init__(self, model_name : str, max_tokens : int = RERANK_MAX_TOKENS, batch_size : int = RERANK_BATCH_SIZE):
+        super().__init__(model_name, max_tokens, batch_size)
+        import torch
+        from FlagEmbedding import FlagReranker
+        self.model = FlagReranker(
+            model_name, use_fp16=torch.cuda.is_available(), batch_size=batch_size, max_length=max_tokens
+        )
+
+    def compute_score(self, pairs : Sequence[Pair]) -> List[float]:
+        if not pairs:
+            return []
+        scores = self.model.compute_score(list(pairs))
+        return scores if isinstance(scores, list) else [scores]
+
+
+class _TokenizedBackend(RerankerBackend):
+    """
+    Shared batching for the CPU backends: pairs are tokenized once without padding, sorted by
+    length and cut into batches, so each batch pads only to its own longest pair instead of
+    every pair padding to the longest parent chunk.
+    """
+
+    tensor_type = 'np'
+
+    def _load_tokenizer(self):
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+
+    def _batches(self, pairs : Sequence[Pair]) -> Iterator[Tuple[List[int], Dict]]:
+        encoded = self.tokenizer(
+            [query for query, _ in pairs], [passage for _, passage in pairs],
+            truncation='longest_first', max_length=self.max_tokens
+        )
+        keys = [key for key in ('input_ids', 'attention_mask', 'token_type_ids') if key in encoded]
+        order = sorted(range(len(pairs)), key=lambda i: len(encoded['input_ids'][i]), reverse=True)
+        for start in range(0, len(order), self.batch_size):
+            idx = order[start:start + self.batch_size]
+            batch = self.tokenizer.pad(
+                {key : [encoded[key][i] for i in idx] for key in keys}, padding='longest', return_tensors=self.tensor_type
+            )
+            yield idx, batch
+
+    def _forward(self, batch : Dict) -> List[float]:
+        raise NotImplementedError
+
+    def compute_score(self, pairs : Sequence[Pair]) -> List[float]:
+        scores = [0.0] * len(pairs)
+        if not pairs:
+            return scores
+        for idx, batch in self._batches(pairs):
+            for i, score in zip(idx, self._forward(batch)):
+                scores[i] = score
+        return scores
+
+
+class Int8Backend(_TokenizedBackend):
+    """The same checkpoint with its Linear layers dynamically quantized to int8 for CPU inference."""
+
+    name = 'int8'
+    tensor_type = 'pt'
+
+    def __init__(self, model_name : str, max_tokens : int = RERANK_MAX_TOKENS, batch_size : int = RERANK_BATCH_SIZE):
+        super().__init__(model_name, max_tokens, batch_size)
+        import torch
+        from transformers import AutoModelForSequenceClassification
+        if RERANK_THREADS:
+            torch.set_num_threads(RERANK_THREADS)
+        self._load_tokenizer()
+        model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+        self.model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def _forward(self, batch : Dict) -> List[float]:
+        import torch
+        with torch.inference_mode():
+            return self.model(**batch).logits.view(-1).float().tolist()
+
+
+class OnnxBackend(_TokenizedBackend):
+    """
+    ONNX Runtime on CPU. The checkpoint is exported once to RERANK_ONNX_DIR (and, with
+    `quantize`, converted to int8 weights there); later loads reuse the files.
+    """
+
+    name = 'onnx'
+
+    def __init__(self, model_name : str, max_tokens : int = RERANK_MAX_TOKENS, batch_size : int = RERANK_BATCH_SIZE,
+                 quantize : bool = False):
+        super().__init__(model_name, max_tokens, batch_size)
+        import onnxruntime as ort
+        self.name = 'onnx-int8' if quantize else 'onnx'
+        self._load_tokenizer()
+        path = self._export(quantize)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if RERANK_THREADS:
+            options.intra_op_num_threads = RERANK_THREADS
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+
+    def _export(self, quantize : bool) -> str:
+        folder = os.path.join(RERANK_ONNX_DIR, self.model_name.replace('/', '--'))
+        path = os.path.join(folder, 'model.onnx')
+        if not os.path.exists(path):
+            import torch
+            from transformers import AutoModelForSequenceClassification
+            os.makedirs(folder, exist_ok=True)
+            log.info(f'Exporting reranker {self.model_name} to {path}')
+            model = AutoModelForSequenceClassification.from_pretrained(self.model_name).eval()
+            sample = self.tokenizer('query', 'passage', return_tensors='pt')
+            torch.onnx.export(
+                model, (sample['input_ids'], sample['attention_mask']), path,
+                input_names=['input_ids', 'attention_mask'], output_names=['logits'],
+                dynamic_axes={
+                    'input_ids' : {0 : 'batch', 1 : 'sequence'},
+                    'attention_mask' : {0 : 'batch', 1 : 'sequence'},
+                    'logits' : {0 : 'batch'},
+                },
+                opset_version=17
+            )
+        if not quantize:
+            return path
+        quantized = os.path.join(folder, 'model.int8.onnx')
+        if not os.path.exists(quantized):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(path, quantized, weight_type=QuantType.QInt8)
+        return quantized
+
+    def _forward(self, batch : Dict) -> List[float]:
+        feeds = {name : batch[name].astype('int64') for name in self.input_names}
+        return self.session.run(['logits'], feeds)[0].reshape(-1).tolist()
+
+
+BACKENDS = {
+    'flag' : FlagBackend,
+    'int8' : Int8Backend,
+    'onnx' : OnnxBackend,
+    'onnx-int8' : lambda *args, **kwargs: OnnxBackend(*args, quantize=True, **kwargs),
+}
+
+
+def resolve_backend(backend : str = RERANK_BACKEND) -> str:
+    if backend == 'auto':
+        import torch
+        return 'flag' if torch.cuda.is_available() else 'int8'
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown reranker backend {backend}; expected auto or one of {sorted(BACKENDS)}')
+    return backend
+
+
+def load_reranker(backend : str = RERANK_BACKEND, model_name : str = RERANKER_VN_MODEL,
+                  max_tokens : int = RERANK_MAX_TOKENS, batch_size : int = RERANK_BATCH_SIZE) -> RerankerBackend:
+    backend = resolve_backend(backend)
+    reranker = BACKENDS[backend](model_name, max_tokens=max_tokens, batch_size=batch_size)
+    log.info(f'Loaded reranker {reranker}')
+    return reranker
@@ -1,19 +1,26 @@
 import asyncio
 import logging
+import math
 import os
 from collections import Counter
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from typing import List, Optional
-from langdetect import detect, LangDetectException
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
 from langchain_core.documents import Document
-from FlagEmbedding import FlagReranker
-from sqlalchemy import select
+from sqlalchemy import func, select
 from sqlalchemy.orm import aliased
 
 from src.core.database import AsyncSessionLocal
 from src.models.chunks import Chunk, ChunkLevel
 from src.models.source_documents import SourceDocument
-from src.workers.processing import EMBEDDING_FN
+from src.core.metrics import CHAT_STAGE_SECONDS, RERANK_PAIRS, RETRIEVAL_QUERY_SECONDS, timed
+from src.core.tracing import tracer, traced, set_attributes
+from .rerankers import RerankerBackend, load_reranker
+from .rerank_cache import RERANK_CACHE, ScoreCache, cached_scores
+from .routing import DOCUMENT_ROUTER
+from .vectors import ACTIVE_MODEL, ModelRef, chunk_vector, with_chunk_vectors
+from .scheduler import EMBED_LIMITER, RERANK_LIMITER, retry_overloaded
+from .policy import RetrievalPolicy, RetrievalStats, cut_at_distance_gap, cut_at_score_elbow, fit_to_budget
 
 load_dotenv()
 logging.basicConfig(
@@ -26,103 +33,378 @@ EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL')
 RERANKER_MUL = os.getenv('RERANKER_MODEL')
 RERANKER_VN_MODEL = os.getenv('VN_MODEL')
 
-RERANKER_VN = FlagReranker(
-    RERANKER_VN_MODEL, use_fp16=True
-)
+# Backend, truncation and batch size come from RERANK_BACKEND / RERANK_MAX_TOKENS / RERANK_BATCH_SIZE.
+RERANKER_VN = load_reranker(model_name=RERANKER_VN_MODEL)
+DEFAULT_POLICY = RetrievalPolicy()
+ROUTING_MODE = os.getenv('RAG_ROUTING_MODE', 'centroid')
+# Batch retrieval: concurrent candidate searches (keep below the DB pool size) and pairs per rerank call.
+RETRIEVAL_BATCH_CONCURRENCY = int(os.getenv('RETRIEVAL_BATCH_CONCURRENCY', 8))
+RERANK_BATCH_PAIRS = int(os.getenv('RERANK_BATCH_PAIRS', 512))
+
+
+@contextmanager
+def _sql(name: str):
+    with traced(f'sql.{name}'), timed(RETRIEVAL_QUERY_SECONDS, name):
+        yield
+
+
+async def embed_query(query: str, model: Optional[ModelRef] = None) -> List[float]:
+    model = model or await ACTIVE_MODEL.get()
+    async with EMBED_LIMITER.slot():
+        return await model.embeddings().aembed_query(query)
+
+
+def _to_document(chunk: Chunk) -> Document:
+    metadata = dict(chunk.chunk_metadata or {})
+    metadata.update({
+        'id': chunk.id,
+        'parent_id': chunk.parent_id,
+        'chunk_level': chunk.chunk_level.value,
+        'source_doc_id': chunk.source_doc_id,
+    })
+    return Document(id=chunk.id, page_content=chunk.content, metadata=metadata)
+
+
+def rerank_documents_vn(question: str, docs: List[Document], reranker: RerankerBackend, top_k=10,
+                        policy: Optional[RetrievalPolicy] = None,
+                        stats: Optional[RetrievalStats] = None,
+                        cache: Optional[ScoreCache] = RERANK_CACHE) -> list[Document]:
+    if not docs:
+        return []
+    scores, cached = cached_scores(reranker, cache, [(question, doc) for doc in docs])
+    _record_cached(stats, cached)
+    return _select_reranked(docs, scores, top_k, policy)
+
 
+def _record_cached(stats: Optional[RetrievalStats], cached: List[bool]) -> None:
+    hits = sum(cached)
+    RERANK_PAIRS.observe(len(cached) - hits)
+    if stats is not None:
+        stats.rerank_cached = hits
 
-def rerank_documents_vn(question: str, docs: List[Document], reranker: FlagReranker, top_k=10) -> list[Document]:
-    pairs = [(question, doc.page_content) for doc in docs]
-    scores = reranker.compute_score(pairs)
+
+def rerank_many(items: List[Tuple[str, List[Document]]], reranker: RerankerBackend, top_k=10,
+                policy: Optional[RetrievalPolicy] = None,
+                stats: Optional[List[RetrievalStats]] = None,
+                cache: Optional[ScoreCache] = RERANK_CACHE) -> List[List[Document]]:
+    """
+    Reranks the candidates of several questions with one compute_score call over all their
+    uncached pairs. `stats`, if given, is aligned with `items`.
+    """
+    pairs = [(question, doc) for question, docs in items for doc in docs]
+    if not pairs:
+        return [[] for _ in items]
+    scores, cached = cached_scores(reranker, cache, pairs)
+    results, offset = [], 0
+    for i, (_, docs) in enumerate(items):
+        end = offset + len(docs)
+        _record_cached(stats[i] if stats else None, cached[offset:end])
+        results.append(_select_reranked(docs, scores[offset:end], top_k, policy) if docs else [])
+        offset = end
+    return results
+
+
+def _select_reranked(docs: List[Document], scores: List[float], top_k=10,
+                     policy: Optional[RetrievalPolicy] = None) -> List[Document]:
     doc_score_pairs = list(zip(docs, scores))
     doc_score_pairs.sort(key=lambda x: x[1], reverse=True)
-    return [doc for doc, score in doc_score_pairs[:top_k]]
+    if policy is None:
+        return [doc for doc, score in doc_score_pairs[:top_k]]
+    keep = cut_at_score_elbow(
+        [score for _, score in doc_score_pairs],
+        min_keep=policy.rerank_min,
+        max_keep=min(top_k, policy.rerank_max),
+        min_drop=policy.elbow_drop
+    )
+    return [doc for doc, score in doc_score_pairs[:keep]]
 
 
-async def initial_retrieval(query: str, top_k_chunks: int = 100, top_k_ids: int = 3):
+@tracer.start_as_current_span('initial_retrieval')
+async def initial_retrieval(query: str, top_k_chunks: Optional[int] = None, top_k_ids: Optional[int] = None,
+                            query_embedding: Optional[List[float]] = None,
+                            policy: Optional[RetrievalPolicy] = None,
+                            stats: Optional[RetrievalStats] = None,
+                            model: Optional[ModelRef] = None):
     log.info(f"Initial retrieval for query : {query}")
-    query_embedding = await EMBEDDING_FN.aembed_query(query)
+    policy = policy or DEFAULT_POLICY
+    model = model or await ACTIVE_MODEL.get()
+    if query_embedding is None:
+        with timed(CHAT_STAGE_SECONDS, 'embedding'):
+            query_embedding = await embed_query(query, model)
+    if ROUTING_MODE == 'centroid':
+        with _sql('centroid_route'):
+            routed_ids = await DOCUMENT_ROUTER.route(query_embedding, top_k_ids or policy.routing_top_ids, model)
+        if routed_ids:
+            log.info(f"Possible ids related to query : {routed_ids} (centroid routing)")
+            return routed_ids
+        log.info("Document router is empty, falling back to chunk voting.")
+    return await vote_retrieval(query, top_k_chunks, top_k_ids, query_embedding, policy, stats, model)
+
+
+async def vote_retrieval(query: str, top_k_chunks: Optional[int] = None, top_k_ids: Optional[int] = None,
+                         query_embedding: Optional[List[float]] = None,
+                         policy: Optional[RetrievalPolicy] = None,
+                         stats: Optional[RetrievalStats] = None,
+                         model: Optional[ModelRef] = None):
+    policy = policy or DEFAULT_POLICY
+    model = model or await ACTIVE_MODEL.get()
+    max_chunks = top_k_chunks or policy.routing_max_chunks
+    top_k_ids = top_k_ids or policy.routing_top_ids
+    if query_embedding is None:
+        with timed(CHAT_STAGE_SECONDS, 'embedding'):
+            query_embedding = await embed_query(query, model)
+    distance = chunk_vector(model).cosine_distance(query_embedding).label('distance')
+    limit = min(policy.routing_chunks, max_chunks)
     async with AsyncSessionLocal() as asession:
-        stmt = select(Chunk).order_by(
-            Chunk.embedding.cosine_distance(query_embedding)
-        ).limit(top_k_chunks)
-        results = await asession.execute(stmt)
-        chunks = results.scalars().all()
-
-        if not chunks:
-            log.warning(f"Initial retrieval found no chunks to map ids.")
-            return []
-        source_doc_ids = [chunk.source_doc_id for chunk in chunks]
+        while True:
+            stmt = with_chunk_vectors(select(SourceDocument.media_id, distance).select_from(Chunk).join(
+                SourceDocument, Chunk.source_doc_id == SourceDocument.id
+            ), model).order_by(distance).limit(limit)
+            with _sql('routing_vote'):
+                results = await asession.execute(stmt)
+                rows = results.all()
+            # Expand the scan only while the hits are tightly clustered, i.e. the vote is not yet decisive.
+            spread = rows[-1].distance - rows[0].distance if rows else 0.0
+            if len(rows) < limit or limit >= max_chunks or spread > policy.distance_gap:
+                break
+            limit = min(limit * 2, max_chunks)
+            if stats is not None:
+                stats.expanded = True
 
-        media_id_stmt = select(SourceDocument.media_id).where(SourceDocument.id.in_(source_doc_ids))
-        media_id_res = await asession.execute(media_id_stmt)
-        media_ids = media_id_res.scalars().all()
+    if stats is not None:
+        stats.routing_chunks = len(rows)
+    if not rows:
+        log.warning(f"Initial retrieval found no chunks to map ids.")
+        return []
 
-        if not media_ids:
-            log.warning(f"Retrieved chunks, but can not find ids.")
-            return []
+    media_ids_count = Counter(row.media_id for row in rows)
+    most_cmm_ids = [media_id for media_id, count in media_ids_count.most_common(top_k_ids)]
+    log.info(f"Possible ids related to query : {most_cmm_ids} (from {len(rows)} chunks)")
+    return most_cmm_ids
+
+
+def _per_document_candidates(model: ModelRef, level: ChunkLevel, distance, media_ids: Sequence[int], per_document: int,
+                             limit: int, *columns):
+    """Nearest `level` chunks across `media_ids` in one query, at most `per_document` from each document."""
+    doc_rank = func.row_number().over(partition_by=Chunk.source_doc_id, order_by=distance).label('doc_rank')
+    ranked = with_chunk_vectors(select(Chunk.id, distance, doc_rank).where(Chunk.chunk_level == level).join(
+        SourceDocument
+    ).where(SourceDocument.media_id.in_(media_ids)), model).subquery()
+    return select(*columns, ranked.c.distance).join(ranked, Chunk.id == ranked.c.id).where(
+        ranked.c.doc_rank <= per_document
+    ).order_by(ranked.c.distance).limit(limit)
 
-        media_ids_count = Counter(media_ids)
-        most_cmm_ids = [media_id for media_id, count in media_ids_count.most_common(top_k_ids)]
-        log.info(f"Possible ids related to query : {most_cmm_ids}")
-        return most_cmm_ids
 
+def _cut_per_document(rows, source_doc_of, policy: RetrievalPolicy):
+    # The distance gap is applied within each document so a closer document cannot cut the others off.
+    groups = {}
+    for row in rows:
+        groups.setdefault(source_doc_of(row), []).append(row)
+    kept = set()
+    for group in groups.values():
+        keep = cut_at_distance_gap([row.distance for row in group], policy.distance_gap, policy.min_candidates)
+        kept.update(id(row) for row in group[:keep])
+    return [row for row in rows if id(row) in kept]
 
-async def retrieval_and_rerank(query: str, media_id: Optional[int] = None, k: int = 25, top_k: int = 10) -> List[
-    Document]:
+
+@tracer.start_as_current_span('retrieval_and_rerank')
+async def retrieval_and_rerank(query: str, media_id: Optional[int] = None, k: int = 25, top_k: int = 10,
+                               policy: Optional[RetrievalPolicy] = None,
+                               stats: Optional[RetrievalStats] = None,
+                               media_ids: Optional[Sequence[int]] = None) -> List[Document]:
+    """
+    `media_id` / `media_ids` scope the search; without them the documents are routed.
+    With several explicit media_ids every document gets an equal share of the candidates.
+    """
     log.info(f"Starting retrieval for query {query}")
-    if media_id:
-        log.info(f'Filtering by M_ID : {media_id}')
-        top_media_ids = [media_id]
+    policy = policy or DEFAULT_POLICY
+    stats = stats if stats is not None else RetrievalStats()
+    # Resolved once so the query vector and the searched vectors come from the same model.
+    model = await ACTIVE_MODEL.get()
+    with timed(CHAT_STAGE_SECONDS, 'embedding'):
+        query_embedding = await embed_query(query, model)
+    all_chunks = await retrieve_candidates(query, query_embedding, media_id, k, policy, stats, media_ids, model)
+    if not all_chunks:
+        return []
+    async with RERANK_LIMITER.slot():
+        with traced('rerank_documents_vn', **{'rerank.pairs': len(all_chunks)}), timed(CHAT_STAGE_SECONDS, 'rerank'):
+            reranked_docs = await asyncio.to_thread(
+                rerank_documents_vn, query, all_chunks, RERANKER_VN, top_k, policy, stats
+            )
+    return _fit_selected(reranked_docs, policy, stats)
+
+
+def _fit_selected(reranked_docs: List[Document], policy: RetrievalPolicy, stats: RetrievalStats) -> List[Document]:
+    token_counts = fit_to_budget([doc.page_content for doc in reranked_docs], policy.context_tokens)
+    reranked_docs = reranked_docs[:len(token_counts)]
+    stats.selected = len(reranked_docs)
+    stats.context_tokens = sum(token_counts)
+    set_attributes({f'retrieval.{key}': value for key, value in stats.as_dict().items()})
+    log.info(f'Reranked to the top {len(reranked_docs)} chunks (~{stats.context_tokens} tokens).')
+    return reranked_docs
+
+
+async def retrieve_candidates(query: str, query_embedding: List[float], media_id: Optional[int] = None, k: int = 25,
+                              policy: Optional[RetrievalPolicy] = None,
+                              stats: Optional[RetrievalStats] = None,
+                              media_ids: Optional[Sequence[int]] = None,
+                              model: Optional[ModelRef] = None) -> List[Document]:
+    """Routing and the child/parent candidate queries of retrieval_and_rerank, without the rerank."""
+    policy = policy or DEFAULT_POLICY
+    stats = stats if stats is not None else RetrievalStats()
+    model = model or await ACTIVE_MODEL.get()
+    scoped_ids = list(dict.fromkeys(media_ids or ([media_id] if media_id else [])))
+    if scoped_ids:
+        log.info(f'Filtering by M_IDs : {scoped_ids}')
+        top_media_ids = scoped_ids
     else:
-        top_media_ids = await initial_retrieval(query)
+        top_media_ids = await initial_retrieval(query, query_embedding=query_embedding, policy=policy, stats=stats, model=model)
         if not top_media_ids:
             return []
-            
-    query_embedding = await EMBEDDING_FN.aembed_query(query)
 
+    max_candidates = min(k, policy.max_candidates)
+    per_document = math.ceil(max_candidates / len(scoped_ids)) if len(scoped_ids) > 1 else None
+    distance = chunk_vector(model).cosine_distance(query_embedding).label('distance')
     parent_ids = set()
     all_chunks = []
     async with AsyncSessionLocal() as asession:
-        stmt = select(Chunk).where(Chunk.chunk_level == ChunkLevel.CHILD)
+        if per_document:
+            child_stmt = _per_document_candidates(model, ChunkLevel.CHILD, distance, top_media_ids, per_document, max_candidates, Chunk)
+        else:
+            stmt = select(Chunk, distance).where(Chunk.chunk_level == ChunkLevel.CHILD)
 
-        stmt = stmt.join(SourceDocument).where(SourceDocument.media_id.in_(top_media_ids))
+            stmt = stmt.join(SourceDocument).where(SourceDocument.media_id.in_(top_media_ids))
+            stmt = with_chunk_vectors(stmt, model)
 
-        child_stmt = stmt.order_by(Chunk.embedding.cosine_distance(query_embedding)).limit(k)
-        child_result = await asession.execute(child_stmt)
-        child_chunks = child_result.scalars().all()
+            child_stmt = stmt.order_by(distance).limit(max_candidates)
+        with _sql('child_candidates'):
+            child_result = await asession.execute(child_stmt)
+            child_rows = child_result.all()
+        if per_document:
+            child_rows = _cut_per_document(child_rows, lambda row: row.Chunk.source_doc_id, policy)
+        else:
+            child_rows = child_rows[:cut_at_distance_gap([row.distance for row in child_rows], policy.distance_gap, policy.min_candidates)]
+        child_chunks = [row.Chunk for row in child_rows]
 
         for chunk in child_chunks:
             if chunk.parent_id:
                 parent_ids.add(chunk.parent_id)
-        parent_stmt_base = select(Chunk).where(
-            Chunk.chunk_level == ChunkLevel.PARENT
-        ).join(SourceDocument).where(SourceDocument.media_id.in_(top_media_ids))
+        if per_document:
+            parent_stmt_direct = _per_document_candidates(
+                model, ChunkLevel.PARENT, distance, top_media_ids, per_document, max_candidates, Chunk.id, Chunk.source_doc_id
+            )
+        else:
+            parent_stmt_base = select(Chunk.id, distance).where(
+                Chunk.chunk_level == ChunkLevel.PARENT
+            ).join(SourceDocument).where(SourceDocument.media_id.in_(top_media_ids))
+            parent_stmt_base = with_chunk_vectors(parent_stmt_base, model)
 
-        parent_stmt_direct = parent_stmt_base.order_by(
-            Chunk.embedding.cosine_distance(query_embedding)
-        ).limit(k)
-        parent_stmt_direct_results = await asession.execute(parent_stmt_direct)
-        parent_stmt_direct_chunks = parent_stmt_direct_results.scalars().all()
+            parent_stmt_direct = parent_stmt_base.order_by(distance).limit(max_candidates)
+        with _sql('parent_candidates'):
+            parent_stmt_direct_results = await asession.execute(parent_stmt_direct)
+            parent_direct_rows = parent_stmt_direct_results.all()
+        if per_document:
+            parent_direct_rows = _cut_per_document(parent_direct_rows, lambda row: row.source_doc_id, policy)
+        else:
+            keep = cut_at_distance_gap([row.distance for row in parent_direct_rows], policy.distance_gap, policy.min_candidates)
+            parent_direct_rows = parent_direct_rows[:keep]
 
-        parent_ids = parent_ids.union({p.id for p in parent_stmt_direct_chunks})
+        parent_ids = parent_ids.union({row.id for row in parent_direct_rows})
         if not parent_ids:
             log.warning(f'No parent chunks found for retrieved {len(child_chunks)} child chunks')
             if not child_chunks:
                 return []
-            all_chunks = [Document(page_content=chunk.content, metadata=chunk.chunk_metadata) for chunk in child_chunks]
+            all_chunks = [_to_document(chunk) for chunk in child_chunks]
         else:
             parent_stmt = select(Chunk).where(Chunk.id.in_(list(parent_ids)))
-            parent_results = await asession.execute(parent_stmt)
-            parent_chunks_table = parent_results.scalars().all()
-            parent_chunks = [Document(page_content=chunk.content, metadata=chunk.chunk_metadata) for chunk in
-                             parent_chunks_table]
-            all_chunks = parent_chunks + [Document(page_content=chunk.content, metadata=chunk.chunk_metadata) for chunk
-                                          in child_chunks]
+            with _sql('parent_fetch'):
+                parent_results = await asession.execute(parent_stmt)
+                parent_chunks_table = parent_results.scalars().all()
+            parent_chunks = [_to_document(chunk) for chunk in parent_chunks_table]
+            all_chunks = parent_chunks + [_to_document(chunk) for chunk in child_chunks]
 
         log.info(f'Retrieved a total of {len(all_chunks)} chunks for reranking.')
-    reranked_docs = await asyncio.to_thread(
-        rerank_documents_vn, query, all_chunks, RERANKER_VN, top_k
-    )
-    log.info(f'Reranked to the top {len(reranked_docs)} chunks.')
-    return reranked_docs
\ No newline at end of file
+    stats.candidates = len(all_chunks)
+    stats.rerank_pairs = len(all_chunks)
+    return all_chunks
+
+
+async def retrieval_and_rerank_batch(queries: List[str], media_id: Optional[int] = None, k: int = 25, top_k: int = 10,
+                                     policy: Optional[RetrievalPolicy] = None,
+                                     media_ids: Optional[Sequence[int]] = None,
+                                     concurrency: int = RETRIEVAL_BATCH_CONCURRENCY,
+                                     rerank_batch_pairs: int = RERANK_BATCH_PAIRS
+                                     ) -> AsyncIterator[Tuple[int, List[Document], RetrievalStats, Optional[Exception]]]:
+    """
+    retrieval_and_rerank for many questions: one embedding call for all of them, candidate
+    searches running concurrently on the pool, and reranking in batches of about
+    `rerank_batch_pairs` pairs. Yields (index, documents, stats, error) as each rerank batch finishes;
+    a question whose search or rerank failed comes with its exception and no documents, and the
+    others carry on. Closing the iterator cancels the searches still running.
+    """
+    policy = policy or DEFAULT_POLICY
+    model = await ACTIVE_MODEL.get()
+
+    async def embed_all():
+        async with EMBED_LIMITER.slot():
+            # HuggingFaceEmbeddings embeds queries and documents the same way.
+            return await model.embeddings().aembed_documents(list(queries))
+
+    with traced('embed_batch', **{'batch.queries': len(queries)}), timed(CHAT_STAGE_SECONDS, 'embedding'):
+        query_embeddings = await retry_overloaded(embed_all)
+    gate = asyncio.Semaphore(concurrency)
+
+    async def search(index: int):
+        stats = RetrievalStats()
+        try:
+            async with gate:
+                docs = await retrieve_candidates(queries[index], query_embeddings[index], media_id, k, policy, stats, media_ids, model)
+        except Exception as e:
+            return index, [], stats, e
+        return index, docs, stats, None
+
+    async def rerank_slot(batch):
+        async with RERANK_LIMITER.slot():
+            return await asyncio.to_thread(
+                rerank_many, [(queries[index], docs) for index, docs, _ in batch], RERANKER_VN, top_k, policy,
+                [stats for _, _, stats in batch]
+            )
+
+    async def rerank(batch):
+        pairs = sum(len(docs) for _, docs, _ in batch)
+        with traced('rerank_many', **{'rerank.pairs': pairs, 'rerank.queries': len(batch)}), timed(CHAT_STAGE_SECONDS, 'rerank'):
+            reranked = await retry_overloaded(lambda: rerank_slot(batch))
+        return [(index, _fit_selected(docs, policy, stats), stats) for (index, _, stats), docs in zip(batch, reranked)]
+
+    async def rerank_isolated(batch):
+        try:
+            return [(*result, None) for result in await rerank(batch)]
+        except Exception as e:
+            if len(batch) == 1:
+                return [(index, [], stats, e) for index, _, stats in batch]
+        # One bad question must not fail the others sharing its batch: rerank them one by one.
+        results = []
+        for item in batch:
+            results.extend(await rerank_isolated([item]))
+        return results
+
+    searches = [asyncio.create_task(search(i)) for i in range(len(queries))]
+    try:
+        batch, batch_pairs = [], 0
+        for finished in asyncio.as_completed(searches):
+            index, docs, stats, error = await finished
+            if error is not None:
+                yield index, [], stats, error
+                continue
+            batch.append((index, docs, stats))
+            batch_pairs += len(docs)
+            if batch_pairs >= rerank_batch_pairs:
+                for result in await rerank_isolated(batch):
+                    yield result
+                batch, batch_pairs = [], 0
+        if batch:
+            for result in await rerank_isolated(batch):
+                yield result
+    finally:
+        for task in searches:
+            task.cancel()
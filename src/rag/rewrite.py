@@ -0,0 +1,124 @@
+import os
+import re
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from src.core.metrics import CHAT_STAGE_SECONDS, timed
+from .scheduler import EMBED_LIMITER, Overloaded
+
+log = logging.getLogger(__name__)
+
+REWRITE_CACHE_SIZE = int(os.getenv("REWRITE_CACHE_SIZE", 1024))
+REWRITE_SHORT_WORDS = int(os.getenv("REWRITE_SHORT_WORDS", 6))
+REWRITE_SIMILARITY = float(os.getenv("REWRITE_SIMILARITY", 0.6))
+# Rolling window that bounds the condense prompt: last N turns, each answer cut to M characters.
+REWRITE_WINDOW_TURNS = int(os.getenv("REWRITE_WINDOW_TURNS", 4))
+REWRITE_ANSWER_CHARS = int(os.getenv("REWRITE_ANSWER_CHARS", 600))
+
+# Openers that only make sense as a continuation ("Còn điều 7 thì sao?", "What about overtime?"). Plain
+# conjunctions (và, nhưng, and, but) also start self-contained questions, so they are not cues.
+CONTINUATION_OPENERS = re.compile(
+    r'^\s*(thế còn|vậy còn|còn\b.*\bthì sao|ngoài ra|thêm nữa|what about|how about|and what about|and how about)\b',
+    re.IGNORECASE
+)
+# References that cannot stand alone: demonstrative phrases pointing back into the conversation, and
+# it/they opening the question ("It applies to interns?", "Does that include overtime?"). Relative
+# "that" and a bare đó/ấy ("the policy that covers...", "năm đó") are too common in full questions.
+REFERENCE_CUES = re.compile(
+    r'\b(nó|cái đó|cái này|điều đó|điều này|vấn đề đó|vấn đề này|trường hợp đó|trường hợp này|'
+    r'khoản đó|khoản này|mục đó|mục này|như trên|ở trên|trên đây|kể trên|nói trên|'
+    r'the former|the latter|the above|mentioned above|the same one)\b'
+    r'|^\s*(it|they)\b'
+    r'|^\s*(is|are|was|were|does|do|did|can|could|will|would|should)\s+(it|they|this|that|these|those)\b',
+    re.IGNORECASE
+)
+
+
+def window_history(chat_history : List[Tuple[str, str]], turns : int = REWRITE_WINDOW_TURNS,
+                   answer_chars : int = REWRITE_ANSWER_CHARS) -> List[Tuple[str, str]]:
+    recent = chat_history[-turns:] if turns > 0 else []
+    return [(q, a if len(a) <= answer_chars else a[:answer_chars].rstrip() + " …") for q, a in recent]
+
+
+def format_history(chat_history : List[Tuple[str, str]]) -> str:
+    return "\n".join([f"Người dùng: {q}\nTrợ lý: {a}" for q, a in chat_history])
+
+
+def _cosine(a : List[float], b : List[float]) -> float:
+    # Embeddings are normalized at encode time, so the dot product is the cosine.
+    return sum(x * y for x, y in zip(a, b))
+
+
+class QueryRewriter:
+    """
+    Decides whether a follow-up question needs the condense LLM call and caches
+    rewrites per (history hash, question).
+    """
+
+    def __init__(self, condense_chain, executor, embeddings, cache_size : int = REWRITE_CACHE_SIZE):
+        self.condense_chain = condense_chain
+        self.executor = executor
+        self.embeddings = embeddings
+        self.cache_size = cache_size
+        self._cache : "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    async def needs_rewrite(self, query : str, chat_history : List[Tuple[str, str]]) -> Tuple[bool, str]:
+        if not chat_history:
+            return False, "no_history"
+        if CONTINUATION_OPENERS.search(query):
+            return True, "continuation"
+        if REFERENCE_CUES.search(query):
+            return True, "reference"
+        if len(query.split()) > REWRITE_SHORT_WORDS:
+            return False, "self_contained"
+        # Short question with no explicit cue: treat it as elliptical only if it stays on the last turn's topic.
+        try:
+            async with EMBED_LIMITER.slot():
+                with timed(CHAT_STAGE_SECONDS, "followup_similarity"):
+                    q_vec, last_vec = await self.embeddings.aembed_documents([query, chat_history[-1][0]])
+        except Overloaded:
+            raise
+        except Exception as e:
+            log.warning(f"Similarity check failed, falling back to rewrite : {e}")
+            return True, "similarity_error"
+        similarity = _cosine(q_vec, last_vec)
+        if similarity >= REWRITE_SIMILARITY:
+            return True, f"similar_to_last_turn ({similarity:.2f})"
+        return False, f"new_topic ({similarity:.2f})"
+
+    def _key(self, query : str, formatted_history : str) -> Tuple[str, str]:
+        digest = hashlib.sha1(formatted_history.encode("utf-8")).hexdigest()
+        return digest, query.strip()
+
+    async def rewrite(self, query : str, chat_history : Optional[List[Tuple[str, str]]]) -> str:
+        chat_history = window_history(chat_history or [])
+        needed, reason = await self.needs_rewrite(query, chat_history)
+        if not needed:
+            if chat_history:
+                self.skipped += 1
+            log.info(f"Skipping condense ({reason}) : {query}")
+            return query
+        formatted_history = format_history(chat_history)
+        key = self._key(query, formatted_history)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            log.info(f"Rewrite cache hit : {cached}")
+            return cached
+        self.misses += 1
+        with timed(CHAT_STAGE_SECONDS, "condense"):
+            standalone_question = await self.executor.ainvoke(self.condense_chain, {
+                "chat_history" : formatted_history,
+                "question" : query
+            }, name = "condense")
+        standalone_question = standalone_question.strip() or query
+        self._cache[key] = standalone_question
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        log.info(f"Rewritten Question ({reason}) : {standalone_question}")
+        return standalone_question
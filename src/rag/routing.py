@@ -0,0 +1,88 @@
+import os
+import time
+import asyncio
+import logging
+import numpy as np
+from typing import List, Optional, Sequence
+from sqlalchemy import select
+
+from src.core.database import AsyncSessionLocal
+from src.models.source_documents import SourceDocument, IngestStatus
+from .vectors import ACTIVE_MODEL, ModelRef, centroids_stmt
+
+log = logging.getLogger(__name__)
+
+ROUTER_TTL_SECONDS = float(os.getenv('ROUTER_TTL_SECONDS', 60))
+
+
+def normalize_rows(matrix : np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def compute_centroid(embeddings : Sequence[Sequence[float]]) -> Optional[List[float]]:
+    if len(embeddings) == 0:
+        return None
+    centroid = np.asarray(embeddings, dtype=np.float32).mean(axis=0)
+    norm = np.linalg.norm(centroid)
+    return (centroid / norm if norm else centroid).tolist()
+
+
+class DocumentRouter:
+    """
+    Exact in-memory search over one centroid per completed SourceDocument. The corpus has
+    few documents, so a dense NumPy matrix product beats an ANN scan over every chunk.
+    """
+
+    def __init__(self, ttl : float = ROUTER_TTL_SECONDS):
+        self.ttl = ttl
+        self._media_ids = np.empty(0, dtype=np.int64)
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._loaded_at = 0.0
+        self._model_id = None
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._media_ids)
+
+    def invalidate(self) -> None:
+        self._loaded_at = 0.0
+
+    def _stale(self, model : ModelRef) -> bool:
+        # Centroids of another embedding model are useless for this query vector.
+        return self._model_id != model.id or time.monotonic() - self._loaded_at >= self.ttl
+
+    async def refresh(self, force : bool = False, model : Optional[ModelRef] = None) -> None:
+        model = model or await ACTIVE_MODEL.get()
+        if not force and not self._stale(model):
+            return
+        async with self._lock:
+            if not force and not self._stale(model):
+                return
+            async with AsyncSessionLocal() as asession:
+                stmt = centroids_stmt(model).where(SourceDocument.status == IngestStatus.COMPLETED)
+                rows = (await asession.execute(stmt)).all()
+            if rows:
+                self._media_ids = np.array([row.media_id for row in rows], dtype=np.int64)
+                self._matrix = normalize_rows(np.array([np.asarray(row.centroid) for row in rows], dtype=np.float32))
+            else:
+                self._media_ids = np.empty(0, dtype=np.int64)
+                self._matrix = np.empty((0, 0), dtype=np.float32)
+            self._loaded_at = time.monotonic()
+            self._model_id = model.id
+            log.info(f"Document router loaded {len(rows)} centroids ({model.name}).")
+
+    async def route(self, query_embedding : Sequence[float], top_k : int = 3, model : Optional[ModelRef] = None) -> List[int]:
+        await self.refresh(model = model)
+        if not len(self):
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        scores = self._matrix @ query
+        top_k = min(top_k, len(scores))
+        idx = np.argpartition(-scores, top_k - 1)[:top_k]
+        idx = idx[np.argsort(-scores[idx])]
+        return [int(media_id) for media_id in self._media_ids[idx]]
+
+
+DOCUMENT_ROUTER = DocumentRouter()
@@ -0,0 +1,126 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable
+from src.core.metrics import (
+    CHAT_COALESCED, SCHEDULER_IN_FLIGHT, SCHEDULER_QUEUE_DEPTH, SCHEDULER_SHED, SCHEDULER_WAIT_SECONDS
+)
+
+log = logging.getLogger(__name__)
+
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", 4))
+EMBED_MAX_QUEUE = int(os.getenv("EMBED_MAX_QUEUE", 64))
+# One cross-encoder instance on one device: batches run back to back, so more slots only add contention.
+RERANK_MAX_CONCURRENCY = int(os.getenv("RERANK_MAX_CONCURRENCY", 1))
+RERANK_MAX_QUEUE = int(os.getenv("RERANK_MAX_QUEUE", 32))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", 32))
+OVERLOAD_RETRIES = int(os.getenv("OVERLOAD_RETRIES", 10))
+
+
+class Overloaded(Exception):
+    """A stage queue is full; the request should be retried after `retry_after` seconds."""
+
+    def __init__(self, stage : str, retry_after : int):
+        super().__init__(f"The {stage} stage is overloaded, retry in {retry_after}s")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+class StageLimiter:
+    """
+    Bounded concurrency for one heavy stage. Up to `max_queue` callers wait for a slot;
+    beyond that `slot()` raises Overloaded instead of queueing (a negative max_queue disables shedding).
+    """
+
+    def __init__(self, stage : str, max_concurrency : int, max_queue : int = -1):
+        self.stage = stage
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.in_flight = 0
+        # Moving average of slot hold time, used to estimate Retry-After.
+        self.avg_seconds = 1.0
+
+    @property
+    def full(self) -> bool:
+        return 0 <= self.max_queue <= self.waiting and self.in_flight >= self.max_concurrency
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil((self.waiting + 1) * self.avg_seconds / self.max_concurrency))
+
+    def check(self) -> None:
+        if self.full:
+            SCHEDULER_SHED.labels(self.stage).inc()
+            raise Overloaded(self.stage, self.retry_after())
+
+    @asynccontextmanager
+    async def slot(self):
+        self.check()
+        self.waiting += 1
+        SCHEDULER_QUEUE_DEPTH.labels(self.stage).inc()
+        queued = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+            SCHEDULER_QUEUE_DEPTH.labels(self.stage).dec()
+        started = time.perf_counter()
+        SCHEDULER_WAIT_SECONDS.labels(self.stage).observe(started - queued)
+        self.in_flight += 1
+        SCHEDULER_IN_FLIGHT.labels(self.stage).inc()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            SCHEDULER_IN_FLIGHT.labels(self.stage).dec()
+            self._semaphore.release()
+            self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * (time.perf_counter() - started)
+
+
+def admit(*limiters : StageLimiter) -> None:
+    """Sheds a request up front when any stage it will need is already full, before it does any work."""
+    for limiter in limiters:
+        limiter.check()
+
+
+async def retry_overloaded(factory : Callable[[], Awaitable[Any]], retries : int = OVERLOAD_RETRIES) -> Any:
+    """For background work (batch jobs): waits out Overloaded instead of failing, up to `retries` times."""
+    for attempt in range(retries + 1):
+        try:
+            return await factory()
+        except Overloaded as e:
+            if attempt == retries:
+                raise
+            log.info(f"{e}; waiting {e.retry_after}s (attempt {attempt + 1}/{retries})")
+            await asyncio.sleep(e.retry_after)
+
+
+class Coalescer:
+    """Runs one computation per key; identical concurrent callers await the same result."""
+
+    def __init__(self):
+        self._in_flight : Dict[Hashable, asyncio.Future] = {}
+
+    async def run(self, key : Hashable, factory : Callable[[], Awaitable[Any]]) -> Any:
+        future = self._in_flight.get(key)
+        if future is not None:
+            CHAT_COALESCED.inc()
+            log.info(f"Coalesced onto in-flight request : {key}")
+            return await asyncio.shield(future)
+        future = asyncio.ensure_future(factory())
+        self._in_flight[key] = future
+
+        def _done(_):
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+        future.add_done_callback(_done)
+        # Shielded so a disconnecting caller does not cancel the work others are waiting on.
+        return await asyncio.shield(future)
+
+
+EMBED_LIMITER = StageLimiter("embed", EMBED_MAX_CONCURRENCY, EMBED_MAX_QUEUE)
+RERANK_LIMITER = StageLimiter("rerank", RERANK_MAX_CONCURRENCY, RERANK_MAX_QUEUE)
@@ -0,0 +1,63 @@
+import os
+import json
+import logging
+import threading
+from uuid import uuid4
+from typing import List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", os.getenv("REDIS_URL"))
+SESSION_TTL = int(os.getenv("SESSION_TTL", 24 * 3600))
+# Turns kept per session; only the last REWRITE_WINDOW_TURNS of them reach the condense prompt.
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", 50))
+SESSION_PREFIX = "chat:session:"
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import redis.asyncio as redis
+                _client = redis.from_url(SESSION_REDIS_URL, decode_responses = True)
+    return _client
+
+
+def new_session_id() -> str:
+    return uuid4().hex
+
+
+class SessionStore:
+    """Conversation turns per session in a capped Redis list; every write refreshes the TTL."""
+
+    def __init__(self, client = None, ttl : int = SESSION_TTL, max_turns : int = SESSION_MAX_TURNS):
+        self._client = client
+        self.ttl = ttl
+        self.max_turns = max_turns
+
+    @property
+    def client(self):
+        return self._client or get_client()
+
+    def _key(self, session_id : str) -> str:
+        return f"{SESSION_PREFIX}{session_id}"
+
+    async def history(self, session_id : str, last : Optional[int] = None) -> List[Tuple[str, str]]:
+        start = -last if last else 0
+        rows = await self.client.lrange(self._key(session_id), start, -1)
+        return [tuple(json.loads(row)) for row in rows]
+
+    async def append(self, session_id : str, question : str, answer : str) -> None:
+        key = self._key(session_id)
+        async with self.client.pipeline(transaction = True) as pipe:
+            pipe.rpush(key, json.dumps([question, answer], ensure_ascii = False))
+            pipe.ltrim(key, -self.max_turns, -1)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def clear(self, session_id : str) -> bool:
+        return bool(await self.client.delete(self._key(session_id)))
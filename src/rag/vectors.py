@@ -0,0 +1,130 @@
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import List, Optional
+from sqlalchemy import and_, cast, select
+from pgvector.sqlalchemy import Vector
+
+from src.core.database import AsyncSessionLocal, SessionLocal
+from src.core.embeddings import EMBEDDING_MODEL, get_embedding_fn
+from src.models.chunks import Chunk
+from src.models.embedding_models import ChunkEmbedding, DocumentCentroid, EmbeddingModel, EmbeddingModelStatus
+from src.models.source_documents import SourceDocument
+
+log = logging.getLogger(__name__)
+
+ACTIVE_MODEL_TTL_SECONDS = float(os.getenv('ACTIVE_MODEL_TTL_SECONDS', 15))
+
+
+@dataclass(frozen=True)
+class ModelRef:
+    id : int
+    name : str
+    dim : int
+    inline : bool
+
+    @classmethod
+    def of(cls, row : EmbeddingModel) -> 'ModelRef':
+        return cls(id=row.id, name=row.name, dim=row.dim, inline=row.inline)
+
+    def embeddings(self):
+        # The inline model is whatever EMBEDDING_MODEL the corpus was first embedded with.
+        return get_embedding_fn(None if self.inline else self.name)
+
+
+# Used when the registry table does not exist yet (migration not applied).
+FALLBACK_MODEL = ModelRef(id=0, name=EMBEDDING_MODEL or 'legacy', dim=1024, inline=True)
+
+
+class ActiveModel:
+    """
+    The ACTIVE embedding model, cached for `ttl` seconds. Switching models is a single
+    UPDATE (see workers.reembed.activate_model); every process picks it up within the TTL,
+    and each request resolves the model once so its query vector and SQL always agree.
+    """
+
+    def __init__(self, ttl : float = ACTIVE_MODEL_TTL_SECONDS):
+        self.ttl = ttl
+        self._model : Optional[ModelRef] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        self._loaded_at = 0.0
+
+    def _fresh(self) -> bool:
+        return self._model is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def _store(self, row : Optional[EmbeddingModel]) -> ModelRef:
+        model = ModelRef.of(row) if row is not None else FALLBACK_MODEL
+        if self._model is not None and model != self._model:
+            log.info(f"Active embedding model switched from {self._model.name} to {model.name}")
+        self._model, self._loaded_at = model, time.monotonic()
+        return model
+
+    async def get(self) -> ModelRef:
+        if self._fresh():
+            return self._model
+        try:
+            async with AsyncSessionLocal() as asession:
+                row = (await asession.execute(_active_stmt())).scalars().first()
+        except Exception as e:
+            log.warning(f"Could not read the active embedding model, using {FALLBACK_MODEL.name} : {e}")
+            row = None
+        return self._store(row)
+
+    def get_sync(self, refresh : bool = False) -> ModelRef:
+        if not refresh and self._fresh():
+            return self._model
+        with self._lock:
+            try:
+                with SessionLocal() as session:
+                    row = session.execute(_active_stmt()).scalars().first()
+            except Exception as e:
+                log.warning(f"Could not read the active embedding model, using {FALLBACK_MODEL.name} : {e}")
+                row = None
+            return self._store(row)
+
+
+def _active_stmt():
+    return select(EmbeddingModel).where(EmbeddingModel.status == EmbeddingModelStatus.ACTIVE)
+
+
+def building_models() -> List[ModelRef]:
+    """Models being re-embedded into; ingestion writes their vectors too so the rebuild never falls behind."""
+    try:
+        with SessionLocal() as session:
+            rows = session.execute(
+                select(EmbeddingModel).where(EmbeddingModel.status == EmbeddingModelStatus.BUILDING)
+            ).scalars().all()
+    except Exception as e:
+        log.warning(f"Could not read building embedding models : {e}")
+        return []
+    return [ModelRef.of(row) for row in rows]
+
+
+def chunk_vector(model : ModelRef):
+    if model.inline:
+        return Chunk.embedding
+    # Cast to the model's dimension so the partial HNSW index for this model applies.
+    return cast(ChunkEmbedding.embedding, Vector(model.dim))
+
+
+def with_chunk_vectors(stmt, model : ModelRef):
+    """Joins the side table holding `model`'s chunk vectors; a no-op for the inline model."""
+    if model.inline:
+        return stmt.where(Chunk.embedding.is_not(None))
+    return stmt.join(ChunkEmbedding, and_(ChunkEmbedding.chunk_id == Chunk.id, ChunkEmbedding.model_id == model.id))
+
+
+def centroids_stmt(model : ModelRef):
+    if model.inline:
+        return select(SourceDocument.media_id, SourceDocument.centroid).where(SourceDocument.centroid.is_not(None))
+    return select(SourceDocument.media_id, DocumentCentroid.centroid).join(
+        DocumentCentroid, and_(DocumentCentroid.source_doc_id == SourceDocument.id, DocumentCentroid.model_id == model.id)
+    )
+
+
+ACTIVE_MODEL = ActiveModel()
@@ -1,6 +1,9 @@
 import os
 from dotenv import load_dotenv
 from celery import Celery
+import time
+from celery.signals import before_task_publish, worker_init, worker_process_init, task_prerun, task_postrun
+from kombu import Queue
 load_dotenv()
 REDIS_URL = os.getenv("REDIS_URL")
 celery_app = Celery(
@@ -9,3 +12,100 @@ celery_app = Celery(
     backend= REDIS_URL,
     include=['src.workers.tasks']
 )
+# Each ingestion stage has its own queue so parsing, embedding and DB writes can overlap across documents,
+# and a long parse never blocks a quick delete. See "Workers" in README.md for the worker layout.
+celery_app.conf.task_queues = (
+    Queue('celery'),
+    Queue('parse'),
+    Queue('embed'),
+    Queue('write'),
+    Queue('delete'),
+)
+celery_app.conf.task_default_queue = 'celery'
+celery_app.conf.task_routes = {
+    # Parses and embeds in one task, so it runs where the model already lives; the API uses the chain instead.
+    'src.workers.tasks.process_document_task': {'queue': 'embed'},
+    'src.workers.tasks.parse_document_task': {'queue': 'parse'},
+    'src.workers.tasks.embed_chunks_task': {'queue': 'embed'},
+    'src.workers.tasks.write_chunks_task': {'queue': 'write'},
+    'src.workers.tasks.reembed_corpus_task': {'queue': 'embed'},
+    'src.workers.tasks.delete_document_task': {'queue': 'delete'},
+    'src.workers.tasks.delete_documents_batch_task': {'queue': 'delete'},
+}
+celery_app.conf.update(
+    # Tasks run for minutes: take one message at a time and ack only once it is done,
+    # so a crashed worker hands the document back instead of losing it.
+    worker_prefetch_multiplier = int(os.getenv("CELERY_PREFETCH_MULTIPLIER", 1)),
+    task_acks_late = True,
+    task_reject_on_worker_lost = True,
+    # Must exceed the longest task, otherwise Redis redelivers unacked messages mid-run.
+    broker_transport_options = {'visibility_timeout': int(os.getenv("CELERY_VISIBILITY_TIMEOUT", 4 * 3600))},
+)
+
+@worker_process_init.connect
+def reset_db_pool(**kwargs):
+    # Prefork children must not reuse connections opened by the parent before the fork.
+    from src.core.database import engine
+    engine.dispose(close=False)
+
+def _preload_embedding_model():
+    if os.getenv("WORKER_PRELOAD_EMBEDDINGS", "0") == "1":
+        from src.core.embeddings import get_embedding_fn
+        get_embedding_fn()
+
+def _is_prefork(worker) -> bool:
+    # worker_init fires before the pool class is resolved, so it may still be the --pool name.
+    pool = getattr(worker, 'pool_cls', None) or celery_app.conf.worker_pool
+    name = pool if isinstance(pool, str) else pool.__module__
+    return 'prefork' in name or 'processes' in name
+
+@worker_process_init.connect
+def preload_embedding_model(**kwargs):
+    # Prefork (and solo) pools: load in each child, never in the parent before the fork.
+    _preload_embedding_model()
+
+@worker_init.connect
+def preload_embedding_model_in_worker(sender = None, **kwargs):
+    # Thread, gevent and eventlet pools never send worker_process_init; load once in the worker process.
+    if sender is not None and not _is_prefork(sender):
+        _preload_embedding_model()
+
+@worker_init.connect
+def start_worker_tracing(**kwargs):
+    from src.core.tracing import setup_tracing
+    setup_tracing("rag-worker")
+
+@before_task_publish.connect
+def _inject_trace_context(headers = None, **kwargs):
+    # Carries the publisher's span (e.g. the /ingest request) into the task's span on the worker.
+    if headers is not None:
+        from src.core.tracing import inject_headers
+        inject_headers(headers)
+
+@worker_init.connect
+def start_worker_metrics(**kwargs):
+    port = os.getenv("WORKER_METRICS_PORT")
+    if port:
+        from src.core.metrics import start_metrics_server
+        start_metrics_server(int(port))
+
+_task_started = {}
+_task_spans = {}
+
+@task_prerun.connect
+def _mark_task_start(task_id = None, task = None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+    if task is not None:
+        from src.core.tracing import start_task_span
+        _task_spans[task_id] = start_task_span(f"celery.{task.name.rsplit('.', 1)[-1]}", task.request)
+
+@task_postrun.connect
+def _observe_task(task_id = None, task = None, state = None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None and task is not None:
+        from src.core.metrics import CELERY_TASK_SECONDS
+        CELERY_TASK_SECONDS.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - started)
+    span = _task_spans.pop(task_id, None)
+    if span is not None:
+        from src.core.tracing import end_task_span
+        end_task_span(*span, state = state)
@@ -1,7 +1,13 @@
+import json
+import time
 import logging
-from sqlalchemy import select
+import argparse
+from typing import Iterable, List
+from sqlalchemy import select, delete
 from src.core.database import SessionLocal
+from src.core.objects import ObjectStore, OBJECT_GC_GRACE_SECONDS
 from src.models.source_documents import SourceDocument
+from src.models.chunks import Chunk, ChunkLevel
 
 logging.basicConfig(
     level = logging.INFO,
@@ -9,22 +15,90 @@ logging.basicConfig(
 )
 log = logging.getLogger(__name__)
 
-def delete_documents(media_id : int):
-    log.info(f'Recieved request to delete document with M_ID : {media_id}')
+def _remove_unreferenced(session, content_hashes : Iterable[str], grace_seconds : int = OBJECT_GC_GRACE_SECONDS) -> int:
+    """Removes the uploaded objects among `content_hashes` that no document references any more."""
+    content_hashes = set(content_hashes)
+    if not content_hashes:
+        return 0
+    referenced = set(session.execute(
+        select(SourceDocument.content_hash).where(SourceDocument.content_hash.in_(content_hashes))
+    ).scalars())
+    store = ObjectStore()
+    return sum(store.remove(content_hash, grace_seconds) for content_hash in content_hashes - referenced)
+
+def delete_documents_bulk(media_ids : List[int]) -> dict:
+    log.info(f'Recieved request to delete documents with M_IDs : {media_ids}')
+    started = time.perf_counter()
+    report = {
+        'media_ids' : list(media_ids),
+        'deleted_media_ids' : [],
+        'documents_deleted' : 0,
+        'child_chunks_deleted' : 0,
+        'parent_chunks_deleted' : 0,
+        'objects_removed' : 0,
+        'elapsed_ms' : 0.0,
+        'error' : None
+    }
     session = SessionLocal()
     try:
-        stmt = select(SourceDocument).where(SourceDocument.media_id == media_id)
-        doc_to_delete = session.execute(stmt).scalars().first()
-        if not doc_to_delete:
-            log.warning(f'Document with M_ID {media_id} not found. Document might have already been deleted.')
-            return
-        session.delete(doc_to_delete)
+        stmt = select(SourceDocument.id, SourceDocument.media_id, SourceDocument.content_hash).where(SourceDocument.media_id.in_(media_ids))
+        rows = session.execute(stmt).all()
+        if not rows:
+            log.warning(f'Documents with M_IDs {media_ids} not found. Documents might have already been deleted.')
+            return report
+        doc_ids = [row.id for row in rows]
+        # Children first so the self-referencing parent_id FK never has to cascade row by row.
+        report['child_chunks_deleted'] = session.execute(
+            delete(Chunk).where(Chunk.source_doc_id.in_(doc_ids), Chunk.chunk_level == ChunkLevel.CHILD),
+            execution_options = {'synchronize_session' : False}
+        ).rowcount
+        report['parent_chunks_deleted'] = session.execute(
+            delete(Chunk).where(Chunk.source_doc_id.in_(doc_ids)),
+            execution_options = {'synchronize_session' : False}
+        ).rowcount
+        report['documents_deleted'] = session.execute(
+            delete(SourceDocument).where(SourceDocument.id.in_(doc_ids)),
+            execution_options = {'synchronize_session' : False}
+        ).rowcount
         session.commit()
-        log.info(f'Successfully deleted document (ID : {doc_to_delete.id}, M_ID : {doc_to_delete.media_id}) with all its chunks.')
+        report['deleted_media_ids'] = [row.media_id for row in rows]
+        # After the commit: a failed delete must not lose the file its documents still point at.
+        report['objects_removed'] = _remove_unreferenced(session, [row.content_hash for row in rows if row.content_hash])
+        log.info(f'Successfully deleted {report["documents_deleted"]} documents (M_IDs : {report["deleted_media_ids"]}) '
+                 f'with {report["child_chunks_deleted"]} child and {report["parent_chunks_deleted"]} parent chunks.')
     except Exception as e:
-        log.error(f'An error occurred for document with M_ID : {media_id}: {e}')
+        log.error(f'An error occurred for documents with M_IDs : {media_ids}: {e}')
         session.rollback()
+        report['error'] = str(e)
     finally:
         session.close()
+        report['elapsed_ms'] = (time.perf_counter() - started) * 1000
+    return report
+
+def delete_documents(media_id : int) -> dict:
+    return delete_documents_bulk([media_id])
+
+def collect_objects(grace_seconds : int = OBJECT_GC_GRACE_SECONDS) -> dict:
+    """
+    Removes every stored object no document references, e.g. uploads whose document was deleted
+    within the grace period, or whose ingest never registered one.
+    """
+    started = time.perf_counter()
+    store = ObjectStore()
+    with SessionLocal() as session:
+        referenced = set(session.execute(
+            select(SourceDocument.content_hash).where(SourceDocument.content_hash.is_not(None))
+        ).scalars())
+    removed = sum(store.remove(content_hash, grace_seconds) for content_hash in set(store.hashes()) - referenced)
+    log.info(f'Removed {removed} unreferenced objects.')
+    return {'objects_removed' : removed, 'elapsed_ms' : (time.perf_counter() - started) * 1000}
 
+def main():
+    parser = argparse.ArgumentParser(description = 'Remove uploaded objects that no document references.')
+    parser.add_argument('--grace_seconds', type = int, default = OBJECT_GC_GRACE_SECONDS,
+                        help = 'Keep objects written or re-uploaded more recently than this.')
+    args = parser.parse_args()
+    print(json.dumps(collect_objects(args.grace_seconds), indent = 2))
 
+if __name__ == '__main__':
+    main()
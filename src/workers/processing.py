@@ -1,38 +1,59 @@
 import os
 import re
 import logging
-import torch
 import enum
+import base64
+import time
+import numpy as np
 
 from dotenv import load_dotenv
+from dataclasses import dataclass
 from datetime import datetime, timezone
 from uuid import uuid4
-from sqlalchemy import select, or_
-from typing import List, Optional
+from sqlalchemy import delete, select, or_, and_
+from typing import Callable, Dict, List, Optional, Tuple
 
 from langchain_core.documents import Document
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter, MarkdownHeaderTextSplitter, MarkdownTextSplitter, TextSplitter
 from langchain_experimental.text_splitter import SemanticChunker
 
 from src.core.database import SessionLocal
+from src.core.embeddings import get_embedding_fn, embed_matrix
+from src.core.pgcopy import NULL, copy_rows, int4_field, json_field, row, text_field, vector_fields
 from src.models.source_documents import SourceDocument, IngestStatus
-from src.models.chunks import Chunk, ChunkLevel
-from src.load import load_from_document
+from src.models.chunks import ChunkLevel
+from src.models.embedding_models import DocumentCentroid
+from src.load import load_from_document, load_from_file
+from src.core.objects import ObjectStore
+from src.rag.routing import compute_centroid
+from src.rag.vectors import ACTIVE_MODEL, ModelRef, building_models
+from src.core.tracing import tracer, set_attributes
+from src.core.metrics import (
+    INGEST_CHUNKS_EMBEDDED, INGEST_CHUNKS_WRITTEN, INGEST_EMBED_RATE, INGEST_PAGES, INGEST_STAGE_SECONDS
+)
 
 logging.basicConfig(level=logging.INFO,format='%(asctime)s - %(levelname)s - %(message)s')
 log = logging.getLogger(__name__)
 load_dotenv()
 
-EMBEDDING_FN = HuggingFaceEmbeddings(
-    model_name = os.getenv('EMBEDDING_MODEL'),
-    model_kwargs = {'device' : 'cuda' if torch.cuda.is_available() else 'mps'},
-    encode_kwargs = {'normalize_embeddings' : True}
-)
 class DocType(enum.Enum):
     STRUCTURED = "STRUCTURED"
     UNSTRUCTURED = "UNSTRUCTURED"
 
+
+@dataclass
+class ChunkingConfig:
+    parent_size : int = int(os.getenv('CHUNK_PARENT_SIZE', 1200))
+    parent_overlap : int = int(os.getenv('CHUNK_PARENT_OVERLAP', 120))
+    child_size : int = int(os.getenv('CHUNK_CHILD_SIZE', 500))
+    child_overlap : int = int(os.getenv('CHUNK_CHILD_OVERLAP', 100))
+    semantic_child_size : int = int(os.getenv('CHUNK_SEMANTIC_CHILD_SIZE', 400))
+    semantic_child_overlap : int = int(os.getenv('CHUNK_SEMANTIC_CHILD_OVERLAP', 40))
+    semantic_breakpoint : float = float(os.getenv('CHUNK_SEMANTIC_BREAKPOINT', 90))
+
+
+DEFAULT_CHUNKING = ChunkingConfig()
+
 def classify_document(docs: List[Document], threshold : float = .1) -> DocType:
     full_text = "".join([doc.page_content for doc in docs])
     if not full_text.strip():
@@ -65,7 +86,8 @@ def classify_document(docs: List[Document], threshold : float = .1) -> DocType:
         return DocType.UNSTRUCTURED
     
 
-def _chunk_structured_document(docs: List[Document]) -> List[Document]:
+def _chunk_structured_document(docs: List[Document], config : Optional[ChunkingConfig] = None) -> List[Document]:
+    config = config or DEFAULT_CHUNKING
     BILINGUAL_LEGAL_SEPARATORS = [
         "\n\nChương ", "\n\nChapter ", "\n\nPart ",
         "\n\nĐiều ", "\n\nArticle ", "\n\nSection ", "\n\nSec. ", "\n\nMục ",
@@ -74,15 +96,15 @@ def _chunk_structured_document(docs: List[Document]) -> List[Document]:
     ]
     
     parent_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1200,   
-        chunk_overlap=120,    
+        chunk_size=config.parent_size,
+        chunk_overlap=config.parent_overlap,
         separators=BILINGUAL_LEGAL_SEPARATORS,
         keep_separator = True
     )
 
     child_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=100,
+        chunk_size=config.child_size,
+        chunk_overlap=config.child_overlap,
         separators=[r"\n\d+\.\s", r"\n[a-z]\)\s", r"\n\(\d+\)\s", r"\n\([a-z]\)\s",
         "\n\n", "\n", ". ", " "],
         keep_separator=True
@@ -109,13 +131,16 @@ def _chunk_structured_document(docs: List[Document]) -> List[Document]:
     return all_chunks
 
 
-def _chunk_semantic_document(docs: List[Document]) -> List[Document]:
+def _chunk_semantic_document(docs: List[Document], config : Optional[ChunkingConfig] = None) -> List[Document]:
+    config = config or DEFAULT_CHUNKING
     semantic_splitter = SemanticChunker(
-        embeddings=EMBEDDING_FN, 
+        embeddings=get_embedding_fn(),
         breakpoint_threshold_type="percentile", 
-        breakpoint_threshold_amount=90
+        breakpoint_threshold_amount=config.semantic_breakpoint
+    )
+    child_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=config.semantic_child_size, chunk_overlap=config.semantic_child_overlap
     )
-    child_splitter = RecursiveCharacterTextSplitter(chunk_size=400, chunk_overlap=40)
     parent_chunks = semantic_splitter.split_documents(docs)
     
     all_chunks = []
@@ -136,78 +161,306 @@ def _chunk_semantic_document(docs: List[Document]) -> List[Document]:
     return all_chunks
 
 
-def process_document(file_name : str, media_id : int, format : str = 'pdf'):
+def chunk_documents(docs : List[Document], config : Optional[ChunkingConfig] = None) -> List[Document]:
+    if classify_document(docs) == DocType.STRUCTURED:
+        return _chunk_structured_document(docs, config)
+    return _chunk_semantic_document(docs, config)
+
+
+CHUNK_COLUMNS = ['id', 'content', 'chunk_level', 'chunk_metadata', 'embedding', 'source_doc_id', 'parent_id']
+
+
+def encode_embeddings(embeddings) -> str:
+    # float32 bytes in base64: ~4x smaller than a JSON list of floats when passed between Celery stages.
+    return base64.b64encode(np.ascontiguousarray(embeddings, dtype=np.float32).tobytes()).decode('ascii')
+
+
+def decode_embeddings(data : str, dim : int) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32).reshape(-1, dim)
+
+
+def embed_for(model : ModelRef, contents : List[str], serialize : bool = True) -> dict:
+    """
+    One model's vectors for `contents`. Serialized (base64) for the Celery handoff to the write
+    stage; in-process callers keep the float32 array itself so it reaches COPY without a copy.
+    """
+    vectors = embed_matrix(model.embeddings(), contents)
+    entry = {
+        'name' : model.name,
+        'inline' : model.inline,
+        'dim' : int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+    }
+    if serialize:
+        entry['data'] = encode_embeddings(vectors)
+    else:
+        entry['array'] = vectors
+    return entry
+
+
+def _decode_vectors(vectors : dict) -> Dict[int, Tuple[ModelRef, np.ndarray]]:
+    return {
+        int(model_id) : (
+            ModelRef(id = int(model_id), name = entry['name'], dim = entry['dim'], inline = entry['inline']),
+            entry['array'] if 'array' in entry else decode_embeddings(entry['data'], entry['dim'])
+        )
+        for model_id, entry in vectors.items()
+    }
+
+
+def mark_failed(source_doc_id : Optional[int]):
+    if not source_doc_id:
+        return
+    with SessionLocal() as session:
+        failed_docs = session.get(SourceDocument, source_doc_id)
+        if failed_docs:
+            failed_docs.status = IngestStatus.FAILED
+            session.commit()
+
+
+def record_progress(source_doc_id : Optional[int], timings : Optional[dict] = None, **fields):
+    if not source_doc_id:
+        return
+    with SessionLocal() as session:
+        source_docs = session.get(SourceDocument, source_doc_id)
+        if not source_docs:
+            return
+        for key, value in fields.items():
+            setattr(source_docs, key, value)
+        if timings:
+            source_docs.stage_timings = {**(source_docs.stage_timings or {}), **timings}
+        session.commit()
+
+
+def _notify(progress : Optional[Callable[[str, dict], None]], stage : str, **meta):
+    if progress is None:
+        return
+    try:
+        progress(stage, meta)
+    except Exception as e:
+        log.warning(f"Progress callback failed at stage {stage} : {e}")
+
+
+@tracer.start_as_current_span('ingest.parse')
+def parse_document(file_name : str, media_id : int, format : str = 'pdf',
+                   progress : Optional[Callable[[str, dict], None]] = None,
+                   docs : Optional[List[Document]] = None,
+                   content_hash : Optional[str] = None) -> Optional[dict]:
+    """
+    Loads and chunks a document and registers its SourceDocument as PROCESSING.
+    Pages already in memory can be passed as `docs` to skip loading the file; with
+    `content_hash` the file is read from the object store (uploads) instead of data/.
+    Returns a JSON-serializable payload for the embedding stage, or None when skipped.
+    """
     log.info(f"--- Starting processing for: {file_name} ---")
-    dir_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'processed')
-    file_path = os.path.join(dir_path, f'{file_name}.pdf')
-    
+    if content_hash:
+        file_path = ObjectStore().path(content_hash)
+    else:
+        dir_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'processed')
+        file_path = os.path.join(dir_path, f'{file_name}.{format}')
+
     with SessionLocal() as session:
         try:
-            stmt = select(SourceDocument).where(or_(
-                SourceDocument.media_id == media_id, SourceDocument.file_path == file_path)
-            )
+            if content_hash:
+                # The same bytes uploaded under another media_id are not processed twice; failed ones are retried.
+                same_file = and_(SourceDocument.content_hash == content_hash, SourceDocument.status != IngestStatus.FAILED)
+            else:
+                same_file = SourceDocument.file_path == file_path
+            stmt = select(SourceDocument).where(or_(SourceDocument.media_id == media_id, same_file))
             existing_doc = session.execute(stmt).scalars().first()
             if existing_doc:
-                log.warning(f"Document with M_ID {media_id} already exist. Skipping process.")
-                return
+                log.warning(f"Document with M_ID {media_id} or the same file already exist. Skipping process.")
+                return None
         except Exception as e:
             log.error(f"Unexpected error : {e}")
-            return
+            return None
+    started = time.perf_counter()
     try:
-        docs_from_file = load_from_document(file_name)
+        if docs is not None:
+            docs_from_file = docs
+        elif content_hash:
+            docs_from_file = load_from_file(file_path, format)
+        else:
+            docs_from_file = load_from_document(file_name, format)
         if not docs_from_file:
             log.warning(f"No content extracted. Aborting...")
-            return
+            return None
     except Exception as e:
         log.error(f"Failed to load documents : {e}")
-        return
-    with SessionLocal() as session:
-        try:
+        return None
+    timings = {'load_ms' : (time.perf_counter() - started) * 1000}
+    INGEST_STAGE_SECONDS.labels('load').observe(timings['load_ms'] / 1000)
+    INGEST_PAGES.inc(len(docs_from_file))
+    _notify(progress, 'loaded', media_id = media_id, pages = len(docs_from_file))
+
+    source_doc_id = None
+    try:
+        with SessionLocal() as session:
+            if content_hash:
+                # A FAILED earlier upload of the same bytes holds this file_path (unique); the retry replaces it.
+                replaced = session.execute(
+                    delete(SourceDocument).where(
+                        SourceDocument.file_path == file_path, SourceDocument.status == IngestStatus.FAILED
+                    ).returning(SourceDocument.media_id),
+                    execution_options = {'synchronize_session' : False}
+                ).scalars().all()
+                if replaced:
+                    log.info(f"Replacing failed upload of the same file (M_ID {replaced}) with M_ID {media_id}")
             source_docs = SourceDocument(
                 media_id = media_id,
                 file_name = file_name,
                 file_path = file_path,
+                content_hash = content_hash,
+                format = format,
                 page_count = len(docs_from_file),
                 status = IngestStatus.PROCESSING,
                 created_at = datetime.now(timezone.utc)
             )
             session.add(source_docs)
             session.commit()
-            session.refresh(source_docs)
+            source_doc_id = source_docs.id
             log.info(f"Created source documents with M_ID : {media_id}")
-            
 
-            doc_type = classify_document(docs_from_file)
-            all_chunks = _chunk_structured_document(docs_from_file) if doc_type == DocType.STRUCTURED else _chunk_semantic_document(docs_from_file)
-            chunks_content = [doc.page_content for doc in all_chunks]
-            chunks_embedded = EMBEDDING_FN.embed_documents(chunks_content)
-
-            all_db_chunks = []
-            for i, chunk in enumerate(all_chunks):
-                all_db_chunks.append(
-                    Chunk(
-                        id = chunk.metadata.get('id'),
-                        content = chunk.page_content,
-                        chunk_level = chunk.metadata.get('chunk_level'),
-                        embedding = chunks_embedded[i],
-                        chunk_metadata = {'page' : chunk.metadata.get('page') + 1},
-                        source_doc_id = source_docs.id,
-                        parent_id = chunk.metadata.get('parent_id')
-                    )
+        started = time.perf_counter()
+        all_chunks = chunk_documents(docs_from_file)
+        timings['chunk_ms'] = (time.perf_counter() - started) * 1000
+        INGEST_STAGE_SECONDS.labels('chunk').observe(timings['chunk_ms'] / 1000)
+        record_progress(source_doc_id, timings)
+    except Exception as e:
+        log.error(f"Error occurred while chunking {file_name} : {e}")
+        mark_failed(source_doc_id)
+        return None
+    set_attributes({'ingest.media_id' : media_id, 'ingest.pages' : len(docs_from_file), 'ingest.chunks' : len(all_chunks)})
+    _notify(progress, 'parsed', media_id = media_id, pages = len(docs_from_file), chunks = len(all_chunks), timings = timings)
+    return {
+        'file_name' : file_name,
+        'media_id' : media_id,
+        'source_doc_id' : source_doc_id,
+        'pages' : len(docs_from_file),
+        'timings' : timings,
+        'chunks' : [
+            {
+                'id' : chunk.metadata.get('id'),
+                'content' : chunk.page_content,
+                'chunk_level' : chunk.metadata.get('chunk_level').value,
+                'parent_id' : chunk.metadata.get('parent_id'),
+                'page' : chunk.metadata.get('page') + 1
+            }
+            for chunk in all_chunks
+        ]
+    }
+
+
+@tracer.start_as_current_span('ingest.embed')
+def embed_chunks(payload : Optional[dict], progress : Optional[Callable[[str, dict], None]] = None,
+                 serialize : bool = True) -> Optional[dict]:
+    if not payload:
+        return payload
+    started = time.perf_counter()
+    try:
+        chunks_content = [chunk['content'] for chunk in payload['chunks']]
+        # Models being re-embedded into get this document's vectors too, so the rebuild never falls behind.
+        active = ACTIVE_MODEL.get_sync()
+        models = [active] + [model for model in building_models() if model.id != active.id]
+        vectors = {str(model.id) : embed_for(model, chunks_content, serialize) for model in models}
+    except Exception as e:
+        log.error(f"Error occurred while embedding M_ID {payload['media_id']} : {e}")
+        mark_failed(payload['source_doc_id'])
+        return None
+    timings = {**payload.get('timings', {}), 'embed_ms' : (time.perf_counter() - started) * 1000}
+    INGEST_STAGE_SECONDS.labels('embed').observe(timings['embed_ms'] / 1000)
+    INGEST_CHUNKS_EMBEDDED.inc(len(chunks_content))
+    if timings['embed_ms'] > 0:
+        INGEST_EMBED_RATE.observe(len(chunks_content) / (timings['embed_ms'] / 1000))
+    record_progress(payload['source_doc_id'], timings, chunks_embedded = len(chunks_content))
+    log.info(f"Embedded {len(chunks_content)} chunks for M_ID {payload['media_id']}.")
+    set_attributes({'ingest.media_id' : payload['media_id'], 'ingest.chunks_embedded' : len(chunks_content)})
+    _notify(progress, 'embedded', media_id = payload['media_id'], chunks_embedded = len(chunks_content), timings = timings)
+    return {
+        **payload,
+        'timings' : timings,
+        'vectors' : vectors
+    }
+
+
+@tracer.start_as_current_span('ingest.write')
+def write_chunks(payload : Optional[dict], progress : Optional[Callable[[str, dict], None]] = None) -> Optional[dict]:
+    if not payload:
+        return payload
+    started = time.perf_counter()
+    media_id = payload['media_id']
+    with SessionLocal() as session:
+        try:
+            vectors = _decode_vectors(payload['vectors'])
+            active = ACTIVE_MODEL.get_sync(refresh = True)
+            if active.id not in vectors:
+                # The active model was switched between the embed and write stages.
+                contents = [chunk['content'] for chunk in payload['chunks']]
+                vectors[active.id] = (active, embed_matrix(active.embeddings(), contents))
+            live = {active.id} | {model.id for model in building_models()}
+            inline = next((embedded for model, embedded in vectors.values() if model.inline), None)
+
+            source_docs = session.get(SourceDocument, payload['source_doc_id'])
+            source_docs.centroid = compute_centroid(inline) if inline is not None else None
+
+            # Binary COPY on the session's connection (same transaction): vectors go from the float32
+            # arrays to pgvector's binary format without a Python float or text literal per element.
+            chunks = payload['chunks']
+            cursor = session.connection().connection.cursor()
+            inline_fields = vector_fields(inline) if inline is not None else [NULL] * len(chunks)
+            doc_field = int4_field(source_docs.id)
+            written = copy_rows(cursor, 'chunks', CHUNK_COLUMNS, (
+                row(
+                    text_field(chunk['id']),
+                    text_field(chunk['content']),
+                    text_field(ChunkLevel(chunk['chunk_level']).value),
+                    json_field({'page' : chunk['page']}),
+                    inline_fields[i],
+                    doc_field,
+                    text_field(chunk['parent_id'])
                 )
-            session.add_all(all_db_chunks)
+                for i, chunk in enumerate(chunks)
+            ))
+            for model, embedded in vectors.values():
+                if model.inline or model.id not in live:
+                    continue
+                model_field = int4_field(model.id)
+                copy_rows(cursor, 'chunk_embeddings', ['chunk_id', 'model_id', 'embedding'], (
+                    row(text_field(chunk['id']), model_field, vector)
+                    for chunk, vector in zip(chunks, vector_fields(embedded))
+                ))
+                session.merge(DocumentCentroid(
+                    source_doc_id = source_docs.id, model_id = model.id, centroid = compute_centroid(embedded)
+                ))
+            session.flush()
+            timings = {**payload.get('timings', {}), 'write_ms' : (time.perf_counter() - started) * 1000}
+            source_docs.chunks_written = written
+            source_docs.stage_timings = {**(source_docs.stage_timings or {}), **timings}
             source_docs.status = IngestStatus.COMPLETED
             source_docs.processed_at = datetime.now(timezone.utc)
             session.commit()
-            log.info(f"Successfully stored object M_ID {media_id} with {len(all_db_chunks)} chunks.")
+            INGEST_STAGE_SECONDS.labels('write').observe(timings['write_ms'] / 1000)
+            INGEST_CHUNKS_WRITTEN.inc(written)
+            log.info(f"Successfully stored object M_ID {media_id} with {written} chunks.")
         except Exception as e:
-            log.error(f"Error occurred during DB operations for {file_name} : {e}")
+            log.error(f"Error occurred during DB operations for {payload['file_name']} : {e}")
             session.rollback()
-            if source_docs and source_docs.id:
-                failed_docs = session.get(SourceDocument, SourceDocument.id)
-                if failed_docs:
-                    failed_docs.status = IngestStatus.FAILED
-                    session.commit()
-        finally:
-            session.close()
+            mark_failed(payload['source_doc_id'])
+            return None
+    set_attributes({'ingest.media_id' : media_id, 'ingest.chunks_written' : written})
+    _notify(progress, 'written', media_id = media_id, chunks_written = written, timings = timings)
+    return {
+        'file_name' : payload['file_name'],
+        'media_id' : media_id,
+        'source_doc_id' : payload['source_doc_id'],
+        'pages' : payload['pages'],
+        'chunks' : len(payload['chunks']),
+        'timings' : timings
+    }
+
 
+def process_document(file_name : str, media_id : int, format : str = 'pdf',
+                     progress : Optional[Callable[[str, dict], None]] = None,
+                     content_hash : Optional[str] = None) -> Optional[dict]:
+    payload = parse_document(file_name, media_id, format, progress = progress, content_hash = content_hash)
+    # In one process the vectors stay a float32 array from the encoder to the COPY buffer.
+    return write_chunks(embed_chunks(payload, progress = progress, serialize = False), progress = progress)
@@ -0,0 +1,251 @@
+import os
+import time
+import logging
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+from sqlalchemy import bindparam, exists, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+
+from src.core.database import SessionLocal, engine
+from src.core.embeddings import get_embedding_fn
+from src.core.metrics import REEMBED_CHUNKS
+from src.models.chunks import Chunk
+from src.models.embedding_models import ChunkEmbedding, EmbeddingModel, EmbeddingModelStatus
+from src.rag.vectors import ACTIVE_MODEL, ModelRef
+
+logging.basicConfig(
+    level = logging.INFO,
+    format = '%(asctime)s - %(levelname)s - %(message)s'
+)
+log = logging.getLogger(__name__)
+
+REEMBED_BATCH_SIZE = int(os.getenv('REEMBED_BATCH_SIZE', 256))
+# pgvector cannot build HNSW indexes over vectors wider than this.
+HNSW_MAX_DIM = 2000
+
+
+def _notify(progress : Optional[Callable[[str, dict], None]], stage : str, **meta):
+    if progress is not None:
+        progress(stage, meta)
+
+
+def _missing(model : ModelRef):
+    if model.inline:
+        return Chunk.embedding.is_(None)
+    return ~exists().where(ChunkEmbedding.chunk_id == Chunk.id, ChunkEmbedding.model_id == model.id)
+
+
+def start_reembedding(model_name : str) -> dict:
+    """
+    Registers `model_name` as a BUILDING model. A model that already failed or is still
+    building is resumed rather than duplicated; its stored vectors are kept. Naming the retired
+    inline model refills the chunks.embedding vectors left NULL while another model was active.
+    """
+    with SessionLocal() as session:
+        row = session.execute(
+            # A side-table model of the same name predates inline rebuilds; it wins.
+            select(EmbeddingModel).where(EmbeddingModel.name == model_name).order_by(EmbeddingModel.inline)
+        ).scalars().first()
+        if row is not None and row.status == EmbeddingModelStatus.ACTIVE:
+            raise ValueError(f'{model_name} is already the active embedding model')
+        if row is None:
+            dim = len(get_embedding_fn(model_name).embed_query('dimension probe'))
+            row = EmbeddingModel(name = model_name, dim = dim, status = EmbeddingModelStatus.BUILDING)
+            session.add(row)
+        row.status = EmbeddingModelStatus.BUILDING
+        row.error = None
+        row.chunks_total = session.execute(select(func.count(Chunk.id))).scalar_one()
+        if row.inline:
+            row.chunks_done = session.execute(select(func.count(Chunk.id)).where(Chunk.embedding.is_not(None))).scalar_one()
+        session.commit()
+        log.info(f'Re-embedding {row.chunks_total} chunks into {model_name} (model {row.id}, dim {row.dim}).')
+        return {'model_id' : row.id, 'name' : row.name, 'dim' : row.dim, 'chunks_total' : row.chunks_total}
+
+
+def _embed_batch(session, model : ModelRef, after : Optional[str], batch_size : int) -> List[str]:
+    stmt = select(Chunk.id, Chunk.content).where(_missing(model))
+    if after is not None:
+        stmt = stmt.where(Chunk.id > after)
+    rows = session.execute(stmt.order_by(Chunk.id).limit(batch_size)).all()
+    if not rows:
+        return []
+    vectors = model.embeddings().embed_documents([row.content for row in rows])
+    if model.inline:
+        inserted = _fill_inline(session, rows, vectors)
+        session.execute(
+            update(EmbeddingModel).where(EmbeddingModel.id == model.id).values(chunks_done = EmbeddingModel.chunks_done + inserted)
+        )
+        session.commit()
+        REEMBED_CHUNKS.labels(model.name).inc(inserted)
+        return [row.id for row in rows]
+    values = [
+        {'chunk_id' : row.id, 'model_id' : model.id, 'embedding' : vector}
+        for row, vector in zip(rows, vectors)
+    ]
+    try:
+        # Ingestion writes vectors for BUILDING models too, so a row may already be there.
+        inserted = session.execute(insert(ChunkEmbedding).values(values).on_conflict_do_nothing()).rowcount
+    except IntegrityError:
+        # A chunk was deleted between the read and the insert; keep only the ones that still exist.
+        session.rollback()
+        alive = set(session.execute(select(Chunk.id).where(Chunk.id.in_([row.id for row in rows]))).scalars())
+        values = [value for value in values if value['chunk_id'] in alive]
+        inserted = session.execute(insert(ChunkEmbedding).values(values).on_conflict_do_nothing()).rowcount if values else 0
+    session.execute(
+        update(EmbeddingModel).where(EmbeddingModel.id == model.id).values(chunks_done = EmbeddingModel.chunks_done + inserted)
+    )
+    session.commit()
+    REEMBED_CHUNKS.labels(model.name).inc(inserted)
+    return [row.id for row in rows]
+
+
+def _fill_inline(session, rows, vectors) -> int:
+    # Deleted chunks simply match no row; chunks written inline by ingestion meanwhile are left alone.
+    chunks = Chunk.__table__
+    result = session.execute(
+        update(chunks).where(chunks.c.id == bindparam('chunk_id'), chunks.c.embedding.is_(None))
+        .values(embedding = bindparam('vector')),
+        [{'chunk_id' : row.id, 'vector' : vector} for row, vector in zip(rows, vectors)]
+    )
+    return result.rowcount if result.rowcount >= 0 else len(rows)
+
+
+def _catch_up(session, model : ModelRef, batch_size : int) -> int:
+    """Embeds every chunk still missing a vector for `model`, including ones ingested behind the scan."""
+    embedded = 0
+    while True:
+        ids = _embed_batch(session, model, None, batch_size)
+        if not ids:
+            return embedded
+        embedded += len(ids)
+
+
+def build_centroids(session, model : ModelRef, source_doc_ids : Optional[List[int]] = None) -> None:
+    """Recomputes `model`'s document centroids (all documents, or only `source_doc_ids`); the caller commits."""
+    params = {'model_id' : model.id}
+    scope = ''
+    if source_doc_ids is not None:
+        params['source_doc_ids'] = list(source_doc_ids)
+        scope = 'AND c.source_doc_id = ANY(:source_doc_ids)'
+    if model.inline:
+        session.execute(text(f"""
+            UPDATE source_documents sd SET centroid = sub.centroid
+            FROM (
+                SELECT c.source_doc_id, avg(c.embedding) AS centroid
+                FROM chunks c WHERE c.embedding IS NOT NULL {scope}
+                GROUP BY c.source_doc_id
+            ) sub
+            WHERE sd.id = sub.source_doc_id
+        """), params)
+        return
+    session.execute(text(f"""
+        INSERT INTO document_centroids (source_doc_id, model_id, centroid)
+        SELECT c.source_doc_id, :model_id, avg(ce.embedding::vector({model.dim}))
+        FROM chunk_embeddings ce JOIN chunks c ON c.id = ce.chunk_id
+        WHERE ce.model_id = :model_id {scope}
+        GROUP BY c.source_doc_id
+        ON CONFLICT (source_doc_id, model_id) DO UPDATE SET centroid = excluded.centroid
+    """), params)
+
+
+def _build_index(model : ModelRef) -> None:
+    if model.inline:
+        # chunks.embedding has had its HNSW index since the initial migrations.
+        return
+    if model.dim > HNSW_MAX_DIM:
+        log.warning(f'{model.name} has {model.dim} dimensions; no HNSW index, searches will scan.')
+        return
+    # CONCURRENTLY keeps chunk_embeddings writable (ingestion keeps dual-writing) but cannot run in a transaction.
+    with engine.connect().execution_options(isolation_level = 'AUTOCOMMIT') as connection:
+        connection.execute(text(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_chunk_embeddings_hnsw_{model.id} ON chunk_embeddings '
+            f'USING hnsw ((embedding::vector({model.dim})) vector_cosine_ops) WHERE model_id = {model.id}'
+        ))
+
+
+def reembed_corpus(model_id : int, batch_size : int = REEMBED_BATCH_SIZE, activate : bool = False,
+                   progress : Optional[Callable[[str, dict], None]] = None) -> dict:
+    """
+    Embeds every chunk into a BUILDING model batch by batch while the active model keeps
+    serving, then builds its centroids and HNSW index. With `activate` it switches over at the end.
+    Safe to re-run: chunks that already have a vector for the model are skipped.
+    """
+    started = time.perf_counter()
+    report = {'model_id' : model_id, 'chunks_embedded' : 0, 'activated' : False, 'elapsed_ms' : 0.0, 'error' : None}
+    with SessionLocal() as session:
+        try:
+            row = session.get(EmbeddingModel, model_id)
+            if row is None or row.status != EmbeddingModelStatus.BUILDING:
+                raise ValueError(f'Embedding model {model_id} is not being built')
+            model = ModelRef.of(row)
+            after = None
+            while True:
+                ids = _embed_batch(session, model, after, batch_size)
+                if not ids:
+                    break
+                after = ids[-1]
+                report['chunks_embedded'] += len(ids)
+                rate = report['chunks_embedded'] / (time.perf_counter() - started)
+                row = session.get(EmbeddingModel, model_id, populate_existing = True)
+                row.chunks_per_second = rate
+                session.commit()
+                _notify(progress, 'embedding', model_id = model_id, chunks_done = row.chunks_done,
+                        chunks_total = row.chunks_total, chunks_per_second = rate)
+            report['chunks_embedded'] += _catch_up(session, model, batch_size)
+            _notify(progress, 'indexing', model_id = model_id)
+            build_centroids(session, model)
+            session.commit()
+            _build_index(model)
+            log.info(f'Re-embedded {report["chunks_embedded"]} chunks into {model.name}.')
+        except Exception as e:
+            log.error(f'Re-embedding into model {model_id} failed : {e}')
+            session.rollback()
+            session.execute(
+                update(EmbeddingModel).where(EmbeddingModel.id == model_id, EmbeddingModel.status == EmbeddingModelStatus.BUILDING)
+                .values(status = EmbeddingModelStatus.FAILED, error = str(e))
+            )
+            session.commit()
+            report['error'] = str(e)
+        finally:
+            report['elapsed_ms'] = (time.perf_counter() - started) * 1000
+    if activate and report['error'] is None:
+        try:
+            report.update(activate_model(model_id, batch_size))
+        except ValueError as e:
+            log.error(f'Could not activate embedding model {model_id} : {e}')
+            report['error'] = str(e)
+    return report
+
+
+def activate_model(model_id : int, batch_size : int = REEMBED_BATCH_SIZE, catch_up : bool = True) -> dict:
+    """
+    Makes `model_id` the ACTIVE model in one transaction once every chunk has a vector for it.
+    Readers resolve the active model per request, so each request sees either the old or the new model.
+    Without `catch_up` (the API, which never loads embedding models) missing vectors are an error.
+    """
+    with SessionLocal() as session:
+        row = session.get(EmbeddingModel, model_id)
+        if row is None or row.status not in (EmbeddingModelStatus.BUILDING, EmbeddingModelStatus.RETIRED):
+            raise ValueError(f'Embedding model {model_id} cannot be activated')
+        model = ModelRef.of(row)
+        # Documents ingested since the rebuild finished, or since the model was retired: while another
+        # model is active nothing writes this one's vectors.
+        if catch_up and _catch_up(session, model, batch_size):
+            build_centroids(session, model)
+        missing = session.execute(select(func.count(Chunk.id)).where(_missing(model))).scalar_one()
+        if missing:
+            raise ValueError(f'{missing} chunks have no vector for embedding model {model_id}; '
+                             f're-embed into {model.name} (POST /embedding-models) before activating it')
+        session.execute(
+            update(EmbeddingModel).where(EmbeddingModel.status == EmbeddingModelStatus.ACTIVE)
+            .values(status = EmbeddingModelStatus.RETIRED)
+        )
+        row = session.get(EmbeddingModel, model_id, populate_existing = True)
+        row.status = EmbeddingModelStatus.ACTIVE
+        row.activated_at = datetime.now(timezone.utc)
+        row.chunks_done = row.chunks_total = session.execute(select(func.count(Chunk.id))).scalar_one()
+        session.commit()
+    ACTIVE_MODEL.invalidate()
+    log.info(f'Embedding model {model.name} (model {model_id}) is now active.')
+    return {'model_id' : model_id, 'activated' : True}
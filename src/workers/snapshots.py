@@ -0,0 +1,407 @@
+"""
+Parquet snapshots of processed documents: their source_documents rows and chunks, vectors included.
+
+    python -m src.workers.snapshots export snapshots/prod --media_ids 12 13
+    DB_URL=... python -m src.workers.snapshots import snapshots/prod --replace
+
+Importing needs no model inference: chunks and vectors are bulk-loaded with binary COPY,
+with the secondary indexes dropped during the load and rebuilt once at the end.
+"""
+import os
+import json
+import time
+import logging
+import argparse
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import delete, insert, select, text
+
+from src.core.database import SessionLocal, engine
+from src.core.objects import ObjectStore
+from src.core.pgcopy import copy_rows, int4_field, row, text_field, vector_fields
+from src.models.chunks import Chunk, ChunkLevel
+from src.models.embedding_models import ChunkEmbedding, EmbeddingModel, EmbeddingModelStatus
+from src.models.source_documents import SourceDocument, IngestStatus
+from src.rag.vectors import ModelRef
+from .reembed import build_centroids
+
+logging.basicConfig(
+    level = logging.INFO,
+    format = '%(asctime)s - %(levelname)s - %(message)s'
+)
+log = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 2
+# Version 1 snapshots lack content_hash and format; they import with both NULL.
+READABLE_VERSIONS = {1, SNAPSHOT_VERSION}
+SNAPSHOT_BATCH_ROWS = int(os.getenv('SNAPSHOT_BATCH_ROWS', 10000))
+# Memory for the index rebuilds after a load; HNSW builds are much faster when the graph fits.
+SNAPSHOT_MAINTENANCE_WORK_MEM = os.getenv('SNAPSHOT_MAINTENANCE_WORK_MEM', '1GB')
+INLINE_DIM = 1024
+# Tables whose secondary indexes are dropped for the load and rebuilt afterwards.
+DEFERRED_INDEX_TABLES = ['chunks', 'chunk_embeddings']
+
+
+def _vector_type(dim : int) -> pa.DataType:
+    return pa.list_(pa.float32(), dim)
+
+
+DOCUMENT_SCHEMA = pa.schema([
+    ('media_id', pa.int64()),
+    ('file_name', pa.string()),
+    ('file_path', pa.string()),
+    ('content_hash', pa.string()),
+    ('format', pa.string()),
+    ('page_count', pa.int32()),
+    ('status', pa.string()),
+    ('created_at', pa.timestamp('us')),
+    ('processed_at', pa.timestamp('us')),
+    ('chunks_embedded', pa.int32()),
+    ('chunks_written', pa.int32()),
+    ('stage_timings', pa.string()),
+    ('centroid', _vector_type(INLINE_DIM)),
+])
+CHUNK_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('media_id', pa.int64()),
+    ('parent_id', pa.string()),
+    ('chunk_level', pa.string()),
+    ('content', pa.string()),
+    ('chunk_metadata', pa.string()),
+    ('embedding', _vector_type(INLINE_DIM)),
+])
+
+
+def _vector_schema(dim : int) -> pa.Schema:
+    return pa.schema([('chunk_id', pa.string()), ('media_id', pa.int64()), ('embedding', _vector_type(dim))])
+
+
+def _to_vector_array(vectors : List, dim : int) -> pa.Array:
+    matrix = np.zeros((len(vectors), dim), dtype = np.float32)
+    missing = []
+    for i, vector in enumerate(vectors):
+        missing.append(vector is None)
+        if vector is not None:
+            matrix[i] = vector
+    return pa.FixedSizeListArray.from_arrays(pa.array(matrix.reshape(-1)), dim, mask = pa.array(missing))
+
+
+def _from_vector_array(array : pa.Array):
+    """(n x dim float32 matrix, validity mask) of a fixed-size list column, without a per-element Python object."""
+    dim = array.type.list_size
+    values = array.values.slice(array.offset * dim, len(array) * dim)
+    matrix = values.to_numpy(zero_copy_only = False).reshape(len(array), dim)
+    return matrix, array.is_valid().to_numpy(zero_copy_only = False)
+
+
+def _write_batches(path : Path, schema : pa.Schema, batches) -> int:
+    written = 0
+    with pq.ParquetWriter(path, schema, compression = 'zstd') as writer:
+        for columns in batches:
+            batch = pa.record_batch(columns, schema = schema)
+            writer.write_batch(batch)
+            written += batch.num_rows
+    return written
+
+
+def export_snapshot(out_dir : str, media_ids : Optional[List[int]] = None, batch_rows : int = SNAPSHOT_BATCH_ROWS) -> dict:
+    """Writes the COMPLETED documents in `media_ids` (all of them when omitted) with their chunks and vectors."""
+    started = time.perf_counter()
+    out = Path(out_dir)
+    out.mkdir(parents = True, exist_ok = True)
+    with SessionLocal() as session:
+        stmt = select(SourceDocument).where(SourceDocument.status == IngestStatus.COMPLETED).order_by(SourceDocument.media_id)
+        if media_ids:
+            stmt = stmt.where(SourceDocument.media_id.in_(media_ids))
+        docs = session.execute(stmt).scalars().all()
+        exported_ids = [doc.media_id for doc in docs]
+        pq.write_table(pa.table({
+            'media_id' : exported_ids,
+            'file_name' : [doc.file_name for doc in docs],
+            'file_path' : [doc.file_path for doc in docs],
+            'content_hash' : [doc.content_hash for doc in docs],
+            'format' : [doc.format for doc in docs],
+            'page_count' : [doc.page_count for doc in docs],
+            'status' : [doc.status.value for doc in docs],
+            'created_at' : [doc.created_at for doc in docs],
+            'processed_at' : [doc.processed_at for doc in docs],
+            'chunks_embedded' : [doc.chunks_embedded for doc in docs],
+            'chunks_written' : [doc.chunks_written for doc in docs],
+            'stage_timings' : [json.dumps(doc.stage_timings) if doc.stage_timings else None for doc in docs],
+            'centroid' : _to_vector_array([doc.centroid for doc in docs], INLINE_DIM),
+        }, schema = DOCUMENT_SCHEMA), out / 'source_documents.parquet', compression = 'zstd')
+
+        # Parents first, so that on import every parent_id already exists when its children are copied.
+        chunk_stmt = select(
+            Chunk.id, SourceDocument.media_id, Chunk.parent_id, Chunk.chunk_level, Chunk.content,
+            Chunk.chunk_metadata, Chunk.embedding
+        ).join(SourceDocument).where(SourceDocument.media_id.in_(exported_ids)).order_by(
+            Chunk.parent_id.is_not(None), Chunk.id
+        ).execution_options(yield_per = batch_rows)
+
+        def chunk_batches():
+            for rows in session.execute(chunk_stmt).partitions():
+                yield {
+                    'id' : [r.id for r in rows],
+                    'media_id' : [r.media_id for r in rows],
+                    'parent_id' : [r.parent_id for r in rows],
+                    'chunk_level' : [r.chunk_level.value for r in rows],
+                    'content' : [r.content for r in rows],
+                    'chunk_metadata' : [json.dumps(r.chunk_metadata, ensure_ascii = False) for r in rows],
+                    'embedding' : _to_vector_array([r.embedding for r in rows], INLINE_DIM),
+                }
+        chunks = _write_batches(out / 'chunks.parquet', CHUNK_SCHEMA, chunk_batches())
+
+        inline = session.execute(select(EmbeddingModel).where(EmbeddingModel.inline.is_(True))).scalars().first()
+        manifest_models = [{'name' : inline.name if inline else None, 'dim' : INLINE_DIM, 'inline' : True}]
+        side_models = session.execute(select(EmbeddingModel).where(
+            EmbeddingModel.inline.is_(False), EmbeddingModel.status != EmbeddingModelStatus.FAILED
+        ).order_by(EmbeddingModel.id)).scalars().all()
+        for model in side_models:
+            vector_stmt = select(ChunkEmbedding.chunk_id, SourceDocument.media_id, ChunkEmbedding.embedding).join(
+                Chunk, Chunk.id == ChunkEmbedding.chunk_id
+            ).join(SourceDocument).where(
+                ChunkEmbedding.model_id == model.id, SourceDocument.media_id.in_(exported_ids)
+            ).execution_options(yield_per = batch_rows)
+
+            def vector_batches():
+                for rows in session.execute(vector_stmt).partitions():
+                    yield {
+                        'chunk_id' : [r.chunk_id for r in rows],
+                        'media_id' : [r.media_id for r in rows],
+                        'embedding' : _to_vector_array([r.embedding for r in rows], model.dim),
+                    }
+            file_name = f'vectors_{len(manifest_models)}.parquet'
+            count = _write_batches(out / file_name, _vector_schema(model.dim), vector_batches())
+            if count:
+                manifest_models.append({'name' : model.name, 'dim' : model.dim, 'inline' : False, 'file' : file_name, 'rows' : count})
+            else:
+                (out / file_name).unlink()
+
+    manifest = {
+        'version' : SNAPSHOT_VERSION,
+        'created_at' : datetime.now(timezone.utc).isoformat(),
+        'media_ids' : exported_ids,
+        'documents' : len(exported_ids),
+        'chunks' : chunks,
+        'models' : manifest_models,
+    }
+    (out / 'manifest.json').write_text(json.dumps(manifest, indent = 2, ensure_ascii = False))
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    log.info(f'Exported {len(exported_ids)} documents and {chunks} chunks to {out} in {elapsed_ms / 1000:.1f}s.')
+    return {**manifest, 'elapsed_ms' : elapsed_ms}
+
+
+def _deferrable_indexes(connection) -> List[dict]:
+    # Primary keys and unique indexes stay: the FK checks and ON CONFLICT rely on them.
+    rows = connection.execute(text("""
+        SELECT i.relname AS name, pg_get_indexdef(x.indexrelid) AS definition
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_class t ON t.oid = x.indrelid
+        WHERE t.relname = ANY(:tables) AND NOT x.indisprimary AND NOT x.indisunique
+          AND t.relnamespace = current_schema()::regnamespace
+    """), {'tables' : DEFERRED_INDEX_TABLES}).all()
+    return [{'name' : r.name, 'definition' : r.definition} for r in rows]
+
+
+def _copy_chunks(cursor, path : Path, doc_map : Dict[int, int], write_inline : bool, batch_rows : int) -> int:
+    copied = 0
+    for batch in pq.ParquetFile(path).iter_batches(batch_size = batch_rows):
+        media_ids = batch.column('media_id').to_numpy()
+        keep = np.isin(media_ids, list(doc_map))
+        if not keep.any():
+            continue
+        batch = batch.filter(pa.array(keep))
+        columns = {name : batch.column(name).to_pylist() for name in ('id', 'media_id', 'parent_id', 'chunk_level', 'content', 'chunk_metadata')}
+        if write_inline:
+            matrix, present = _from_vector_array(batch.column('embedding'))
+            vectors = vector_fields(matrix, present)
+        else:
+            vectors = [text_field(None)] * batch.num_rows
+        copied += copy_rows(cursor, 'chunks', ['id', 'content', 'chunk_level', 'chunk_metadata', 'embedding', 'source_doc_id', 'parent_id'], (
+            row(
+                text_field(columns['id'][i]),
+                text_field(columns['content'][i]),
+                text_field(columns['chunk_level'][i]),
+                # Already JSON text in the snapshot.
+                text_field(columns['chunk_metadata'][i]),
+                vectors[i],
+                int4_field(doc_map[columns['media_id'][i]]),
+                text_field(columns['parent_id'][i]),
+            )
+            for i in range(batch.num_rows)
+        ))
+    return copied
+
+
+def _copy_vectors(cursor, path : Path, model_id : int, doc_map : Dict[int, int], batch_rows : int) -> int:
+    copied = 0
+    model_field = int4_field(model_id)
+    for batch in pq.ParquetFile(path).iter_batches(batch_size = batch_rows):
+        keep = np.isin(batch.column('media_id').to_numpy(), list(doc_map))
+        if not keep.any():
+            continue
+        batch = batch.filter(pa.array(keep))
+        chunk_ids = batch.column('chunk_id').to_pylist()
+        matrix, _ = _from_vector_array(batch.column('embedding'))
+        copied += copy_rows(cursor, 'chunk_embeddings', ['chunk_id', 'model_id', 'embedding'], (
+            row(text_field(chunk_id), model_field, vector)
+            for chunk_id, vector in zip(chunk_ids, vector_fields(matrix))
+        ))
+    return copied
+
+
+def _delete_documents(connection, media_ids : List[int]) -> None:
+    # Same order as delete_documents_bulk, but inside the import transaction so a failed load keeps them.
+    doc_ids = select(SourceDocument.id).where(SourceDocument.media_id.in_(media_ids)).scalar_subquery()
+    connection.execute(delete(Chunk).where(Chunk.source_doc_id.in_(doc_ids), Chunk.chunk_level == ChunkLevel.CHILD))
+    connection.execute(delete(Chunk).where(Chunk.source_doc_id.in_(doc_ids)))
+    connection.execute(delete(SourceDocument).where(SourceDocument.media_id.in_(media_ids)))
+
+
+def import_snapshot(in_dir : str, replace : bool = False, defer_indexes : bool = True,
+                    batch_rows : int = SNAPSHOT_BATCH_ROWS, assume_inline_model : bool = False) -> dict:
+    """
+    Loads a snapshot in one transaction. Documents whose media_id already exists are skipped,
+    or deleted first (in the same transaction) with `replace`. Source document ids are reassigned
+    by this database. Uploaded documents (those with a content_hash) get their file_path pointed at
+    this host's object store; the objects themselves are not part of the snapshot. If the snapshot's inline vectors are recorded under another model name than
+    this database's inline model, the import is refused unless `assume_inline_model` says they are
+    the same model (e.g. both registered from different EMBEDDING_MODEL spellings); a different
+    dimension is always refused.
+    With `defer_indexes` the chunk indexes are dropped for the load and rebuilt before commit,
+    which holds an exclusive lock on chunks until then: meant for restores, not a live API.
+    """
+    started = time.perf_counter()
+    src = Path(in_dir)
+    manifest = json.loads((src / 'manifest.json').read_text())
+    if manifest.get('version') not in READABLE_VERSIONS:
+        raise ValueError(f"Unsupported snapshot version {manifest.get('version')}")
+    report = {
+        'documents' : 0, 'skipped_media_ids' : [], 'chunks' : 0, 'vectors' : {}, 'skipped_models' : [],
+        'timings' : {}, 'elapsed_ms' : 0.0
+    }
+    docs = pq.read_table(src / 'source_documents.parquet').to_pylist()
+    store = ObjectStore()
+
+    with SessionLocal() as session:
+        existing = set(session.execute(
+            select(SourceDocument.media_id).where(SourceDocument.media_id.in_([doc['media_id'] for doc in docs]))
+        ).scalars())
+        models = session.execute(select(EmbeddingModel)).scalars().all()
+    if existing and not replace:
+        log.warning(f'Skipping {len(existing)} documents that already exist : {sorted(existing)}')
+        report['skipped_media_ids'] = sorted(existing)
+        docs = [doc for doc in docs if doc['media_id'] not in existing]
+    if not docs:
+        return report
+
+    by_name = {(model.name, model.dim) : model for model in models if not model.inline}
+    inline_target = next((model for model in models if model.inline), None)
+    inline_source = next((entry for entry in manifest['models'] if entry['inline']), {'name' : None, 'dim' : INLINE_DIM})
+    write_inline = inline_target is not None
+    if write_inline:
+        # Vectors from different models are not comparable; mixing them in chunks.embedding would corrupt search,
+        # and importing without them would leave COMPLETED documents that retrieval cannot find.
+        if inline_source['dim'] != inline_target.dim:
+            raise ValueError(f"Snapshot inline vectors have {inline_source['dim']} dimensions, "
+                             f"{inline_target.name} here has {inline_target.dim}")
+        if inline_source['name'] != inline_target.name and not assume_inline_model:
+            raise ValueError(f"Snapshot inline vectors come from {inline_source['name']}, inline vectors here from "
+                             f"{inline_target.name}; pass assume_inline_model (--assume-inline-model) if they are the same model")
+        if inline_source['name'] != inline_target.name:
+            log.warning(f"Importing inline vectors of {inline_source['name']} as {inline_target.name}, as instructed.")
+
+    with engine.begin() as connection:
+        cursor = connection.connection.cursor()
+        if existing and replace:
+            # Before the indexes are dropped: the deletes look chunks up by source_doc_id and parent_id.
+            _delete_documents(connection, sorted(existing))
+        deferred = []
+        if defer_indexes:
+            tick = time.perf_counter()
+            deferred = _deferrable_indexes(connection)
+            for index in deferred:
+                connection.execute(text(f'DROP INDEX "{index["name"]}"'))
+            log.info(f'Deferred {len(deferred)} indexes : {[index["name"] for index in deferred]}')
+            report['timings']['drop_indexes_ms'] = (time.perf_counter() - tick) * 1000
+
+        tick = time.perf_counter()
+        inserted = connection.execute(insert(SourceDocument).returning(SourceDocument.id, SourceDocument.media_id), [
+            {
+                **{key : doc[key] for key in ('media_id', 'file_name', 'page_count', 'created_at', 'processed_at',
+                                              'chunks_embedded', 'chunks_written')},
+                'content_hash' : doc.get('content_hash'),
+                'format' : doc.get('format'),
+                # The source host's object store path means nothing here.
+                'file_path' : store.path(doc['content_hash']) if doc.get('content_hash') else doc['file_path'],
+                'status' : doc['status'],
+                'stage_timings' : json.loads(doc['stage_timings']) if doc['stage_timings'] else None,
+                'centroid' : np.asarray(doc['centroid'], dtype = np.float32) if write_inline and doc['centroid'] is not None else None,
+            }
+            for doc in docs
+        ]).all()
+        doc_map = {r.media_id : r.id for r in inserted}
+        report['documents'] = len(doc_map)
+
+        report['chunks'] = _copy_chunks(cursor, src / 'chunks.parquet', doc_map, write_inline, batch_rows)
+        report['timings']['copy_chunks_ms'] = (time.perf_counter() - tick) * 1000
+
+        tick = time.perf_counter()
+        for entry in manifest['models']:
+            if entry['inline']:
+                continue
+            target = by_name.get((entry['name'], entry['dim']))
+            if target is None:
+                log.warning(f"No embedding model {entry['name']} ({entry['dim']}d) here; its vectors are not imported.")
+                report['skipped_models'].append(entry['name'])
+                continue
+            report['vectors'][entry['name']] = _copy_vectors(cursor, src / entry['file'], target.id, doc_map, batch_rows)
+            build_centroids(connection, ModelRef.of(target), list(doc_map.values()))
+        report['timings']['copy_vectors_ms'] = (time.perf_counter() - tick) * 1000
+
+        tick = time.perf_counter()
+        if deferred:
+            connection.execute(text(f"SET LOCAL maintenance_work_mem = '{SNAPSHOT_MAINTENANCE_WORK_MEM}'"))
+            for index in deferred:
+                connection.execute(text(index['definition']))
+        for table in DEFERRED_INDEX_TABLES:
+            connection.execute(text(f'ANALYZE {table}'))
+        report['timings']['build_indexes_ms'] = (time.perf_counter() - tick) * 1000
+
+    report['elapsed_ms'] = (time.perf_counter() - started) * 1000
+    log.info(f"Imported {report['documents']} documents and {report['chunks']} chunks from {src} "
+             f"in {report['elapsed_ms'] / 1000:.1f}s.")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Export or import Parquet snapshots of processed documents.')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+    parser_export = subparsers.add_parser('export', help = 'Write documents, chunks and vectors to a directory.')
+    parser_export.add_argument('out_dir')
+    parser_export.add_argument('--media_ids', type = int, nargs = '+', help = 'Documents to export (default: all completed).')
+    parser_import = subparsers.add_parser('import', help = 'Bulk-load a snapshot directory into DB_URL.')
+    parser_import.add_argument('in_dir')
+    parser_import.add_argument('--replace', action = 'store_true', help = 'Replace documents that already exist.')
+    parser_import.add_argument('--keep-indexes', action = 'store_true', help = 'Load with indexes in place (slower, no exclusive lock).')
+    parser_import.add_argument('--assume-inline-model', action = 'store_true',
+                               help = "Load inline vectors recorded under another model name as this database's inline model.")
+    parser.add_argument('--batch_rows', type = int, default = SNAPSHOT_BATCH_ROWS)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        result = export_snapshot(args.out_dir, args.media_ids, args.batch_rows)
+    else:
+        result = import_snapshot(args.in_dir, args.replace, not args.keep_indexes, args.batch_rows, args.assume_inline_model)
+    print(json.dumps(result, indent = 2, ensure_ascii = False, default = str))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import os
+import json
+import logging
+import threading
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+STAGING_REDIS_URL = os.getenv("STAGING_REDIS_URL", os.getenv("REDIS_URL"))
+# Must outlast the queue wait between two stages; every stash refreshes it.
+STAGING_TTL = int(os.getenv("STAGING_TTL", 24 * 3600))
+STAGING_PREFIX = "ingest:staged:"
+# Payload fields kept in Redis between stages instead of travelling as task results and arguments.
+STAGED_FIELDS = ('chunks', 'vectors')
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import redis
+                _client = redis.from_url(STAGING_REDIS_URL)
+    return _client
+
+
+def _key(source_doc_id : int) -> str:
+    return f"{STAGING_PREFIX}{source_doc_id}"
+
+
+def stash(payload : Optional[dict], *fields : str) -> Optional[dict]:
+    """
+    Stores `fields` of a stage payload in a Redis hash and returns the payload without any staged
+    field, plus a 'staged' key for the next stage. That small dict is all that goes through the
+    result backend and the next task's arguments.
+    """
+    if not payload:
+        return payload
+    key = _key(payload['source_doc_id'])
+    with get_client().pipeline(transaction = True) as pipe:
+        pipe.hset(key, mapping = {field : json.dumps(payload[field], ensure_ascii = False) for field in fields})
+        pipe.expire(key, STAGING_TTL)
+        pipe.execute()
+    return {
+        **{name : value for name, value in payload.items() if name not in STAGED_FIELDS},
+        'staged' : key
+    }
+
+
+def restore(summary : Optional[dict], *fields : str) -> Optional[dict]:
+    """The full payload behind a stashed summary, or None when it has expired (the document is marked FAILED)."""
+    if not summary:
+        return summary
+    values = get_client().hmget(summary['staged'], fields)
+    if any(value is None for value in values):
+        from .processing import mark_failed
+        log.error(f"Staged {fields} for M_ID {summary['media_id']} expired or missing ({summary['staged']})")
+        mark_failed(summary['source_doc_id'])
+        return None
+    payload = {name : value for name, value in summary.items() if name != 'staged'}
+    return {**payload, **{field : json.loads(value) for field, value in zip(fields, values)}}
+
+
+def drop(summary : Optional[dict]) -> None:
+    if summary:
+        get_client().delete(summary['staged'])
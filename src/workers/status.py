@@ -0,0 +1,78 @@
+from typing import List, Optional
+from celery.result import AsyncResult
+from sqlalchemy import select
+
+from src.core.database import AsyncSessionLocal
+from src.models.source_documents import SourceDocument
+from src.models.embedding_models import EmbeddingModel, EmbeddingModelStatus
+from .celery_app import celery_app
+
+
+def _serialize(value):
+    if isinstance(value, BaseException):
+        return {'error' : type(value).__name__, 'detail' : str(value)}
+    return value
+
+
+def task_status(task_id : str) -> dict:
+    result = AsyncResult(task_id, app = celery_app)
+    state = result.state
+    return {
+        'task_id' : task_id,
+        'state' : state,
+        # PROGRESS meta while running, the return value once finished, the exception on failure.
+        'info' : _serialize(result.info),
+        'ready' : result.ready(),
+    }
+
+
+def _document_status(doc : SourceDocument) -> dict:
+    return {
+        'media_id' : doc.media_id,
+        'file_name' : doc.file_name,
+        'status' : doc.status.value,
+        'pages_parsed' : doc.page_count,
+        'chunks_embedded' : doc.chunks_embedded,
+        'chunks_written' : doc.chunks_written,
+        'stage_timings' : doc.stage_timings or {},
+        'created_at' : doc.created_at,
+        'processed_at' : doc.processed_at,
+    }
+
+
+async def documents_status(media_ids : List[int]) -> List[dict]:
+    async with AsyncSessionLocal() as asession:
+        stmt = select(SourceDocument).where(SourceDocument.media_id.in_(media_ids))
+        docs = (await asession.execute(stmt)).scalars().all()
+    found = {doc.media_id : _document_status(doc) for doc in docs}
+    return [found.get(media_id, {'media_id' : media_id, 'status' : 'NOT_FOUND'}) for media_id in media_ids]
+
+
+async def document_status(media_id : int) -> Optional[dict]:
+    status = (await documents_status([media_id]))[0]
+    return None if status['status'] == 'NOT_FOUND' else status
+
+
+def _embedding_model_status(model : EmbeddingModel) -> dict:
+    remaining = max(model.chunks_total - model.chunks_done, 0)
+    building = model.status == EmbeddingModelStatus.BUILDING
+    return {
+        'id' : model.id,
+        'name' : model.name,
+        'dim' : model.dim,
+        'status' : model.status.value,
+        'chunks_total' : model.chunks_total,
+        'chunks_done' : model.chunks_done,
+        'percent' : round(min(100.0, 100.0 * model.chunks_done / model.chunks_total), 1) if model.chunks_total else 100.0,
+        'chunks_per_second' : model.chunks_per_second,
+        'eta_seconds' : round(remaining / model.chunks_per_second) if building and model.chunks_per_second else None,
+        'error' : model.error,
+        'created_at' : model.created_at,
+        'activated_at' : model.activated_at,
+    }
+
+
+async def embedding_models_status() -> List[dict]:
+    async with AsyncSessionLocal() as asession:
+        models = (await asession.execute(select(EmbeddingModel).order_by(EmbeddingModel.id))).scalars().all()
+    return [_embedding_model_status(model) for model in models]
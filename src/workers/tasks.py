@@ -1,18 +1,122 @@
+from celery import chain, chord, group
 from .celery_app import celery_app
-from .processing import process_document
-from .delete_documents import delete_documents
+from .processing import process_document, parse_document, embed_chunks, write_chunks
+from . import staging
+from .delete_documents import delete_documents, delete_documents_bulk
+from .reembed import reembed_corpus, start_reembedding
 import logging
 logging.basicConfig(
     level = logging.INFO,
     format = '%(asctime)s - %(levelname)s - %(message)s'
 )
+def _reporter(task):
+    def report(stage : str, meta : dict):
+        task.update_state(state = 'PROGRESS', meta = {'stage' : stage, **meta})
+    return report
+
+@celery_app.task(bind = True)
+def process_document_task(self, file_name : str, media_id: int, format : str = 'pdf', content_hash : str = None):
+    logging.info(f'Processing task started for {file_name} (M_ID : {media_id})')
+    return process_document(file_name = file_name, media_id = media_id, format = format, progress = _reporter(self),
+                            content_hash = content_hash)
+
+@celery_app.task(bind = True)
+def parse_document_task(self, file_name : str, media_id : int, format : str = 'pdf', content_hash : str = None):
+    payload = parse_document(file_name = file_name, media_id = media_id, format = format, progress = _reporter(self),
+                             content_hash = content_hash)
+    return staging.stash(payload, 'chunks')
+
+# The chain stages hand each other a summary with a 'staged' Redis key; chunk text and vectors
+# never pass through the result backend or the next task's arguments.
+@celery_app.task(bind = True)
+def embed_chunks_task(self, summary : dict):
+    payload = embed_chunks(staging.restore(summary, 'chunks'), progress = _reporter(self))
+    if not payload:
+        staging.drop(summary)
+    return staging.stash(payload, 'vectors')
+
+@celery_app.task(bind = True)
+def write_chunks_task(self, summary : dict):
+    result = write_chunks(staging.restore(summary, 'chunks', 'vectors'), progress = _reporter(self))
+    staging.drop(summary)
+    return result
+
 @celery_app.task
-def process_document_task(file_name : str, media_id: int, format : str = 'pdf'):
-    process_document(file_name = file_name, media_id = media_id, format = format)
-    return logging.info(f'Processing task started for {file_name} (M_ID : {media_id})')
+def summarize_batch_task(results : list, documents : list):
+    written = [r for r in results if r]
+    summary = {
+        'total' : len(documents),
+        'completed' : len(written),
+        'skipped_or_failed' : [d['media_id'] for d in documents if d['media_id'] not in {r['media_id'] for r in written}],
+        'pages' : sum(r['pages'] for r in written),
+        'chunks' : sum(r['chunks'] for r in written)
+    }
+    logging.info(f'Batch ingestion finished : {summary}')
+    return summary
+
+def ingest_chain(file_name : str, media_id : int, format : str = 'pdf', content_hash : str = None):
+    """
+    One document as parse -> embed -> write on their own queues, so only the embed workers
+    ever load the embedding model. The chain's result (the write task) returns what
+    process_document would.
+    """
+    return chain(
+        parse_document_task.s(file_name = file_name, media_id = media_id, format = format, content_hash = content_hash),
+        embed_chunks_task.s(),
+        write_chunks_task.s()
+    )
+
+def start_ingest(file_name : str, media_id : int, format : str = 'pdf', content_hash : str = None):
+    return ingest_chain(file_name, media_id, format, content_hash).apply_async()
+
+def ingest_batch(documents : list):
+    """
+    Fans documents out as parse -> embed -> write chains, one per document, and
+    summarizes them in a chord callback. Returns (group result, callback result).
+    """
+    header = group(
+        ingest_chain(d['file_name'], d['media_id'], d.get('format', 'pdf'), d.get('content_hash'))
+        for d in documents
+    )
+    callback = chord(header)(summarize_batch_task.s(documents = documents))
+    group_result = callback.parent
+    group_result.save()
+    return group_result, callback
+
+def batch_progress(batch_id : str) -> dict:
+    group_result = celery_app.GroupResult.restore(batch_id)
+    if group_result is None:
+        return None
+    stages = {'parsed' : 0, 'embedded' : 0, 'written' : 0, 'failed' : 0}
+    for write_result in group_result.results:
+        embed_result = write_result.parent
+        parse_result = embed_result.parent if embed_result is not None else None
+        for name, result in [('parsed', parse_result), ('embedded', embed_result), ('written', write_result)]:
+            if result is not None and result.successful() and result.result:
+                stages[name] += 1
+        # Stages return None for skipped or failed documents instead of raising, so the chord callback still runs.
+        if write_result.failed() or (write_result.successful() and not write_result.result):
+            stages['failed'] += 1
+    return {
+        'batch_id' : batch_id,
+        'total' : len(group_result.results),
+        **stages,
+        'finished' : group_result.ready()
+    }
 
 @celery_app.task
 def delete_document_task(media_id : int):
-    delete_documents(media_id = media_id)
-    return logging.info(f"Deleting task started for file with M_ID : {media_id}")
+    logging.info(f"Deleting task started for file with M_ID : {media_id}")
+    return delete_documents(media_id = media_id)
+
+@celery_app.task
+def delete_documents_batch_task(media_ids : list[int]):
+    logging.info(f"Batch deleting task started for M_IDs : {media_ids}")
+    return delete_documents_bulk(media_ids = media_ids)
 
+@celery_app.task(bind = True)
+def reembed_corpus_task(self, model_name : str, batch_size : int = 256, activate : bool = False):
+    logging.info(f"Re-embedding task started for embedding model {model_name}")
+    # Registered here rather than in the API so only the embed workers ever load the new model.
+    model = start_reembedding(model_name)
+    return reembed_corpus(model_id = model['model_id'], batch_size = batch_size, activate = activate, progress = _reporter(self))